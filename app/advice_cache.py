@@ -0,0 +1,68 @@
+
+import hashlib
+import json
+import time
+from typing import Any, Dict, Hashable
+
+from app import ledger
+from app.cache import LRUCache
+from app.config import settings
+
+
+class AdviceCache:
+    """Memoized `generate_recommendations` results.
+
+    Entries are keyed by (account, ledger version, risk profile, hash of the request inputs,
+    price time bucket). The ledger version is the id of the account's newest transaction, so
+    a new ledger row makes old entries unreachable; they are also dropped right away by the
+    ledger commit hook. Bounded by entry count and approximate serialized size.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, price_bucket_seconds: float):
+        self.price_bucket_seconds = price_bucket_seconds
+        self._by_account: Dict[str, set] = {}
+        self._lru = LRUCache(max_size=max_entries, max_bytes=max_bytes, on_evict=self._forget)
+
+    def key(self, account_id: str, ledger_version: int | None, risk_profile: str, inputs: Dict[str, Any]) -> tuple:
+        digest = hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+        price_bucket = int(time.time() // self.price_bucket_seconds) if self.price_bucket_seconds > 0 else 0
+        return (account_id, ledger_version, (risk_profile or "balanced").lower(), digest, price_bucket)
+
+    def get(self, key: tuple) -> Dict[str, Any] | None:
+        return self._lru.get(key)
+
+    def set(self, key: tuple, advice: Dict[str, Any]):
+        size = len(json.dumps(advice, default=str))
+        self._lru.set(key, advice, size=size)
+        self._by_account.setdefault(key[0], set()).add(key)
+
+    def invalidate_account(self, account_id: str):
+        for key in self._by_account.pop(account_id, ()):
+            self._lru.pop(key)
+
+    def _forget(self, key: Hashable, _value: Any):
+        keys = self._by_account.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_account[key[0]]
+
+    def clear(self):
+        self._lru.clear()
+        self._by_account.clear()
+
+    def stats(self) -> dict:
+        return {**self._lru.stats(), "accounts": len(self._by_account)}
+
+
+advice_cache = AdviceCache(
+    max_entries=settings.advice_cache_max_entries,
+    max_bytes=settings.advice_cache_max_bytes,
+    price_bucket_seconds=settings.advice_cache_price_bucket_seconds,
+)
+
+
+@ledger.on_commit
+def _invalidate(changes: dict):
+    for account_id in changes:
+        advice_cache.invalidate_account(account_id)
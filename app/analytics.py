@@ -0,0 +1,296 @@
+
+"""Columnar spending analytics over an account's ledger.
+
+Every figure the advisor needs (monthly income/expense estimates, "gastos hormiga", category
+buckets, recurring deposits and rolling averages of the monthly net flow) is derived from
+per-(description, month) aggregates, `LedgerCells`. For a stored ledger, `load_cells` reads
+them from the `LedgerMonth` totals that `app.ledger` keeps on every write, so the cost does not
+grow with the history; client-supplied transactions are aggregated in NumPy (`LedgerColumns`).
+`analyze` accepts either.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import LedgerMonth, LocalTransaction
+
+# Expenses at or below this amount count as "gastos hormiga"
+SMALL_EXPENSE_LIMIT = 20.0
+# Months (ending at the newest transaction) used for the monthly estimates
+ESTIMATE_MONTHS = 6
+# Window of days (ending at the newest transaction) used for "gastos hormiga"
+HORMIGA_DAYS = 30
+# A deposit description seen in at least this many distinct months is recurring
+RECURRING_MIN_MONTHS = 2
+ROLLING_WINDOW = 3
+_US_PER_DAY = 86_400_000_000
+
+# Keyword rules; descriptions are matched lower-cased
+CATEGORY_RULES: List[tuple[str, tuple[str, ...]]] = [
+    ("saldo_inicial", ("initial balance",)),
+    ("nomina", ("payroll", "salary", "paycheck", "nómina", "nomina", "sueldo")),
+    ("inversiones", ("gemini ", "demo buy", "demo sell", "trade")),
+    ("transferencias", ("transfer",)),
+    ("comida", ("starbucks", "restaurant", "restaurante", "cafe", "café", "food", "comida", "oxxo", "super")),
+    ("transporte", ("uber", "didi", "taxi", "gas", "gasolina", "metro")),
+    ("servicios", ("netflix", "spotify", "cfe", "telmex", "internet", "renta", "rent")),
+]
+OTHER_CATEGORY = "otros"
+CATEGORIES = [name for name, _ in CATEGORY_RULES] + [OTHER_CATEGORY]
+_INCOME_EXCLUDED = ("saldo_inicial", "transferencias", "inversiones")
+
+
+@dataclass
+class LedgerColumns:
+    amounts: np.ndarray        # float64
+    timestamps: np.ndarray     # datetime64[us]
+    codes: np.ndarray          # int32 index into `descriptions`
+    descriptions: List[str]    # distinct descriptions
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+
+# one alternation with a named group per category; the leftmost match decides
+_CATEGORY_RE = re.compile("|".join(
+    f"(?P<c{i}>{'|'.join(re.escape(k) for k in keywords)})" for i, (_, keywords) in enumerate(CATEGORY_RULES)
+))
+
+
+def _categorize(description: str) -> int:
+    m = _CATEGORY_RE.search(description.lower())
+    return int(m.lastgroup[1:]) if m else len(CATEGORY_RULES)
+
+
+def _parse_timestamps(values: List[str]) -> np.ndarray:
+    try:
+        return np.array(values, dtype="datetime64[us]")
+    except ValueError:
+        # e.g. "Z" or "+02:00" suffixes from clients: normalise to naive UTC one by one
+        parsed = []
+        for v in values:
+            dt = datetime.fromisoformat(v)
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+            parsed.append(dt.isoformat())
+        return np.array(parsed, dtype="datetime64[us]")
+
+
+def build_columns(amounts, timestamps, descriptions) -> LedgerColumns:
+    """Build columns from parallel sequences; timestamps may be datetimes or ISO strings."""
+    index: Dict[str, int] = {}
+    codes = np.fromiter((index.setdefault(d or "", len(index)) for d in descriptions), dtype=np.int32, count=len(descriptions))
+    ts = _parse_timestamps([t if isinstance(t, str) else t.isoformat() for t in timestamps])
+    return LedgerColumns(
+        amounts=np.asarray(amounts, dtype=np.float64),
+        timestamps=ts,
+        codes=codes,
+        descriptions=list(index),
+    )
+
+
+def columns_from_transactions(txs: List[Dict[str, Any]]) -> LedgerColumns:
+    """Columns for client-supplied transaction dicts ({amount, description, created_at}).
+
+    Rows without created_at are taken as happening now.
+    """
+    now = datetime.utcnow().isoformat()
+    return build_columns(
+        [float(tx.get("amount") or 0.0) for tx in txs],
+        [str(tx.get("created_at") or now) for tx in txs],
+        [str(tx.get("description") or "") for tx in txs],
+    )
+
+
+@dataclass
+class LedgerCells:
+    """Credits, debits and row counts per (description, month) cell, plus the gastos hormiga
+    window (the last HORMIGA_DAYS days up to the newest transaction)."""
+    descriptions: List[str]    # distinct descriptions
+    cell_desc: np.ndarray      # intp index into `descriptions`
+    cell_month: np.ndarray     # intp month index, 0 = first_month
+    credit: np.ndarray         # float64
+    debit: np.ndarray          # float64, positive
+    count: np.ndarray          # int64
+    first_month: np.datetime64  # datetime64[M]
+    span: int                  # months from the oldest to the newest transaction
+    transaction_count: int
+    small_count: int
+    small_total: float
+
+
+def cells_from_columns(cols: LedgerColumns) -> LedgerCells | None:
+    """Aggregate row columns into cells in one vectorized pass (None for no rows)."""
+    n = len(cols)
+    if n == 0:
+        return None
+    amounts = cols.amounts
+    n_desc = len(cols.descriptions)
+
+    # calendar month of each row as an index from the oldest month (0) to the newest
+    # (span - 1), via a per-day lookup table instead of datetime64[M] casts
+    days = cols.timestamps.view(np.int64) // _US_PER_DAY
+    first_day, last_day = int(days.min()), int(days.max())
+    first_month = np.datetime64(first_day, "D").astype("datetime64[M]")
+    last_month = np.datetime64(last_day, "D").astype("datetime64[M]")
+    month_starts = np.arange(first_month, last_month + 1).astype("datetime64[D]").astype(np.int64)
+    span = len(month_starts)
+    day_to_month = np.searchsorted(month_starts, np.arange(first_day, last_day + 1), side="right") - 1
+    month_idx = day_to_month[days - first_day]
+
+    cell = cols.codes.astype(np.intp) * span + month_idx
+    if n_desc * span <= 4 * n:
+        n_cells = n_desc * span
+        cell_desc, cell_month = np.divmod(np.arange(n_cells), span)
+    else:
+        # too many distinct descriptions for a dense grid: compact the occupied cells
+        occupied, cell = np.unique(cell, return_inverse=True)
+        n_cells = len(occupied)
+        cell_desc, cell_month = np.divmod(occupied, span)
+
+    # gastos hormiga over the last HORMIGA_DAYS days
+    small = (amounts < 0) & (amounts > -SMALL_EXPENSE_LIMIT) & (days > last_day - HORMIGA_DAYS)
+    return LedgerCells(
+        descriptions=cols.descriptions,
+        cell_desc=cell_desc,
+        cell_month=cell_month,
+        credit=np.bincount(cell, weights=np.maximum(amounts, 0.0), minlength=n_cells),
+        debit=-np.bincount(cell, weights=np.minimum(amounts, 0.0), minlength=n_cells) + 0.0,
+        count=np.bincount(cell, minlength=n_cells),
+        first_month=first_month,
+        span=span,
+        transaction_count=n,
+        small_count=int(np.count_nonzero(small)),
+        small_total=float(-amounts[small].sum()) + 0.0,
+    )
+
+
+async def load_cells(session: AsyncSession, account_id: str) -> LedgerCells | None:
+    """Read an account's cells from its `LedgerMonth` totals (None for an empty ledger).
+
+    The totals are kept by `app.ledger` on every write, so this reads one row per description
+    and month plus the rows of the gastos hormiga window, however long the history is.
+    """
+    amount, created_at = LocalTransaction.amount, LocalTransaction.created_at
+    of_account = LocalTransaction.account_id == account_id
+    last = (await session.execute(select(func.max(created_at)).where(of_account))).scalar_one_or_none()
+    if last is None:
+        return None
+
+    rows = (await session.execute(
+        select(LedgerMonth.description, LedgerMonth.month, LedgerMonth.credit, LedgerMonth.debit, LedgerMonth.count)
+        .where(LedgerMonth.account_id == account_id)
+    )).all()
+    if not rows:
+        return None
+
+    # the same window as cells_from_columns: from the start of the day HORMIGA_DAYS - 1 days
+    # before the newest transaction
+    since = datetime.combine(last.date(), time()) - timedelta(days=HORMIGA_DAYS - 1)
+    small_count, small_total = (await session.execute(
+        select(func.count(), func.coalesce(func.sum(-amount), 0.0))
+        .where(of_account, amount < 0, amount > -SMALL_EXPENSE_LIMIT, created_at >= since)
+    )).one()
+
+    index: Dict[str, int] = {}
+    cell_desc = np.fromiter((index.setdefault(d, len(index)) for d, *_ in rows), dtype=np.intp, count=len(rows))
+    months = np.array([m for _, m, *_ in rows], dtype="datetime64[M]")
+    first_month = months.min()
+    count = np.fromiter((c for *_, c in rows), dtype=np.int64, count=len(rows))
+    return LedgerCells(
+        descriptions=list(index),
+        cell_desc=cell_desc,
+        cell_month=(months - first_month).astype(np.intp),
+        credit=np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows)),
+        debit=np.fromiter((r[3] for r in rows), dtype=np.float64, count=len(rows)),
+        count=count,
+        first_month=first_month,
+        span=int((months.max() - first_month).astype(int)) + 1,
+        transaction_count=int(count.sum()),
+        small_count=int(small_count),
+        small_total=float(small_total) + 0.0,
+    )
+
+
+def analyze(data: "LedgerColumns | LedgerCells | None") -> Dict[str, Any]:
+    """Compute the advisor's spending figures from ledger columns or cells, as of the newest
+    transaction."""
+    cells = cells_from_columns(data) if isinstance(data, LedgerColumns) else data
+    empty = {
+        "transaction_count": 0,
+        "monthly_income": 0.0,
+        "monthly_expenses": 0.0,
+        "months_observed": 0,
+        "small_expenses": {"count": 0, "total": 0.0, "days": HORMIGA_DAYS},
+        "categories": {},
+        "recurring_deposits": [],
+        "has_payroll": False,
+        "monthly": [],
+    }
+    if cells is None or cells.transaction_count == 0:
+        return empty
+
+    n_desc = len(cells.descriptions)
+    n_cat = len(CATEGORIES)
+    desc_category = np.fromiter((_categorize(d) for d in cells.descriptions), dtype=np.intp, count=n_desc)
+    excluded_lut = np.zeros(n_cat, dtype=bool)
+    excluded_lut[[CATEGORIES.index(c) for c in _INCOME_EXCLUDED]] = True
+
+    span = cells.span
+    last_month = cells.first_month + (span - 1)
+    cell_desc, cell_month = cells.cell_desc, cells.cell_month
+    credit, debit, count = cells.credit, cells.debit, cells.count
+    cell_category = desc_category[cell_desc]
+    cell_flow = ~excluded_lut[cell_category]
+
+    # monthly series over the estimate window, oldest -> newest
+    months_observed = min(ESTIMATE_MONTHS, span)
+    income_series = np.bincount(cell_month, weights=credit * cell_flow, minlength=span)[-months_observed:]
+    expense_series = np.bincount(cell_month, weights=debit * cell_flow, minlength=span)[-months_observed:]
+    net_series = income_series - expense_series
+    rolling = np.convolve(net_series, np.ones(ROLLING_WINDOW))[:months_observed] / np.minimum(np.arange(1, months_observed + 1), ROLLING_WINDOW)
+    month_labels = np.arange(last_month - months_observed + 1, last_month + 1).astype(str)
+
+    # category buckets (all history): totals in and out
+    cat_in = np.bincount(cell_category, weights=credit, minlength=n_cat)
+    cat_out = np.bincount(cell_category, weights=debit, minlength=n_cat)
+    cat_count = np.bincount(cell_category, weights=count, minlength=n_cat).astype(np.int64)
+    categories = {
+        CATEGORIES[i]: {"count": int(cat_count[i]), "income": round(float(cat_in[i]), 2), "expenses": round(float(cat_out[i]), 2)}
+        for i in np.flatnonzero(cat_count)
+    }
+
+    # recurring deposits: same description credited in >= RECURRING_MIN_MONTHS distinct months
+    deposit_cells = (credit > 0) & cell_flow
+    months_per_desc = np.bincount(cell_desc[deposit_cells], minlength=n_desc)
+    credit_per_desc = np.bincount(cell_desc[deposit_cells], weights=credit[deposit_cells], minlength=n_desc)
+    recurring = [
+        {
+            "description": cells.descriptions[code],
+            "months": int(months_per_desc[code]),
+            "average_monthly_amount": round(float(credit_per_desc[code] / months_per_desc[code]), 2),
+        }
+        for code in np.flatnonzero(months_per_desc >= RECURRING_MIN_MONTHS)
+    ]
+    recurring.sort(key=lambda r: r["months"], reverse=True)
+
+    payroll = CATEGORIES.index("nomina")
+    return {
+        "transaction_count": cells.transaction_count,
+        "monthly_income": round(float(income_series.sum() / months_observed), 2),
+        "monthly_expenses": round(float(expense_series.sum() / months_observed), 2),
+        "months_observed": months_observed,
+        "small_expenses": {"count": cells.small_count, "total": round(cells.small_total, 2), "days": HORMIGA_DAYS},
+        "categories": categories,
+        "recurring_deposits": recurring,
+        "has_payroll": bool(cat_count[payroll]),
+        "monthly": [
+            {"month": str(m), "income": round(float(i), 2), "expenses": round(float(e), 2), "net": round(float(t), 2), "rolling_net": round(float(r), 2)}
+            for m, i, e, t, r in zip(month_labels, income_series, expense_series, net_series, rolling)
+        ],
+    }
@@ -0,0 +1,96 @@
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """Small in-process LRU cache with per-entry TTL and hit/miss counters.
+
+    Optionally bounded by total size as well: pass `max_bytes` and give each `set` the
+    entry's approximate size. `on_evict(key, value)` is called for entries dropped by the
+    size limits or expiry (not for explicit `pop`/`clear`).
+
+    Not thread-safe; meant to be used from the event loop only.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float | None = None,
+        max_bytes: int | None = None,
+        on_evict: Callable[[Hashable, Any], None] | None = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, tuple[float, int, Any]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, _, value = entry
+        if expires_at and expires_at < time.monotonic():
+            self._remove(key)
+            if self.on_evict:
+                self.on_evict(key, value)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None, size: int = 0):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0.0
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (expires_at, size, value)
+        self.bytes += size
+        while self._data and (
+            len(self._data) > self.max_size
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            old_key, (_, old_size, old_value) = self._data.popitem(last=False)
+            self.bytes -= old_size
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        return self._remove(key)
+
+    def _remove(self, key: Hashable) -> Any:
+        _, size, value = self._data.pop(key)
+        self.bytes -= size
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        out = {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+        if self.max_bytes is not None:
+            out.update({"bytes": self.bytes, "max_bytes": self.max_bytes})
+        return out
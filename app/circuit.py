@@ -0,0 +1,138 @@
+
+"""Circuit breaker with a latency-derived timeout, one per upstream (see app/upstream.py).
+
+closed     calls go through; outcomes land in a rolling window. When at least `min_calls`
+           are recorded and `failure_rate` of them failed, the circuit opens.
+open       calls are rejected at once with `CircuitOpenError` (callers fall back to demo
+           data) until `open_seconds` have passed.
+half_open  up to `half_open_calls` probe calls go through; a success closes the circuit,
+           a failure opens it again.
+
+The adaptive timeout is `timeout_multiplier` × the p99 latency of recent successful calls,
+kept between `min_timeout` and the caller's hard timeout, so a slow upstream is given up on
+long before e.g. the 20 s Nessie timeout.
+"""
+import time
+from collections import deque
+
+import httpx
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+# latency samples needed before the adaptive timeout kicks in
+MIN_LATENCY_SAMPLES = 10
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        open_seconds: float = 15.0,
+        half_open_calls: int = 1,
+        timeout_multiplier: float = 3.0,
+        min_timeout: float = 0.5,
+        latency_samples: int = 100,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.state = CLOSED
+        self._outcomes: deque[bool] = deque(maxlen=window)   # True = failure
+        self._latencies: deque[float] = deque(maxlen=latency_samples)
+        self._p99: float | None = None
+        self._opened_at = 0.0
+        self._probes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; a True in half-open takes a probe slot."""
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self._probes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                self.rejected += 1
+                return False
+            self._probes += 1
+        return True
+
+    def record_success(self, latency: float):
+        self._latencies.append(latency)
+        self._p99 = None
+        if self.state == HALF_OPEN:
+            self._close()
+            return
+        self._outcomes.append(False)
+
+    def record_failure(self):
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(True)
+        if len(self._outcomes) >= self.min_calls and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+            self._open()
+
+    def record_abandoned(self):
+        """The call was cancelled before an outcome: give back its half-open probe slot."""
+        if self.state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def timeout(self, hard_timeout: float | None) -> float | None:
+        """Deadline for the next call: adaptive once enough latencies are known, never above `hard_timeout`.
+
+        Half-open probes get the full timeout, so an upstream that recovered but is now
+        slower than before can still close the circuit (and reset the estimate).
+        """
+        if len(self._latencies) < MIN_LATENCY_SAMPLES or self.state == HALF_OPEN:
+            return hard_timeout
+        if self._p99 is None:
+            ordered = sorted(self._latencies)
+            self._p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+        adaptive = max(self.min_timeout, self._p99 * self.timeout_multiplier)
+        return adaptive if hard_timeout is None else min(adaptive, hard_timeout)
+
+    def reset(self):
+        self._close()
+        self._latencies.clear()
+        self._p99 = None
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+
+    def _close(self):
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._probes = 0
+
+    def stats(self) -> dict:
+        failures = sum(self._outcomes)
+        out = {
+            "state": self.state,
+            "window_calls": len(self._outcomes),
+            "window_failures": failures,
+            "failure_rate": round(failures / len(self._outcomes), 3) if self._outcomes else 0.0,
+            "adaptive_timeout_s": None,
+            "times_opened": self.opened,
+            "rejected": self.rejected,
+        }
+        if len(self._latencies) >= MIN_LATENCY_SAMPLES:
+            out["adaptive_timeout_s"] = round(self.timeout(None), 3)
+        if self.state == OPEN:
+            out["retry_in_s"] = round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+        return out
@@ -0,0 +1,64 @@
+"""Conditional requests and compression for the JSON endpoints the dashboard polls.
+
+Responses derived from an account's ledger carry an ETag built from the ledger version (the
+id of the account's newest `LocalTransaction`, see `ledger.get_ledger_state`) plus whatever
+else shapes the body, such as the page requested. A poll that sends it back in If-None-Match
+while nothing changed gets a bodyless 304 before the rows are loaded or serialized.
+
+The tags are weak: the same JSON is sent gzipped or not depending on Accept-Encoding, and
+bodies of at least `settings.response_gzip_min_bytes` are gzipped for clients that accept it.
+"""
+import gzip
+import hashlib
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse, Response
+
+from app.config import settings
+
+# browsers keep the response but revalidate it on every use; never stored by shared caches
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag(*parts) -> str:
+    """A weak ETag for the given parts (e.g. route name, account id, ledger version)."""
+    return f'W/"{hashlib.sha1(repr(parts).encode()).hexdigest()[:20]}"'
+
+
+def _matches(header: str, tag: str) -> bool:
+    # If-None-Match uses the weak comparison: W/"x" matches "x"
+    opaque = tag.removeprefix("W/")
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == opaque for t in tags)
+
+
+def _accepts_gzip(header: str) -> bool:
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            q = params.strip()
+            return not (q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"))
+    return False
+
+
+def not_modified(request: Request, tag: str) -> Response | None:
+    """A 304 response if the request's If-None-Match matches `tag`, else None."""
+    header = request.headers.get("if-none-match")
+    if header is None or not _matches(header, tag):
+        return None
+    return Response(status_code=304, headers={"ETag": tag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"})
+
+
+def json_response(request: Request, content, tag: str | None = None) -> JSONResponse:
+    """Render `content` as JSON with `tag` as its ETag, gzipped when large and accepted."""
+    response = JSONResponse(jsonable_encoder(content))
+    if tag is not None:
+        response.headers["ETag"] = tag
+        response.headers["Cache-Control"] = CACHE_CONTROL
+    response.headers["Vary"] = "Accept-Encoding"
+    if len(response.body) >= settings.response_gzip_min_bytes and _accepts_gzip(request.headers.get("accept-encoding", "")):
+        response.body = gzip.compress(response.body, compresslevel=settings.response_gzip_level)
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Content-Length"] = str(len(response.body))
+    return response
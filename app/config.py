@@ -13,9 +13,97 @@ class Settings(BaseSettings):
     # App
     secret_key: str = "cambia-esto-por-un-valor-largo-aleatorio"
     access_token_expire_minutes: int = 120
+    # Authenticated-user cache in get_current_user (see app/security.py)
+    auth_cache_max_users: int = 10000
+    auth_cache_ttl_seconds: float = 60.0
+    # Password hashing runs in a thread pool; beyond workers + max_queue pending calls we answer 503
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 64
+    # Token for the operator endpoints (X-Admin-Token header); empty = those endpoints are closed
+    admin_token: str = ""
+
+    # Rate limits per user (per client IP for login), see app/ratelimit.py: "requests/seconds"
+    # allows a burst of `requests`, refilled evenly over `seconds`; "" disables a limit.
+    # A /nessie/transactions page costs one token per 50 rows requested.
+    rate_limit_enabled: bool = True
+    rate_limit_login: str = "10/60"
+    rate_limit_advise: str = "30/60"
+    rate_limit_trade: str = "30/60"
+    rate_limit_projections: str = "20/60"
+    rate_limit_transactions: str = "240/60"
+    # Load shedding per worker: at most max_concurrency requests run at once, others queue; a
+    # request that would wait more than max_wait_ms, or finds max_queue waiting, gets a 503
+    load_shed_enabled: bool = True
+    load_shed_max_concurrency: int = 100
+    load_shed_max_queue: int = 500
+    load_shed_max_wait_ms: float = 1000.0
+
+    # Prometheus metrics at /metrics; Server-Timing adds a db/upstream/app breakdown to every response
+    metrics_enabled: bool = True
+    metrics_server_timing: bool = True
+
+    # State shared by worker processes (see app/store.py): "memory" for a single process, or
+    # "sqlite:///path" for several workers on one host; messages are polled every poll seconds
+    shared_store: str = "memory"
+    shared_store_poll_seconds: float = 0.05
 
     # DB
     database_url: str = f"sqlite+aiosqlite:///{os.path.join(BASE_DIR, 'app.db')}"
+    # Apply pending schema migrations (app/migrations) on startup; set to False to run
+    # `python -m app.migrate` as a deploy step instead (startup then refuses an outdated schema)
+    db_auto_migrate: bool = True
+    # Connection pool for server databases (PostgreSQL/asyncpg), per worker process
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # asyncpg prepared statements cached per connection; 0 disables them (needed behind
+    # pgbouncer in transaction pooling mode)
+    db_statement_cache_size: int = 500
+    # SQLite profile (see app/database.py): "tuned" = WAL + the pragmas below, one serialized
+    # writer connection and a pool of read-only connections; "default" = driver defaults
+    # (rollback journal, a new connection per session). Ignored for other databases.
+    sqlite_profile: str = "tuned"
+    sqlite_read_pool_size: int = 8
+    sqlite_writer_wait_seconds: float = 30.0
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_kib: int = 64 * 1024
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+
+    # Largest page /nessie/transactions will return; bigger limits are clamped
+    transactions_max_page_size: int = 200
+    # /nessie/balance, /nessie/transactions and /gemini/advise send an ETag derived from the ledger
+    # version and answer a matching If-None-Match with 304 (see app/conditional.py); bodies of at
+    # least gzip_min_bytes are gzipped for clients that accept it
+    response_gzip_min_bytes: int = 1024
+    response_gzip_level: int = 6
+    # POST /nessie/transactions/bulk: rows per executemany batch and per request; bodies are
+    # received in full before any insert, in memory up to spool_bytes and on disk beyond
+    bulk_ingest_batch_size: int = 5000
+    bulk_ingest_max_rows: int = 1_000_000
+    bulk_ingest_max_bytes: int = 512 * 1024 * 1024
+    bulk_ingest_spool_bytes: int = 8 * 1024 * 1024
+
+    # GET /nessie/stream (Server-Sent Events): events buffered per subscriber before it is
+    # dropped as a slow consumer, and keep-alive comment interval
+    sse_queue_size: int = 100
+    sse_keepalive_seconds: float = 15.0
+    # Lifetime of the stream-only tokens from POST /nessie/stream/token; EventSource sends them
+    # in the URL, where access logs and proxies keep them
+    stream_token_expire_seconds: int = 60
+
+    # Nessie deposit outbox (see app/outbox.py): rows claimed per batch, concurrent upstream
+    # calls, idle poll interval, retry backoff (doubling from base up to max), attempts before
+    # a row is marked failed, and how long a claimed row is held before another worker may retry it
+    outbox_batch_size: int = 50
+    outbox_concurrency: int = 8
+    outbox_poll_seconds: float = 5.0
+    outbox_backoff_base_seconds: float = 2.0
+    outbox_backoff_max_seconds: float = 300.0
+    outbox_max_attempts: int = 8
+    outbox_lease_seconds: float = 60.0
 
     # Nessie
     nessie_api_key: str = ""  # vacío = DEMO
@@ -28,8 +116,61 @@ class Settings(BaseSettings):
     # If True and gemini_api_key+secret provided, the server will attempt to place real orders
     gemini_execute_trades: bool = False
 
+    # Upstream HTTP clients (shared pools, see app/upstream.py); timeouts in seconds
+    upstream_http2: bool = True
+    upstream_connect_timeout: float = 5.0
+    upstream_keepalive_expiry: float = 30.0
+    nessie_timeout: float = 20.0
+    nessie_max_connections: int = 50
+    nessie_max_keepalive: int = 20
+    gemini_timeout: float = 5.0
+    gemini_order_timeout: float = 10.0
+    gemini_max_connections: int = 50
+    gemini_max_keepalive: int = 20
+    # Circuit breaker per upstream (see app/circuit.py): opens when circuit_failure_rate of the
+    # last circuit_window calls failed (5xx, 429, timeouts, connection errors), rejects calls
+    # for circuit_open_seconds, then lets circuit_half_open_calls probes through
+    circuit_window: int = 20
+    circuit_min_calls: int = 5
+    circuit_failure_rate: float = 0.5
+    circuit_open_seconds: float = 15.0
+    circuit_half_open_calls: int = 1
+    # Adaptive timeout: multiplier x p99 of recent successful calls, at least the minimum and
+    # never above the upstream timeout above
+    adaptive_timeout_multiplier: float = 3.0
+    adaptive_timeout_min_seconds: float = 0.5
+    adaptive_timeout_samples: int = 100
+
+    # Price cache for get_price (see app/price_cache.py)
+    price_cache_ttl_seconds: float = 5.0
+    price_cache_stale_seconds: float = 60.0
+    price_cache_max_symbols: int = 256
+    # comma-separated symbols kept warm by a background task, e.g. "BTCUSD,ETHUSD"; empty = disabled
+    price_hot_symbols: str = ""
+    price_refresh_interval_seconds: float = 4.0
+    # per-call deadline for batched lookups (get_prices); late symbols get a demo fallback
+    price_batch_timeout_seconds: float = 2.0
+
+    # Memoized /gemini/advise results (see app/advice_cache.py); market data in the narrative
+    # is refreshed at most once per price bucket
+    advice_cache_max_entries: int = 5000
+    advice_cache_max_bytes: int = 32 * 1024 * 1024
+    advice_cache_price_bucket_seconds: float = 60.0
+
+    # POST /gemini/projections (see app/projections.py): request limits, and runs of at least
+    # pool_min_cells paths x months go to a pool of projection_workers processes; beyond
+    # workers + max_queue pending runs we answer 503
+    projection_max_paths: int = 50000
+    projection_max_years: int = 50
+    projection_pool_min_cells: int = 500000
+    projection_workers: int = 2
+    projection_max_queue: int = 8
+
     # Frontend (raíz donde están index.html, style.css, etc.)
     frontend_dir: str = os.path.abspath(os.path.join(BASE_DIR, "..", ".."))
+    # Serve it as content-hashed, precompressed copies held in memory (see app/static_assets.py);
+    # False serves the files as they are from disk
+    static_precompressed: bool = True
 
     model_config = SettingsConfigDict(
         env_file=env_path,
@@ -1,17 +1,145 @@
+"""Engine and session setup.
 
+With SQLite and `settings.sqlite_profile == "tuned"` (the default) the database runs in WAL
+mode with the pragmas from Settings, writes go through a single pooled writer connection and
+reads through a pool of read-only connections (`RoutingSession`). Measured with
+`python -m benchmarks.api_load --users 40 --duration 10 --ledger-rows 2000` against the
+"default" profile:
+
+    transfer/trade only          126 -> 204 req/s, p99 4.3 s -> 0.30 s, "database is locked" 10 -> 0
+    mixed reads/writes (4:3)     209 -> 230 req/s, p99 4.0 s -> 0.82 s, read p99 -45..70%
+
+Writes queue for the writer instead of failing, so their median rises (~0.1 s -> ~0.6 s in
+the mixed run) while their tail falls.
+
+Server databases (PostgreSQL through asyncpg; `postgresql://` URLs are switched to the asyncpg
+driver) get a QueuePool sized by the `db_pool_*` settings and a per-connection prepared
+statement cache. The schema is managed by the migrations in app/migrations (app.migrate).
+"""
+import logging
+
+from sqlalchemy import Delete, Insert, Update, event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app import metrics, migrate
 from app.config import settings
 
-engine = create_async_engine(settings.database_url, future=True, echo=False)
-SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+logger = logging.getLogger(__name__)
+
+
+def _async_url(url: str) -> str:
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+DATABASE_URL = _async_url(settings.database_url)
+_is_sqlite = DATABASE_URL.startswith("sqlite")
+_tuned_sqlite = _is_sqlite and settings.sqlite_profile == "tuned" and ":memory:" not in DATABASE_URL
+
+
+def _sqlite_pragmas(query_only: bool):
+    def on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kib)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+    return on_connect
+
+
+if _tuned_sqlite:
+    # One pooled writer connection, so writers queue in the pool instead of failing with
+    # "database is locked", and a pool of read-only connections that WAL lets run alongside it.
+    engine = create_async_engine(
+        DATABASE_URL, future=True, echo=False,
+        poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=settings.sqlite_writer_wait_seconds,
+    )
+    read_engine = create_async_engine(
+        DATABASE_URL, future=True, echo=False,
+        poolclass=AsyncAdaptedQueuePool, pool_size=settings.sqlite_read_pool_size, max_overflow=0,
+    )
+    event.listen(engine.sync_engine, "connect", _sqlite_pragmas(query_only=False))
+    event.listen(read_engine.sync_engine, "connect", _sqlite_pragmas(query_only=True))
+elif _is_sqlite:
+    engine = create_async_engine(DATABASE_URL, future=True, echo=False)
+    read_engine = engine
+else:
+    connect_args = {}
+    if DATABASE_URL.startswith("postgresql+asyncpg"):
+        connect_args = {
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+            "server_settings": {"application_name": "fincoach"},
+        }
+        if settings.db_statement_cache_size == 0:
+            # e.g. behind pgbouncer in transaction mode: no prepared statements at all
+            connect_args["statement_cache_size"] = 0
+    engine = create_async_engine(
+        DATABASE_URL, future=True, echo=False,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args=connect_args,
+    )
+    read_engine = engine
+if settings.metrics_enabled:
+    metrics.instrument_engine(engine)
+    if read_engine is not engine:
+        metrics.instrument_engine(read_engine)
+
+
+# `PoolTimeout` is raised when no connection frees up within the pool timeout (with tuned
+# SQLite: the writer stayed busy for sqlite_writer_wait_seconds); app.main answers it with a 503.
+
+
+class RoutingSession(Session):
+    """Sends reads to `read_engine` and writes to the writer `engine`.
+
+    Once a transaction has written, everything up to its commit/rollback stays on the writer,
+    so it reads its own changes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("writing") or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self.info["writing"] = True
+            return engine.sync_engine
+        return read_engine.sync_engine
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _transaction_ended(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+
+if read_engine is engine:
+    SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+else:
+    SessionLocal = async_sessionmaker(expire_on_commit=False, class_=AsyncSession, sync_session_class=RoutingSession)
 
 class Base(DeclarativeBase):
     pass
 
 async def init_models():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Bring the schema up to date on startup, or, without auto-migration, check that it is."""
+    if settings.db_auto_migrate:
+        applied = await migrate.upgrade(engine)
+        if applied:
+            logger.info("Applied migrations: %s", ", ".join(applied))
+        return
+    todo = await migrate.pending(engine)
+    if todo:
+        raise RuntimeError(f"Database schema is behind: run `python -m app.migrate` ({', '.join(todo)} pending)")
 
 async def get_session() -> AsyncSession:
     async with SessionLocal() as session:
@@ -0,0 +1,80 @@
+
+import asyncio
+import logging
+from typing import Any, Dict
+
+from app import ledger
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One subscriber's bounded queue. `closed` is set when the broker drops it."""
+
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    async def get(self, timeout: float | None = None) -> Dict[str, Any] | None:
+        """Next event, or None on timeout."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """In-process pub/sub keyed by topic (e.g. an account id).
+
+    Publishing never blocks: a subscriber whose queue is full is considered a slow consumer
+    and is dropped (its stream ends and the client reconnects and resyncs).
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._topics: Dict[str, set[Subscription]] = {}
+        self.dropped = 0
+
+    def subscribe(self, topic: str) -> Subscription:
+        sub = Subscription(topic, self.queue_size)
+        self._topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._topics.get(sub.topic)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._topics[sub.topic]
+
+    def publish(self, topic: str, event: Dict[str, Any]):
+        for sub in list(self._topics.get(topic, ())):
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.info("Dropping slow subscriber on %s", topic)
+                sub.closed = True
+                self.dropped += 1
+                self.unsubscribe(sub)
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self._topics.get(topic))
+
+    def stats(self) -> dict:
+        return {
+            "topics": len(self._topics),
+            "subscribers": sum(len(s) for s in self._topics.values()),
+            "dropped": self.dropped,
+        }
+
+
+broker = Broker(queue_size=settings.sse_queue_size)
+
+
+@ledger.on_commit
+def _publish_ledger_changes(changes: dict):
+    for account_id, rows in changes.items():
+        if broker.has_subscribers(account_id):
+            broker.publish(account_id, {"type": "ledger", "rows": rows})
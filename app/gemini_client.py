@@ -1,3 +1,4 @@
+import asyncio
 import random
 import json
 import time
@@ -6,8 +7,9 @@ import hmac
 import hashlib
 from datetime import datetime
 from typing import List, Dict, Any
-import httpx
-from app.models import LocalTransaction
+from app import analytics, holdings, ledger, metrics, projections, upstream
+from app.price_cache import PriceCache, PriceRefresher
+from app.store import store
 from app.config import settings
 
 
@@ -21,43 +23,118 @@ def _base_price_for(symbol: str) -> float:
     return base.get(symbol.upper(), 1.0)
 
 
+async def _fetch_price(symbol_norm: str) -> dict:
+    """Fetch the last traded price from the Gemini public ticker; raises if unavailable.
+
+    With a shared store, a price another worker fetched within the cache TTL is reused, so
+    the upstream sees about one ticker call per symbol and TTL however many workers run.
+    """
+    key = f"price:{symbol_norm}"
+    if store.shared:
+        cached = await store.get(key)
+        if cached is not None:
+            return json.loads(cached)
+    base_url = settings.gemini_base_url.rstrip('/')
+    # public endpoint expects lowercase symbol (e.g., btcusd)
+    sym = symbol_norm.lower()
+    url = f"{base_url}/v1/pubticker/{sym}"
+    r = await upstream.gemini().get(url)
+    r.raise_for_status()
+    j = r.json()
+    # many Gemini pubticker responses include 'last' as string
+    price = float(j.get('last') or j.get('last_price') or j.get('close') or 0)
+    quote = {"symbol": symbol_norm, "price": round(price, 2), "ts": datetime.utcnow().isoformat()}
+    if store.shared:
+        await store.set(key, json.dumps(quote), ttl=settings.price_cache_ttl_seconds)
+    return quote
+
+
+price_cache = PriceCache(
+    _fetch_price,
+    ttl=settings.price_cache_ttl_seconds,
+    stale_ttl=settings.price_cache_stale_seconds,
+    max_size=settings.price_cache_max_symbols,
+)
+price_refresher = PriceRefresher(
+    price_cache,
+    symbols=[s.strip().upper() for s in settings.price_hot_symbols.split(',') if s.strip()],
+    interval=settings.price_refresh_interval_seconds,
+)
+
+
 async def get_price(symbol: str) -> dict:
     """Return a market price for the given symbol.
 
-    If Gemini public API is reachable, use it; otherwise fall back to demo random price.
+    Served from the price cache when possible; if Gemini public API is reachable, use it;
+    otherwise fall back to demo random price.
     """
     symbol_norm = symbol.upper()
-    # try Gemini public ticker
     try:
-        base_url = settings.gemini_base_url.rstrip('/')
-        # public endpoint expects lowercase symbol (e.g., btcusd)
-        sym = symbol_norm.lower()
-        url = f"{base_url}/v1/pubticker/{sym}"
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.get(url)
-            if r.status_code == 200:
-                j = r.json()
-                # many Gemini pubticker responses include 'last' as string
-                price = float(j.get('last') or j.get('last_price') or j.get('close') or 0)
-                return {"symbol": symbol_norm, "price": round(price, 2), "ts": datetime.utcnow().isoformat()}
+        return await price_cache.get(symbol_norm)
     except Exception:
         pass
 
+    metrics.record_fallback("get_price")
+    return _demo_price(symbol_norm)
+
+
+def _demo_price(symbol_norm: str) -> dict:
     # fallback demo price
-    base = _base_price_for(symbol)
+    base = _base_price_for(symbol_norm)
     price = round(base * (1 + random.uniform(-0.03, 0.03)), 2)
     return {"symbol": symbol_norm, "price": price, "ts": datetime.utcnow().isoformat()}
 
 
+async def get_prices(symbols: List[str], timeout: float | None = None) -> Dict[str, dict]:
+    """Return prices for several symbols, fetched concurrently under one deadline.
+
+    Symbols whose lookup fails or misses the deadline get a demo price marked with
+    `"fallback": True`; their upstream fetch keeps running and warms the cache for next time.
+    """
+    timeout = settings.price_batch_timeout_seconds if timeout is None else timeout
+    symbols_norm = list(dict.fromkeys(s.strip().upper() for s in symbols if s and s.strip()))
+
+    async def one(symbol_norm: str) -> dict:
+        try:
+            return await asyncio.wait_for(price_cache.get(symbol_norm), timeout)
+        except Exception:
+            metrics.record_fallback("get_prices")
+            return {**_demo_price(symbol_norm), "fallback": True}
+
+    results = await asyncio.gather(*(one(s) for s in symbols_norm))
+    return dict(zip(symbols_norm, results))
+
+
+async def _settle(session, account_id: str, side: str, symbol: str, qty: float, price: float, usd: float, description: str, order_id: str | None = None) -> dict:
+    """Record an executed trade: the USD ledger row and the crypto fill (the caller commits)."""
+    # a buy spends USD, a sell receives it
+    signs = {'buy': -1, 'sell': 1}
+    if side not in signs:
+        raise holdings.UnknownSide(f"Unknown trade side: {side!r}")
+    tx = await ledger.record_transaction(session, account_id, signs[side] * usd, description)
+    await holdings.record_fill(session, account_id, symbol, side, qty, price, transaction_id=tx.id, order_id=order_id)
+    return {"symbol": symbol, "qty": round(await holdings.held(session, account_id, symbol), 8)}
+
+
 async def simulate_trade(user, side: str, amount_usd: float, symbol: str, session=None) -> dict:
     """Simulate a trade: for demo, reduce/add USD balance by amount_usd and return executed price info.
 
     side: 'buy' reduces USD balance (creates negative LocalTransaction), 'sell' increases USD balance.
+    The ledger row and the fill (which updates the position) are written to the user's primary
+    account; the caller commits. Selling more than the position holds raises
+    `holdings.InsufficientHoldings`; any other side than 'buy' or 'sell' raises `holdings.UnknownSide`.
     """
+    side = side.lower()
+    if side not in holdings.SIDES:
+        raise holdings.UnknownSide(f"Unknown trade side: {side!r}")
     info = await get_price(symbol)
     executed_price = info["price"]
     # amount_usd is the USD value to buy/sell
     qty = round(amount_usd / executed_price, 8) if executed_price else 0
+    symbol_norm = symbol.upper()
+    account_id = user.primary_account_id
+    if side == 'sell' and session is not None and await holdings.held(session, account_id, symbol_norm) < qty:
+        raise holdings.InsufficientHoldings(f"Cannot sell {qty} {symbol_norm}: not enough held")
     # If real Gemini credentials + execute flag are configured, attempt a real order
     try:
         api_key = settings.gemini_api_key
@@ -67,21 +144,18 @@ async def simulate_trade(user, side: str, amount_usd: float, symbol: str, sessio
         api_key = api_secret = None
         execute_real = False
 
-    symbol_norm = symbol.upper()
     if api_key and api_secret and execute_real:
         # place a limit order at current price using Gemini v1 private endpoint
         try:
             base_url = settings.gemini_base_url.rstrip('/')
             sym = symbol_norm.lower()
-            # compute amount in base currency
-            qty = round(amount_usd / executed_price, 8) if executed_price else 0
             payload = {
                 "request": "/v1/order/new",
                 "nonce": str(int(time.time() * 1000)),
                 "symbol": sym,
                 "amount": str(qty),
                 "price": str(executed_price),
-                "side": side.lower(),
+                "side": side,
                 "type": "exchange limit"
             }
             raw = json.dumps(payload)
@@ -92,36 +166,31 @@ async def simulate_trade(user, side: str, amount_usd: float, symbol: str, sessio
                 'X-GEMINI-PAYLOAD': b64.decode(),
                 'X-GEMINI-SIGNATURE': signature
             }
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                r = await client.post(f"{base_url}/v1/order/new", headers=headers)
-                if r.status_code in (200, 201):
-                    j = r.json()
-                    # record a LocalTransaction for USD effect if session provided
-                    if session is not None:
-                        try:
-                            usd_delta = -amount_usd if side.lower() == 'buy' else amount_usd
-                            tx = LocalTransaction(created_at=datetime.utcnow(), amount=usd_delta, description=f"gemini {side} {symbol} ${amount_usd}")
-                            session.add(tx)
-                            await session.flush()
-                        except Exception:
-                            pass
-                    return {"executed": True, "api_response": j}
-                else:
-                    return {"executed": False, "error": r.text, "status_code": r.status_code}
+            r = await upstream.gemini().post(
+                f"{base_url}/v1/order/new", headers=headers, timeout=settings.gemini_order_timeout,
+                extensions={"adaptive_timeout": False},
+            )
         except Exception as e:
             return {"executed": False, "error": str(e)}
-
-    # fallback demo behavior: create LocalTransaction to reflect USD delta
-    if session is not None:
-        try:
-            usd_delta = -amount_usd if side.lower() == 'buy' else amount_usd
-            tx = LocalTransaction(created_at=datetime.utcnow(), amount=usd_delta, description=f"demo {side} {symbol} ${amount_usd}")
-            session.add(tx)
-            await session.flush()
-        except Exception:
-            pass
-
-    return {"symbol": symbol_norm, "side": side.lower(), "amount_usd": amount_usd, "executed_price": executed_price, "qty": qty, "ts": datetime.utcnow().isoformat(), "simulated": True}
+        if r.status_code not in (200, 201):
+            return {"executed": False, "error": r.text, "status_code": r.status_code}
+        j = r.json()
+        res = {"executed": True, "api_response": j}
+        if session is not None:
+            # the exchange reports what filled; without that, assume the limit order filled in full
+            filled_qty = float(j.get("executed_amount") or 0) or qty
+            fill_price = float(j.get("avg_execution_price") or 0) or executed_price
+            res["position"] = await _settle(
+                session, account_id, side, symbol_norm, filled_qty, fill_price, round(filled_qty * fill_price, 2),
+                f"gemini {side} {symbol} ${amount_usd}", order_id=str(j.get("order_id") or "") or None,
+            )
+        return res
+
+    res = {"symbol": symbol_norm, "side": side, "amount_usd": amount_usd, "executed_price": executed_price, "qty": qty, "ts": datetime.utcnow().isoformat(), "simulated": True}
+    # fallback demo behavior: record the USD delta and the fill
+    if session is not None and qty:
+        res["position"] = await _settle(session, account_id, side, symbol_norm, qty, executed_price, amount_usd, f"demo {side} {symbol} ${amount_usd}")
+    return res
 
 
 async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, Any]:
@@ -132,8 +201,12 @@ async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, An
       - monthly_income: float
       - monthly_expenses: float
       - transactions: list of {amount, description, created_at}
+      - analytics: precomputed `analytics.analyze` output (e.g. over the full ledger); derived
+        from `transactions` when absent
       - risk_profile: 'conservative'|'balanced'|'aggressive'
 
+    Missing monthly income/expenses are estimated from the analytics.
+
     Returns a structured dict with recommendations and rationale.
     """
     total = float(user_summary.get('total_usd') or 0.0)
@@ -142,6 +215,14 @@ async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, An
     txs: List[Dict[str, Any]] = user_summary.get('transactions') or []
     risk = (user_summary.get('risk_profile') or 'balanced').lower()
 
+    stats = user_summary.get('analytics')
+    if stats is None:
+        stats = analytics.analyze(analytics.columns_from_transactions(txs))
+    if not income:
+        income = stats['monthly_income']
+    if not expenses:
+        expenses = stats['monthly_expenses']
+
     # Basic safety checks
     emergency_months = 3
     emergency_target = expenses * emergency_months if expenses > 0 else income * emergency_months if income>0 else 1000
@@ -163,12 +244,7 @@ async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, An
         surplus = total - emergency_target
         if surplus > 50:
             # allocation by risk
-            if risk == 'conservative':
-                alloc = {'bonds_pct':0.6,'equities_pct':0.3,'crypto_pct':0.1}
-            elif risk == 'aggressive':
-                alloc = {'bonds_pct':0.2,'equities_pct':0.3,'crypto_pct':0.5}
-            else:
-                alloc = {'bonds_pct':0.4,'equities_pct':0.4,'crypto_pct':0.2}
+            alloc = projections.RISK_ALLOCATIONS.get(risk, projections.RISK_ALLOCATIONS['balanced'])
 
             # recommend target instruments
             equities_amount = round(surplus * alloc['equities_pct'],2)
@@ -181,8 +257,8 @@ async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, An
                 recommendations.append({'type':'invest','instrument':'BND (ETF bonos)','amount':bonds_amount,'rationale':'Estabilidad mediante un ETF de renta fija amplia.'})
             if crypto_amount>0:
                 # split crypto recommendation
-                btc = round(crypto_amount*0.6,2)
-                eth = round(crypto_amount*0.4,2)
+                btc = round(crypto_amount*projections.CRYPTO_SPLIT['BTC'],2)
+                eth = round(crypto_amount*projections.CRYPTO_SPLIT['ETH'],2)
                 if btc>0:
                     recommendations.append({'type':'invest','instrument':'BTC','amount':btc,'rationale':'Exposición a activo de reserva a largo plazo.'})
                 if eth>0:
@@ -191,22 +267,20 @@ async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, An
             rationale.append(f'Superávit ${surplus:.2f} asignado según perfil de riesgo "{risk}" entre renta variable/renta fija/cripto.')
 
     # Look for recurring income in transactions
-    recurring = any(str(tx.get('description','')).lower().find('payroll')>=0 or str(tx.get('description','')).lower().find('salary')>=0 for tx in txs)
+    recurring = stats['has_payroll'] or bool(stats['recurring_deposits'])
     if recurring:
         rationale.append('Detectadas entradas recurrentes de nómina — considere automatizar ahorros en cada salario.')
         recommendations.append({'type':'automation','action':'auto-save','amount':'10% de la nómina','rationale':'Mover automáticamente un porcentaje fijo de cada nómina a inversiones/ahorros.'})
 
     # If many small expenses, recommend budgeting
-    small_expenses = sum(1 for tx in txs if tx.get('amount') and abs(tx.get('amount'))<20)
+    small_expenses = stats['small_expenses']['count']
     if small_expenses > 10:
         recommendations.append({'type':'advice','advice':'Reducir gastos pequeños diarios','rationale':'Se encontraron muchas transacciones pequeñas; recortarlas puede aumentar el ahorro.'})
 
     # Add market-aware suggestion: check BTC/ETH prices (demo) to provide context
     try:
-        prices = {}
-        for s in ('BTCUSD','ETHUSD'):
-            p = await get_price(s)
-            prices[s] = p['price']
+        quotes = await get_prices(['BTCUSD','ETHUSD'])
+        prices = {s: q['price'] for s, q in quotes.items()}
         market_note = f"Precios de mercado (demo): BTC ${prices['BTCUSD']}, ETH ${prices['ETHUSD']}"
         rationale.append(market_note)
     except Exception:
@@ -221,7 +295,7 @@ async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, An
     account_id = user_summary.get('account_id') or ''
     # gastos hormiga: pequeñas transacciones
     small_count = small_expenses
-    small_sum = round(sum(abs(tx.get('amount') or 0) for tx in txs if tx.get('amount') and abs(tx.get('amount'))<20),2)
+    small_sum = stats['small_expenses']['total']
 
     salutation = f"Hola {name}, " if name else "Hola, "
     balance_line = f"Actualmente tienes ${total:.2f} en tu cuenta principal{(' (id: '+account_id+')' if account_id else '')}."
@@ -260,5 +334,6 @@ async def generate_recommendations(user_summary: Dict[str, Any]) -> Dict[str, An
         'recommendations':recommendations,
         'rationale':rationale,
         'score':score,
-        'narrative': narrative
+        'narrative': narrative,
+        'analytics': stats
     }
@@ -0,0 +1,135 @@
+"""Crypto holdings: trade fills and the per-account, per-symbol positions derived from them.
+
+`record_fill` stores a fill and folds it into the account's `Position` row in the same
+transaction, with one conditional UPDATE, so a position is always the running aggregate of
+its fills and reading a portfolio costs one row per symbol however many trades were made.
+
+Positions use average cost: a buy adds its quantity and cost; a sell realizes
+qty x (price - average cost) and removes its share of the cost, leaving the average unchanged.
+"""
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Position, TradeFill
+
+
+SIDES = ("buy", "sell")
+
+
+class InsufficientHoldings(ValueError):
+    pass
+
+
+class UnknownSide(ValueError):
+    pass
+
+
+async def _apply_buy(session: AsyncSession, account_id: str, symbol: str, qty: float, price: float) -> bool:
+    res = await session.execute(
+        update(Position)
+        .where(Position.account_id == account_id, Position.symbol == symbol)
+        .values(
+            qty=Position.qty + qty,
+            cost_basis=Position.cost_basis + qty * price,
+            fills=Position.fills + 1,
+            updated_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount > 0
+
+
+async def _apply_sell(session: AsyncSession, account_id: str, symbol: str, qty: float, price: float) -> bool:
+    # every SET expression sees the row as it was before the update
+    sold_cost = qty * Position.cost_basis / Position.qty
+    res = await session.execute(
+        update(Position)
+        .where(Position.account_id == account_id, Position.symbol == symbol, Position.qty >= qty)
+        .values(
+            qty=Position.qty - qty,
+            cost_basis=Position.cost_basis - sold_cost,
+            realized_pnl=Position.realized_pnl + qty * price - sold_cost,
+            fills=Position.fills + 1,
+            updated_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount > 0
+
+
+async def record_fill(
+    session: AsyncSession,
+    account_id: str,
+    symbol: str,
+    side: str,
+    qty: float,
+    price: float,
+    transaction_id: int | None = None,
+    order_id: str | None = None,
+) -> TradeFill:
+    """Add a fill and update the position in the current transaction (the caller commits).
+
+    Raises `InsufficientHoldings` for a sell larger than the position and `UnknownSide` for a
+    side other than "buy" or "sell".
+    """
+    symbol, side = symbol.upper(), side.lower()
+    if side not in SIDES:
+        raise UnknownSide(f"Unknown trade side: {side!r}")
+    if side == "sell":
+        if not await _apply_sell(session, account_id, symbol, qty, price):
+            raise InsufficientHoldings(f"Cannot sell {qty} {symbol}: only {await held(session, account_id, symbol)} held")
+    elif not await _apply_buy(session, account_id, symbol, qty, price):
+        try:
+            async with session.begin_nested():
+                session.add(Position(account_id=account_id, symbol=symbol, qty=qty, cost_basis=qty * price, realized_pnl=0.0, fills=1))
+        except IntegrityError:
+            # another transaction opened the position first
+            await _apply_buy(session, account_id, symbol, qty, price)
+
+    fill = TradeFill(account_id=account_id, symbol=symbol, side=side, qty=qty, price=price, transaction_id=transaction_id, order_id=order_id)
+    session.add(fill)
+    await session.flush()
+    return fill
+
+
+async def held(session: AsyncSession, account_id: str, symbol: str) -> float:
+    q = await session.execute(select(Position.qty).where(Position.account_id == account_id, Position.symbol == symbol.upper()))
+    return float(q.scalar_one_or_none() or 0.0)
+
+
+async def positions(session: AsyncSession, account_id: str) -> list[Position]:
+    """All of the account's positions, open or closed (closed ones still carry realized P&L)."""
+    q = await session.execute(select(Position).where(Position.account_id == account_id).order_by(Position.symbol))
+    return list(q.scalars())
+
+
+def value(positions: list[Position], prices: dict[str, dict]) -> dict:
+    """Value positions against `prices` (symbol -> price quote, as from `get_prices`)."""
+    rows = []
+    totals = {"market_value": 0.0, "cost_basis": 0.0, "unrealized_pnl": 0.0, "realized_pnl": 0.0}
+    for p in positions:
+        quote = prices.get(p.symbol) or {}
+        price = float(quote.get("price") or 0.0)
+        market_value = p.qty * price
+        row = {
+            "symbol": p.symbol,
+            "qty": round(p.qty, 8),
+            "avg_cost": round(p.cost_basis / p.qty, 2) if p.qty > 0 else None,
+            "cost_basis": round(p.cost_basis, 2),
+            "price": price,
+            "market_value": round(market_value, 2),
+            "unrealized_pnl": round(market_value - p.cost_basis, 2),
+            "realized_pnl": round(p.realized_pnl, 2),
+            "fills": p.fills,
+        }
+        if quote.get("fallback"):
+            row["price_fallback"] = True
+        rows.append(row)
+        totals["market_value"] += market_value
+        totals["cost_basis"] += p.cost_basis
+        totals["unrealized_pnl"] += market_value - p.cost_basis
+        totals["realized_pnl"] += p.realized_pnl
+    return {"positions": rows, "totals": {k: round(v, 2) for k, v in totals.items()}}
@@ -0,0 +1,419 @@
+
+"""Ledger writes and balance reads.
+
+Every `LocalTransaction` should be written through `record_transaction`, which keeps the
+materialized `AccountBalance` row in the same database transaction so balance reads are a
+primary-key lookup instead of a SUM over the account history. It also folds every row into
+the account's `LedgerMonth` totals (credits, debits and count per month and description),
+which is what the advisor's analytics read instead of the rows.
+
+Callbacks registered with `on_commit` are told which accounts a committed transaction wrote
+to (and the rows it added), so caches and live streams derived from the ledger can react.
+The notice goes through the shared store (`app.store`), so with several worker processes the
+listeners in every worker hear about every commit.
+
+Run `python -m app.ledger verify` to compare the materialized balances with the ledger, or
+`python -m app.ledger rebuild` to recompute balances and month totals from `local_transactions`.
+"""
+import asyncio
+import base64
+import csv
+import io
+import json
+import logging
+import sys
+from datetime import datetime
+from typing import Callable, Iterable
+
+from sqlalchemy import event, select, update, delete, insert, func, case, or_, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import LocalTransaction, AccountBalance, LedgerMonth
+from app.store import store
+
+logger = logging.getLogger(__name__)
+
+# account id -> serialized rows added, or None when not tracked row by row (bulk inserts)
+CommitListener = Callable[[dict[str, list[dict] | None]], None]
+_commit_listeners: list[CommitListener] = []
+LEDGER_CHANNEL = "ledger.commit"
+
+
+def on_commit(fn: CommitListener) -> CommitListener:
+    """Register `fn(changes)` to run after a commit (in any worker) that wrote ledger rows.
+
+    `changes` maps each written account id to the serialized rows added, or to None if they
+    were not tracked individually.
+    """
+    _commit_listeners.append(fn)
+    return fn
+
+
+def _touch(session: AsyncSession, account_id: str, tx: LocalTransaction | None = None):
+    changes = session.info.setdefault("ledger_accounts", {})
+    rows = changes.get(account_id, [])
+    if tx is None or rows is None:
+        changes[account_id] = None
+    else:
+        rows.append(serialize(tx))
+        changes[account_id] = rows
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session):
+    accounts = session.info.pop("ledger_accounts", None)
+    if not accounts:
+        return
+    store.publish_nowait(LEDGER_CHANNEL, {"changes": accounts})
+
+
+def _notify(message: dict):
+    for fn in _commit_listeners:
+        try:
+            fn(message["changes"])
+        except Exception:
+            logger.exception("Ledger commit listener failed")
+
+
+store.subscribe(LEDGER_CHANNEL, _notify)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop("ledger_accounts", None)
+
+
+async def _ledger_totals(session: AsyncSession, account_id: str) -> tuple[float, int | None]:
+    q = await session.execute(
+        select(func.coalesce(func.sum(LocalTransaction.amount), 0.0), func.max(LocalTransaction.id))
+        .where(LocalTransaction.account_id == account_id)
+    )
+    total, last_id = q.one()
+    return float(total), last_id
+
+
+async def _add_to_balance(session: AsyncSession, account_id: str, delta: float, last_transaction_id: int | None) -> bool:
+    res = await session.execute(
+        update(AccountBalance)
+        .where(AccountBalance.account_id == account_id)
+        .values(
+            balance=AccountBalance.balance + delta,
+            last_transaction_id=case(
+                (AccountBalance.last_transaction_id > last_transaction_id, AccountBalance.last_transaction_id),
+                else_=last_transaction_id,
+            ),
+            updated_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount > 0
+
+
+async def apply_to_balance(session: AsyncSession, account_id: str, delta: float, last_transaction_id: int | None, tx: LocalTransaction | None = None):
+    """Add `delta` to the account's materialized balance (the caller commits).
+
+    Accounts without a balance row yet are seeded from the ledger, which must already contain
+    the flushed rows this delta accounts for.
+    `tx`, when the delta comes from a single row, is reported to the commit listeners.
+    """
+    updated = await _add_to_balance(session, account_id, delta, last_transaction_id)
+    if not updated:
+        total, last_id = await _ledger_totals(session, account_id)
+        try:
+            async with session.begin_nested():
+                session.add(AccountBalance(account_id=account_id, balance=total, last_transaction_id=last_id))
+        except IntegrityError:
+            # another transaction seeded the row first; its total cannot include our
+            # uncommitted rows, so add the delta to it
+            await _add_to_balance(session, account_id, delta, last_transaction_id)
+    _touch(session, account_id, tx)
+
+
+# (month, description) -> [credit, debit, count]
+MonthCells = dict[tuple[str, str], list]
+
+
+def month_cells(rows: Iterable[tuple[float, str | None, datetime]]) -> MonthCells:
+    """Sum (amount, description, created_at) rows into month totals."""
+    cells: MonthCells = {}
+    for amount, description, created_at in rows:
+        cell = cells.setdefault((created_at.strftime("%Y-%m"), description or ""), [0.0, 0.0, 0])
+        if amount > 0:
+            cell[0] += amount
+        elif amount < 0:
+            cell[1] -= amount
+        cell[2] += 1
+    return cells
+
+
+def _month_upsert(dialect: str):
+    insert_ = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert_(LedgerMonth.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["account_id", "month", "description"],
+        set_={
+            "credit": stmt.table.c.credit + stmt.excluded.credit,
+            "debit": stmt.table.c.debit + stmt.excluded.debit,
+            "count": stmt.table.c.count + stmt.excluded.count,
+        },
+    )
+
+
+async def apply_to_months(session: AsyncSession, account_id: str, cells: MonthCells):
+    """Add `cells` to the account's `LedgerMonth` rows with one executemany upsert (the caller commits)."""
+    if not cells:
+        return
+    # always in key order, so two transactions writing the same cells cannot deadlock
+    params = [
+        {"account_id": account_id, "month": month, "description": description, "credit": credit, "debit": debit, "count": count}
+        for (month, description), (credit, debit, count) in sorted(cells.items())
+    ]
+    await session.execute(_month_upsert(session.get_bind().dialect.name), params)
+
+
+async def record_transaction(
+    session: AsyncSession,
+    account_id: str | None,
+    amount: float,
+    description: str,
+    created_at: datetime | None = None,
+) -> LocalTransaction:
+    """Add a ledger row and update the account balance and month totals in the current
+    transaction (the caller commits)."""
+    tx = LocalTransaction(account_id=account_id, amount=float(amount), description=description, created_at=created_at or datetime.utcnow())
+    session.add(tx)
+    await session.flush()
+    if account_id is not None:
+        await apply_to_balance(session, account_id, float(amount), tx.id, tx)
+        await apply_to_months(session, account_id, month_cells([(tx.amount, description, tx.created_at)]))
+    return tx
+
+
+async def insert_batch(session: AsyncSession, account_id: str, rows: list) -> float:
+    """Insert many ledger rows with a single executemany and return their summed amount.
+
+    `rows` are objects with amount, description and created_at attributes (e.g.
+    `schemas.TransactionIn`). The month totals are updated with the rows; the balance is not
+    touched: call `apply_batch_to_balance` once after the last batch (the caller commits).
+    """
+    if not rows:
+        return 0.0
+    now = datetime.utcnow()
+    params = [
+        {"account_id": account_id, "amount": float(r.amount), "description": r.description, "created_at": r.created_at or now}
+        for r in rows
+    ]
+    await session.execute(insert(LocalTransaction), params)
+    await apply_to_months(session, account_id, month_cells((p["amount"], p["description"], p["created_at"]) for p in params))
+    return sum(p["amount"] for p in params)
+
+
+async def apply_batch_to_balance(session: AsyncSession, account_id: str, total: float):
+    q = await session.execute(select(func.max(LocalTransaction.id)).where(LocalTransaction.account_id == account_id))
+    await apply_to_balance(session, account_id, total, q.scalar_one())
+
+
+async def get_ledger_state(session: AsyncSession, account_id: str) -> tuple[float, int | None]:
+    """Return (balance, id of the newest ledger row) for an account in one primary-key lookup.
+
+    The newest row id works as a version of the account's ledger: it changes whenever a row
+    is added.
+    """
+    # balance rows change through bulk UPDATEs, so never trust a copy already in the session
+    row = await session.get(AccountBalance, account_id, populate_existing=True)
+    if row is not None:
+        return float(row.balance), row.last_transaction_id
+    return await _ledger_totals(session, account_id)
+
+
+async def get_balance(session: AsyncSession, account_id: str) -> float:
+    """Return the account balance from the materialized row.
+
+    Accounts written before balances were materialized (and not rebuilt yet) fall back to
+    summing the ledger; their row is created on the next write or by `rebuild`.
+    """
+    row = await session.get(AccountBalance, account_id, populate_existing=True)
+    if row is not None:
+        return float(row.balance)
+    total, _ = await _ledger_totals(session, account_id)
+    return total
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(tx: LocalTransaction) -> str:
+    raw = f"{tx.created_at.isoformat()}|{tx.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, tx_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(tx_id)
+    except Exception as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+def serialize(tx: LocalTransaction) -> dict:
+    return {"id": tx.id, "account_id": tx.account_id, "amount": float(tx.amount), "description": tx.description, "created_at": tx.created_at.isoformat()}
+
+
+async def list_transactions(
+    session: AsyncSession,
+    account_id: str,
+    limit: int,
+    cursor: str | None = None,
+) -> tuple[list[LocalTransaction], str | None]:
+    """Return one page of an account's transactions, newest first, plus the cursor of the next page.
+
+    Keyset pagination over (created_at, id) walks the (account_id, created_at, id) index, so
+    every page costs the same regardless of how deep into the history it is.
+    """
+    stmt = select(LocalTransaction).where(LocalTransaction.account_id == account_id)
+    if cursor:
+        ts, tx_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            LocalTransaction.created_at < ts,
+            and_(LocalTransaction.created_at == ts, LocalTransaction.id < tx_id),
+        ))
+    stmt = stmt.order_by(LocalTransaction.created_at.desc(), LocalTransaction.id.desc()).limit(limit + 1)
+    rows = list((await session.execute(stmt)).scalars().all())
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+EXPORT_COLUMNS = ("id", "account_id", "amount", "description", "created_at")
+
+
+async def export_rows(session: AsyncSession, account_id: str, fmt: str, chunk_rows: int = 1000):
+    """Stream an account's full ledger, oldest first, as NDJSON or CSV text chunks.
+
+    Rows come from a server-side cursor `chunk_rows` at a time as plain column tuples (no ORM
+    objects), so memory stays flat however long the history is.
+    """
+    stmt = (
+        select(LocalTransaction.id, LocalTransaction.account_id, LocalTransaction.amount, LocalTransaction.description, LocalTransaction.created_at)
+        .where(LocalTransaction.account_id == account_id)
+        .order_by(LocalTransaction.created_at, LocalTransaction.id)
+        .execution_options(yield_per=chunk_rows)
+    )
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buf.getvalue()
+
+    result = await session.stream(stmt)
+    async for part in result.partitions():
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerows((tx_id, acc, float(amount), desc, created.isoformat()) for tx_id, acc, amount, desc, created in part)
+            yield buf.getvalue()
+        else:
+            yield "".join(
+                json.dumps({"id": tx_id, "account_id": acc, "amount": float(amount), "description": desc, "created_at": created.isoformat()}) + "\n"
+                for tx_id, acc, amount, desc, created in part
+            )
+
+
+async def rebuild_balances(session: AsyncSession) -> int:
+    """Recompute every materialized balance from the ledger. Returns the number of accounts."""
+    await session.execute(delete(AccountBalance))
+    q = await session.execute(
+        select(LocalTransaction.account_id, func.sum(LocalTransaction.amount), func.max(LocalTransaction.id))
+        .where(LocalTransaction.account_id.is_not(None))
+        .group_by(LocalTransaction.account_id)
+    )
+    rows = [
+        {"account_id": acc, "balance": float(total or 0.0), "last_transaction_id": last_id, "updated_at": datetime.utcnow()}
+        for acc, total, last_id in q.all()
+    ]
+    if rows:
+        await session.execute(AccountBalance.__table__.insert(), rows)
+    await session.commit()
+    return len(rows)
+
+
+def month_of(dialect: str):
+    """SQL expression for the "YYYY-MM" month of `LocalTransaction.created_at`."""
+    if dialect == "sqlite":
+        # DateTime is stored as ISO text: the first 7 characters are the month
+        return func.substr(LocalTransaction.created_at, 1, 7)
+    return func.to_char(LocalTransaction.created_at, "YYYY-MM")
+
+
+async def rebuild_months(session: AsyncSession) -> int:
+    """Recompute every account's month totals from the ledger. Returns the number of rows."""
+    await session.execute(delete(LedgerMonth))
+    month = month_of(session.get_bind().dialect.name)
+    description = func.coalesce(LocalTransaction.description, "")
+    amount = LocalTransaction.amount
+    totals = (
+        select(
+            LocalTransaction.account_id,
+            month,
+            description,
+            func.sum(case((amount > 0, amount), else_=0.0)),
+            func.sum(case((amount < 0, -amount), else_=0.0)),
+            func.count(),
+        )
+        .where(LocalTransaction.account_id.is_not(None))
+        .group_by(LocalTransaction.account_id, month, description)
+    )
+    res = await session.execute(
+        insert(LedgerMonth).from_select(["account_id", "month", "description", "credit", "debit", "count"], totals)
+    )
+    await session.commit()
+    return res.rowcount
+
+
+async def verify_balances(session: AsyncSession, tolerance: float = 1e-6) -> list[dict]:
+    """Compare materialized balances against the ledger. Returns one dict per mismatching account."""
+    q = await session.execute(
+        select(LocalTransaction.account_id, func.sum(LocalTransaction.amount))
+        .where(LocalTransaction.account_id.is_not(None))
+        .group_by(LocalTransaction.account_id)
+    )
+    expected = {acc: float(total or 0.0) for acc, total in q.all()}
+    q = await session.execute(select(AccountBalance.account_id, AccountBalance.balance))
+    actual = {acc: float(bal) for acc, bal in q.all()}
+
+    mismatches = []
+    for acc in sorted(set(expected) | set(actual)):
+        exp, got = expected.get(acc, 0.0), actual.get(acc)
+        if got is None or abs(exp - got) > tolerance:
+            mismatches.append({"account_id": acc, "ledger": exp, "materialized": got})
+    return mismatches
+
+
+async def _main(argv: list[str]) -> int:
+    from app.database import SessionLocal, init_models
+
+    cmd = argv[0] if argv else "verify"
+    if cmd not in ("verify", "rebuild"):
+        print("usage: python -m app.ledger [verify|rebuild]")
+        return 2
+
+    await init_models()
+    async with SessionLocal() as session:
+        if cmd == "rebuild":
+            n = await rebuild_balances(session)
+            cells = await rebuild_months(session)
+            print(f"rebuilt {n} account balances and {cells} month totals")
+            return 0
+        mismatches = await verify_balances(session)
+        for m in mismatches:
+            print(f"{m['account_id']}: ledger={m['ledger']:.2f} materialized={m['materialized']}")
+        print(f"{len(mismatches)} mismatching accounts")
+        return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
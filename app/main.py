@@ -3,32 +3,71 @@ import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse
 
+from app import metrics, projections, ratelimit, static_assets, upstream
 from app.config import settings
-from app.database import init_models
-from app.routers import auth, nessie, gemini
+from app.database import PoolTimeout, init_models
+from app.gemini_client import price_refresher
+from app.outbox import outbox_worker
+from app.security import shutdown_hash_pool
+from app.store import store
+from app.routers import auth, nessie, gemini, admin
 
 app = FastAPI(title="FinCoach API", openapi_url="/openapi.json", docs_url="/docs")
 
+# innermost, so CORS preflights are never queued and shed responses still get CORS headers
+app.add_middleware(
+    ratelimit.LoadShedder,
+    max_concurrency=settings.load_shed_max_concurrency,
+    max_queue=settings.load_shed_max_queue,
+    max_wait_seconds=settings.load_shed_max_wait_ms / 1000,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 @app.on_event("startup")
 async def startup():
     await init_models()
+    await store.start()
+    await upstream.startup()
+    price_refresher.start()
+    outbox_worker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await price_refresher.stop()
+    await outbox_worker.stop()
+    await upstream.shutdown()
+    await store.stop()
+    shutdown_hash_pool()
+    projections.shutdown_pool()
+
+@app.exception_handler(PoolTimeout)
+async def database_busy(request, exc):
+    # every connection (for SQLite: the single writer) stayed busy for the whole pool timeout
+    return JSONResponse({"detail": "Database busy, try again shortly"}, status_code=503, headers={"Retry-After": "1"})
 
 app.include_router(auth.router)
 app.include_router(nessie.router)
 app.include_router(gemini.router)
+app.include_router(admin.router)
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 FRONT_DIR = settings.frontend_dir
 # normalize possible relative path from env to an absolute path
 if FRONT_DIR and not os.path.isabs(FRONT_DIR):
@@ -36,7 +75,12 @@ if FRONT_DIR and not os.path.isabs(FRONT_DIR):
     base = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     FRONT_DIR = os.path.abspath(os.path.join(base, FRONT_DIR))
 
-if os.path.isdir(FRONT_DIR):
+if os.path.isdir(FRONT_DIR) and settings.static_precompressed:
+    # hashed, precompressed copies built once and served from memory (see app/static_assets.py)
+    static_front = static_assets.StaticAssets(static_assets.build(FRONT_DIR, url_prefix="/_static/"))
+    app.mount("/_static", static_front, name="static-front")
+    app.add_route("/", static_front, methods=["GET", "HEAD"], include_in_schema=False)
+elif os.path.isdir(FRONT_DIR):
     app.mount("/_static", StaticFiles(directory=FRONT_DIR), name="static-front")
 
     @app.get("/")
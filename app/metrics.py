@@ -0,0 +1,219 @@
+
+"""In-process metrics in the Prometheus text format.
+
+Counters and histograms are plain dicts keyed by label values, updated from the event loop
+(and from SQLAlchemy cursor events, which run on the same thread), so recording a sample is a
+dict lookup and a few additions. `render()` produces the `/metrics` page.
+
+`MetricsMiddleware` times every request and, through a context variable, collects the DB and
+upstream time spent on its behalf; that breakdown also goes out as a `Server-Timing` header.
+"""
+import bisect
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from app.config import settings
+
+# seconds; the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return out
+
+
+http_requests = Counter("fincoach_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_latency = Histogram("fincoach_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+http_db_queries = Histogram(
+    "fincoach_http_request_db_queries", "DB statements executed per HTTP request.", ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+db_queries = Counter("fincoach_db_queries_total", "DB statements executed.", ("operation",))
+db_latency = Histogram("fincoach_db_query_duration_seconds", "DB statement latency.", ("operation",))
+upstream_calls = Counter("fincoach_upstream_requests_total", "Calls to Nessie/Gemini by outcome.", ("upstream", "outcome"))
+upstream_latency = Histogram("fincoach_upstream_request_duration_seconds", "Latency of calls to Nessie/Gemini.", ("upstream",))
+fallbacks = Counter("fincoach_fallbacks_total", "Times a demo/local fallback was used instead of an upstream answer.", ("operation",))
+outbox_rows = Counter("fincoach_outbox_rows_total", "Outbox rows processed by the background worker, by outcome.", ("kind", "outcome"))
+
+rate_limited = Counter("fincoach_rate_limited_total", "Requests rejected with 429 by a per-user/IP rate limit, by route.", ("route",))
+load_shed = Counter("fincoach_load_shed_total", "Requests rejected with 503 by load shedding, by reason.", ("reason",))
+queue_wait = Histogram("fincoach_request_queue_seconds", "Time requests waited for a concurrency slot before running.")
+
+REGISTRY = [http_requests, http_latency, http_db_queries, db_queries, db_latency, upstream_calls, upstream_latency, fallbacks, outbox_rows, rate_limited, load_shed, queue_wait]
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+@dataclass
+class RequestTimings:
+    """Time spent on behalf of the current request, filled in by the DB and upstream hooks."""
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    upstream_calls: int = 0
+    upstream_seconds: float = 0.0
+
+
+current_timings: ContextVar[RequestTimings | None] = ContextVar("current_timings", default=None)
+
+
+def record_db(operation: str, seconds: float):
+    db_queries.inc(operation)
+    db_latency.observe(seconds, operation)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.db_queries += 1
+        timings.db_seconds += seconds
+
+
+def record_upstream(name: str, outcome: str, seconds: float):
+    upstream_calls.inc(name, outcome)
+    upstream_latency.observe(seconds, name)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.upstream_calls += 1
+        timings.upstream_seconds += seconds
+
+
+def record_fallback(operation: str):
+    fallbacks.inc(operation)
+
+
+def instrument_engine(engine):
+    """Time every statement run through `engine` (an AsyncEngine or a sync Engine)."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        record_db(statement.lstrip()[:6].upper(), time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and DB work, plus `Server-Timing`.
+
+    Routes are labelled with their path template (`/nessie/transactions`, not the URL), found
+    from the endpoint the router picked, so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: dict | None = None
+
+    def _route_label(self, scope) -> str:
+        if self._route_paths is None:
+            router = scope.get("router") or getattr(scope.get("app"), "router", None)
+            routes = getattr(router, "routes", [])
+            # Route endpoints and Mount apps -> their path templates
+            self._route_paths = {getattr(r, "endpoint", None) or getattr(r, "app", None): r.path for r in routes}
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.metrics_server_timing:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"server-timing", self._server_timing(timings, start).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_timings.reset(token)
+            elapsed = time.perf_counter() - start
+            method, route = scope["method"], self._route_label(scope)
+            http_requests.inc(method, route, str(status))
+            http_latency.observe(elapsed, method, route)
+            http_db_queries.observe(timings.db_queries, method, route)
+
+    @staticmethod
+    def _server_timing(timings: RequestTimings, start: float) -> str:
+        # time until the response headers; streamed bodies are not included
+        total = (time.perf_counter() - start) * 1000
+        parts = [f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.db_queries} queries"']
+        if timings.upstream_calls:
+            parts.append(f'upstream;dur={timings.upstream_seconds * 1000:.1f};desc="{timings.upstream_calls} calls"')
+        parts.append(f"app;dur={total:.1f}")
+        return ", ".join(parts)
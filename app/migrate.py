@@ -0,0 +1,127 @@
+"""Apply the schema migrations in app/migrations.
+
+Applied versions are recorded in `schema_migrations`; pending ones run in order, all in one
+transaction (DDL is transactional on both PostgreSQL and SQLite), so a failed upgrade leaves
+the schema as it was.
+
+Several worker processes may start at once; the upgrade takes a database-wide lock first (a
+transaction-scoped advisory lock on PostgreSQL, BEGIN IMMEDIATE on SQLite), so one of them
+migrates and the others wait and then find nothing left to do.
+
+    python -m app.migrate [upgrade|status]
+"""
+import asyncio
+import importlib
+import logging
+import pkgutil
+import sys
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, event, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app import migrations
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock key ("fincoach" as a 64-bit integer) and how long a SQLite upgrade
+# waits for another process holding the write lock
+_PG_LOCK_KEY = int.from_bytes(b"fincoach", "big") - 2**63
+_SQLITE_LOCK_WAIT_SECONDS = 300
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", String(64), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def available() -> list[str]:
+    """Migration module names, oldest first."""
+    names = [m.name for m in pkgutil.iter_modules(migrations.__path__) if m.name[:4].isdigit()]
+    return sorted(names)
+
+
+def _applied(conn: Connection) -> set[str]:
+    schema_migrations.create(conn, checkfirst=True)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def _upgrade(conn: Connection) -> list[str]:
+    applied = _applied(conn)
+    ran = []
+    for name in available():
+        if name in applied:
+            continue
+        logger.info("Applying migration %s", name)
+        importlib.import_module(f"{migrations.__name__}.{name}").upgrade(conn)
+        conn.execute(schema_migrations.insert().values(version=name, applied_at=datetime.utcnow()))
+        ran.append(name)
+    return ran
+
+
+def _sqlite_locking_engine(engine: AsyncEngine) -> AsyncEngine:
+    # pysqlite only BEGINs before DML, so by default DDL would run outside the transaction
+    # and nothing would stop two processes migrating together: take over transaction control
+    # and open the transaction with BEGIN IMMEDIATE, which holds the write lock until commit.
+    locking = create_async_engine(engine.url, poolclass=NullPool, connect_args={"timeout": _SQLITE_LOCK_WAIT_SECONDS})
+
+    @event.listens_for(locking.sync_engine, "connect")
+    def _no_implicit_begin(dbapi_conn, _record):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(locking.sync_engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return locking
+
+
+async def upgrade(engine: AsyncEngine) -> list[str]:
+    """Apply pending migrations under the migration lock; returns the versions applied."""
+    dialect = engine.dialect.name
+    if dialect == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        locking = _sqlite_locking_engine(engine)
+        try:
+            async with locking.begin() as conn:
+                return await conn.run_sync(_upgrade)
+        finally:
+            await locking.dispose()
+    async with engine.begin() as conn:
+        if dialect == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+        return await conn.run_sync(_upgrade)
+
+
+async def pending(engine: AsyncEngine) -> list[str]:
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(_applied)
+    return [name for name in available() if name not in applied]
+
+
+async def _main(argv: list[str]) -> int:
+    from app.database import engine
+
+    cmd = argv[0] if argv else "upgrade"
+    if cmd not in ("upgrade", "status"):
+        print("usage: python -m app.migrate [upgrade|status]")
+        return 2
+    try:
+        if cmd == "status":
+            todo = await pending(engine)
+            for name in available():
+                print(f"{'pending' if name in todo else 'applied'}  {name}")
+            return 1 if todo else 0
+        ran = await upgrade(engine)
+        print("\n".join(f"applied  {name}" for name in ran) or "up to date")
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
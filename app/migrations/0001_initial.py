@@ -0,0 +1,33 @@
+"""users and local_transactions, as first created by create_all."""
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, String, Table
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("email", String(255), nullable=False),
+    Column("password_hash", String(255), nullable=False),
+    Column("first_name", String(100), nullable=True),
+    Column("last_name", String(100), nullable=True),
+    Column("nessie_customer_id", String(64), nullable=True),
+    Column("primary_account_id", String(64), nullable=True),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Index("ix_users_email", "email", unique=True),
+)
+
+local_transactions = Table(
+    "local_transactions", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("account_id", String(64)),
+    Column("amount", Float),
+    Column("description", String(255)),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Index("ix_local_transactions_account_id", "account_id"),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
@@ -0,0 +1,27 @@
+"""Outbox of upstream Nessie calls (app.outbox)."""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text
+
+metadata = MetaData()
+
+nessie_outbox = Table(
+    "nessie_outbox", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("kind", String(32)),
+    Column("account_id", String(64)),
+    Column("payload", Text),
+    Column("idempotency_key", String(64), unique=True),
+    Column("transaction_id", Integer, nullable=True),
+    Column("status", String(16)),
+    Column("attempts", Integer),
+    Column("next_attempt_at", DateTime),
+    Column("claimed_by", String(32), nullable=True),
+    Column("last_error", Text, nullable=True),
+    Column("upstream_id", String(64), nullable=True),
+    Column("created_at", DateTime),
+    Column("synced_at", DateTime, nullable=True),
+    Index("ix_nessie_outbox_status_next_attempt", "status", "next_attempt_at"),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
@@ -0,0 +1,33 @@
+"""Trade fills and per-symbol positions (app.holdings)."""
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, String, Table
+
+metadata = MetaData()
+
+trade_fills = Table(
+    "trade_fills", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("account_id", String(64)),
+    Column("symbol", String(16)),
+    Column("side", String(4)),
+    Column("qty", Float),
+    Column("price", Float),
+    Column("transaction_id", Integer, nullable=True),
+    Column("order_id", String(64), nullable=True),
+    Column("created_at", DateTime),
+    Index("ix_trade_fills_account_created", "account_id", "created_at"),
+)
+
+positions = Table(
+    "positions", metadata,
+    Column("account_id", String(64), primary_key=True),
+    Column("symbol", String(16), primary_key=True),
+    Column("qty", Float),
+    Column("cost_basis", Float),
+    Column("realized_pnl", Float),
+    Column("fills", Integer),
+    Column("updated_at", DateTime),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
@@ -0,0 +1,27 @@
+"""Per-account, per-month ledger totals by description (app.ledger, read by app.analytics)."""
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, text
+
+metadata = MetaData()
+
+ledger_months = Table(
+    "ledger_months", metadata,
+    Column("account_id", String(64), primary_key=True),
+    Column("month", String(7), primary_key=True),
+    Column("description", String(255), primary_key=True),
+    Column("credit", Float),
+    Column("debit", Float),
+    Column("count", Integer),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
+    # DateTime is stored as ISO text on SQLite
+    month = "substr(created_at, 1, 7)" if conn.dialect.name == "sqlite" else "to_char(created_at, 'YYYY-MM')"
+    conn.execute(text(
+        "INSERT INTO ledger_months (account_id, month, description, credit, debit, count) "
+        f"SELECT account_id, {month}, COALESCE(description, ''), "
+        "SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END), SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END), COUNT(*) "
+        "FROM local_transactions WHERE account_id IS NOT NULL "
+        f"GROUP BY account_id, {month}, COALESCE(description, '')"
+    ))
@@ -0,0 +1,8 @@
+"""Schema migrations, applied in order by app.migrate.
+
+Each module is named `NNNN_description.py` and defines `upgrade(conn)`, which gets a sync
+SQLAlchemy Connection inside the migration transaction. Table definitions are written out in
+the module rather than taken from app.models, so a migration keeps doing what it did when it
+was written. Migrations must tolerate schemas created by the `create_all` startup code that
+predates them (create with `checkfirst=True`).
+"""
@@ -1,6 +1,6 @@
 
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Integer, DateTime, Float
+from sqlalchemy import String, Integer, DateTime, Float, Index, Text
 from datetime import datetime
 from app.database import Base
 
@@ -21,8 +21,76 @@ class User(Base):
 
 class LocalTransaction(Base):
     __tablename__ = "local_transactions"
+    # (account_id, created_at, id) serves both per-account lookups and keyset pagination newest-first
+    __table_args__ = (Index("ix_local_transactions_account_created_id", "account_id", "created_at", "id"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    account_id: Mapped[str] = mapped_column(String(64), index=True)
+    account_id: Mapped[str] = mapped_column(String(64))
     amount: Mapped[float] = mapped_column(Float)
     description: Mapped[str] = mapped_column(String(255))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class AccountBalance(Base):
+    """Materialized running balance per account, maintained by app.ledger on every ledger write."""
+    __tablename__ = "account_balances"
+    account_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    balance: Mapped[float] = mapped_column(Float, default=0.0)
+    last_transaction_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class LedgerMonth(Base):
+    """Per-account totals of one description in one calendar month, maintained by app.ledger on
+    every ledger write; app.analytics reads these instead of the rows."""
+    __tablename__ = "ledger_months"
+    account_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)  # "YYYY-MM"
+    description: Mapped[str] = mapped_column(String(255), primary_key=True)
+    credit: Mapped[float] = mapped_column(Float, default=0.0)
+    debit: Mapped[float] = mapped_column(Float, default=0.0)  # positive
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+class NessieOutbox(Base):
+    """Upstream Nessie calls waiting to be made, written in the same transaction as the local
+    ledger row they mirror and drained by app.outbox."""
+    __tablename__ = "nessie_outbox"
+    # the worker's claim query: due rows in pending/sending state
+    __table_args__ = (Index("ix_nessie_outbox_status_next_attempt", "status", "next_attempt_at"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    account_id: Mapped[str] = mapped_column(String(64))
+    payload: Mapped[str] = mapped_column(Text)  # JSON body sent upstream
+    idempotency_key: Mapped[str] = mapped_column(String(64), unique=True)
+    transaction_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default="pending")  # pending | sending | synced | failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    claimed_by: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    upstream_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    synced_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+class TradeFill(Base):
+    """One executed trade: the crypto quantity and price, and the USD ledger row it settled with."""
+    __tablename__ = "trade_fills"
+    __table_args__ = (Index("ix_trade_fills_account_created", "account_id", "created_at"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    account_id: Mapped[str] = mapped_column(String(64))
+    symbol: Mapped[str] = mapped_column(String(16))
+    side: Mapped[str] = mapped_column(String(4))  # buy | sell
+    qty: Mapped[float] = mapped_column(Float)
+    price: Mapped[float] = mapped_column(Float)
+    transaction_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    order_id: Mapped[str | None] = mapped_column(String(64), nullable=True)  # exchange order, live trades only
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class Position(Base):
+    """Running aggregates of an account's fills in one symbol, maintained by app.holdings on every fill
+    (average cost: sells realize P&L against the average cost and leave it unchanged)."""
+    __tablename__ = "positions"
+    account_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    symbol: Mapped[str] = mapped_column(String(16), primary_key=True)
+    qty: Mapped[float] = mapped_column(Float, default=0.0)
+    cost_basis: Mapped[float] = mapped_column(Float, default=0.0)  # USD cost of the qty held
+    realized_pnl: Mapped[float] = mapped_column(Float, default=0.0)
+    fills: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,8 +1,9 @@
 
-import httpx, random, string, logging
+import random, string, logging
 from datetime import date
+from app import ledger, metrics, outbox, upstream
+from app.database import SessionLocal
 from app.config import settings
-from app.models import LocalTransaction
 
 logger = logging.getLogger(__name__)
 
@@ -44,64 +45,68 @@ async def create_customer(first_name: str, last_name: str, address: dict) -> str
         },
     }
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            r = await client.post(_u("/customers"), json=body)
-            if r.status_code not in (200, 201):
-                logger.warning("Nessie create_customer returned status %s: %s", r.status_code, r.text)
-                # fallback to demo id so the app stays usable
-                return _demo_id("LOCALCUST")
-            data = r.json()
-            if isinstance(data, dict) and "objectCreated" in data and "_id" in data["objectCreated"]:
-                return data["objectCreated"]["_id"]
-            return data.get("_id") or data["objectCreated"]["_id"]
+        r = await upstream.nessie().post(_u("/customers"), json=body)
+        if r.status_code not in (200, 201):
+            logger.warning("Nessie create_customer returned status %s: %s", r.status_code, r.text)
+            # fallback to demo id so the app stays usable
+            metrics.record_fallback("create_customer")
+            return _demo_id("LOCALCUST")
+        data = r.json()
+        if isinstance(data, dict) and "objectCreated" in data and "_id" in data["objectCreated"]:
+            return data["objectCreated"]["_id"]
+        return data.get("_id") or data["objectCreated"]["_id"]
     except Exception as e:
         logger.exception("Nessie create_customer failed, falling back to demo mode: %s", e)
+        metrics.record_fallback("create_customer")
         return _demo_id("LOCALCUST")
 
 
+async def _local_account(balance, session) -> str:
+    acc_id = _demo_id("LOCALACC")
+    # an initial local transaction represents the starting balance (committed by the caller)
+    if session is not None and balance:
+        await ledger.record_transaction(session, acc_id, float(balance), "Initial balance (demo)")
+    return acc_id
+
+
 async def create_account_for_customer(customer_id: str, nickname="FinCoach", balance=0, session=None) -> str:
+    """Create a checking account for the customer, or a local demo account (whose starting
+    balance is recorded in `session`, left for the caller to commit) if Nessie is unavailable."""
     if is_demo():
-        acc_id = _demo_id("LOCALACC")
-        # create an initial local transaction representing the starting balance
-        if session is not None and balance:
-            tx = LocalTransaction(account_id=acc_id, amount=float(balance), description="Initial balance (demo)")
-            session.add(tx)
-            await session.commit()
-        return acc_id
+        return await _local_account(balance, session)
 
     body = {"type": "Checking", "nickname": nickname, "rewards": 0, "balance": balance}
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            r = await client.post(_u(f"/customers/{customer_id}/accounts"), json=body)
-            if r.status_code not in (200, 201):
-                logger.warning("Nessie create_account returned status %s: %s", r.status_code, r.text)
-                # fallback to demo account
-                acc_id = _demo_id("LOCALACC")
-                if session is not None and balance:
-                    tx = LocalTransaction(account_id=acc_id, amount=float(balance), description="Initial balance (demo)")
-                    session.add(tx)
-                    await session.commit()
-                return acc_id
-            data = r.json()
-            if isinstance(data, dict) and "objectCreated" in data and "_id" in data["objectCreated"]:
-                return data["objectCreated"]["_id"]
-            return data.get("_id") or data["objectCreated"]["_id"]
+        r = await upstream.nessie().post(_u(f"/customers/{customer_id}/accounts"), json=body)
+        if r.status_code not in (200, 201):
+            logger.warning("Nessie create_account returned status %s: %s", r.status_code, r.text)
+            # fallback to demo account
+            metrics.record_fallback("create_account")
+            return await _local_account(balance, session)
+        data = r.json()
+        if isinstance(data, dict) and "objectCreated" in data and "_id" in data["objectCreated"]:
+            return data["objectCreated"]["_id"]
+        return data.get("_id") or data["objectCreated"]["_id"]
     except Exception as e:
         logger.exception("Nessie create_account failed, falling back to demo account: %s", e)
-        acc_id = _demo_id("LOCALACC")
-        if session is not None and balance:
-            tx = LocalTransaction(account_id=acc_id, amount=float(balance), description="Initial balance (demo)")
-            session.add(tx)
-            await session.commit()
-        return acc_id
+        metrics.record_fallback("create_account")
+        return await _local_account(balance, session)
 
 
 async def deposit_to_account(account_id: str, amount: float, session=None) -> dict:
+    """Record a deposit locally and queue it for Nessie.
+
+    The ledger row and the outbox row are committed together, so the request only waits for
+    one local commit; `app.outbox` makes the upstream call in the background (with retries)
+    and the response carries the outbox id to follow it.
+    """
+    if session is None:
+        async with SessionLocal() as own_session:
+            return await deposit_to_account(account_id, amount, session=own_session)
+
     if is_demo():
-        if session is not None:
-            tx = LocalTransaction(account_id=account_id, amount=amount, description="Payroll deposit (demo)")
-            session.add(tx)
-            await session.commit()
+        await ledger.record_transaction(session, account_id, amount, "Payroll deposit (demo)")
+        await session.commit()
         return {"status": "ok", "mode": "demo", "account_id": account_id, "amount": amount, "transaction_date": str(date.today())}
 
     body = {
@@ -111,43 +116,22 @@ async def deposit_to_account(account_id: str, amount: float, session=None) -> di
         "description": "Payroll deposit",
         "amount": amount,
     }
-    try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            r = await client.post(_u(f"/accounts/{account_id}/deposits"), json=body)
-            if r.status_code not in (200, 201):
-                logger.warning("Nessie deposit returned status %s: %s", r.status_code, r.text)
-                # fallback: record local transaction and return demo-like response
-                if session is not None:
-                    tx = LocalTransaction(account_id=account_id, amount=amount, description="Payroll deposit (fallback)")
-                    session.add(tx)
-                    await session.commit()
-                return {"status": "ok", "mode": "fallback", "account_id": account_id, "amount": amount, "transaction_date": str(date.today())}
-            return r.json()
-    except Exception as e:
-        logger.exception("Nessie deposit failed, falling back to demo transaction: %s", e)
-        if session is not None:
-            tx = LocalTransaction(account_id=account_id, amount=amount, description="Payroll deposit (fallback)")
-            session.add(tx)
-            await session.commit()
-        return {"status": "ok", "mode": "fallback", "account_id": account_id, "amount": amount, "transaction_date": str(date.today())}
-
-
-async def ensure_customer_and_account(user, address_dict: dict | None, session=None) -> tuple[str, str]:
-    if user.nessie_customer_id and user.primary_account_id:
-        return user.nessie_customer_id, user.primary_account_id
-
-    cust_id = user.nessie_customer_id
-    if not cust_id:
-        cust_id = await create_customer(user.first_name or "Nombre", user.last_name or "Usuario", address_dict or {})
-        user.nessie_customer_id = cust_id
-
-    acc_id = user.primary_account_id
-    if not acc_id:
-        acc_id = await create_account_for_customer(cust_id, nickname="FinCoach", balance=1000, session=session)
-        user.primary_account_id = acc_id
-
-    if session is not None:
-        session.add(user)
-        await session.commit()
-
-    return cust_id, acc_id
+    tx = await ledger.record_transaction(session, account_id, amount, "Payroll deposit")
+    row = await outbox.enqueue(session, "deposit", account_id, body, transaction_id=tx.id)
+    await session.commit()
+    outbox.outbox_worker.wake()
+    return {"status": "ok", "mode": "queued", "account_id": account_id, "amount": amount, "transaction_date": body["transaction_date"], "outbox_id": row.id}
+
+
+@outbox.outbox_worker.handler("deposit")
+async def _send_deposit(row) -> str | None:
+    r = await upstream.nessie().post(
+        _u(f"/accounts/{row.account_id}/deposits"),
+        content=row.payload,
+        headers={"Content-Type": "application/json", "Idempotency-Key": row.idempotency_key},
+    )
+    r.raise_for_status()
+    data = r.json()
+    if isinstance(data, dict):
+        return (data.get("objectCreated") or {}).get("_id") or data.get("_id")
+    return None
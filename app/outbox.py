@@ -0,0 +1,235 @@
+
+"""Write-behind queue for upstream Nessie calls.
+
+A request writes its local ledger row and an outbox row in one commit and returns; the
+`OutboxWorker` background task then drains due rows in batches, calls the upstream with at
+most `concurrency` requests in flight, and marks each row synced, or reschedules it with
+exponential backoff (failed after `max_attempts`, or at once on a 4xx answer).
+
+Rows are claimed with a conditional UPDATE and a lease, so several workers (processes) can
+drain the same table, and a row claimed by a worker that died is retried once its lease ends.
+Every row carries an idempotency key that is sent upstream with each attempt.
+"""
+import asyncio
+import json
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+import httpx
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import metrics
+from app.config import settings
+from app.database import SessionLocal
+from app.models import NessieOutbox
+
+logger = logging.getLogger(__name__)
+
+PENDING, SENDING, SYNCED, FAILED = "pending", "sending", "synced", "failed"
+
+# kind -> coroutine sending one row upstream and returning the upstream id (if any)
+Sender = Callable[[NessieOutbox], Awaitable[str | None]]
+
+
+async def enqueue(session: AsyncSession, kind: str, account_id: str, payload: dict, transaction_id: int | None = None) -> NessieOutbox:
+    """Add an outbox row in the current transaction (the caller commits, then calls `outbox_worker.wake()`)."""
+    row = NessieOutbox(
+        kind=kind,
+        account_id=account_id,
+        payload=json.dumps(payload),
+        idempotency_key=uuid.uuid4().hex,
+        transaction_id=transaction_id,
+        status=PENDING,
+        next_attempt_at=datetime.utcnow(),
+    )
+    session.add(row)
+    await session.flush()
+    return row
+
+
+def _is_permanent(exc: Exception) -> bool:
+    # the upstream rejected the request itself: retrying the same body will not help
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return 400 <= status < 500 and status not in (408, 429)
+    return False
+
+
+class OutboxWorker:
+    def __init__(
+        self,
+        batch_size: int,
+        concurrency: int,
+        poll_interval: float,
+        backoff_base: float,
+        backoff_max: float,
+        max_attempts: int,
+        lease: float,
+    ):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self._senders: dict[str, Sender] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._next_retry: datetime | None = None  # earliest retry scheduled by this worker
+        self.stats = {"batches": 0, "synced": 0, "retried": 0, "failed": 0, "lease_lost": 0}
+
+    def handler(self, kind: str):
+        """Register the sender for one kind of outbox row."""
+        def register(fn: Sender) -> Sender:
+            self._senders[kind] = fn
+            return fn
+        return register
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        """New rows were committed: drain now instead of at the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.drain_once()
+            except Exception:
+                logger.exception("Outbox batch failed")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue  # probably more due rows: keep going
+            wait = self.poll_interval
+            if self._next_retry is not None:
+                wait = min(wait, max(0.0, (self._next_retry - datetime.utcnow()).total_seconds()))
+                self._next_retry = None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def drain_once(self) -> int:
+        """Claim one batch of due rows, send them and record the outcomes; returns the batch size.
+
+        No connection is held while the upstream calls are in flight: the claimed rows are
+        loaded in the claiming transaction, and the outcomes are written in a new one, each
+        only if this worker still holds the row's claim.
+        """
+        token = uuid.uuid4().hex
+        async with SessionLocal() as session:
+            now = datetime.utcnow()
+            due = (NessieOutbox.status.in_((PENDING, SENDING))) & (NessieOutbox.next_attempt_at <= now)
+            ids = (await session.execute(
+                select(NessieOutbox.id).where(due).order_by(NessieOutbox.id).limit(self.batch_size)
+            )).scalars().all()
+            if not ids:
+                return 0
+            await session.execute(
+                update(NessieOutbox)
+                .where(NessieOutbox.id.in_(ids), due)
+                .values(status=SENDING, claimed_by=token, next_attempt_at=now + timedelta(seconds=self.lease))
+            )
+            rows = (await session.execute(
+                select(NessieOutbox).where(NessieOutbox.claimed_by == token, NessieOutbox.status == SENDING)
+            )).scalars().all()
+            await session.commit()
+        if not rows:
+            return 0
+
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def send(row: NessieOutbox):
+            sender = self._senders.get(row.kind)
+            if sender is None:
+                return LookupError(f"no sender for outbox kind {row.kind!r}")
+            async with sem:
+                try:
+                    return await sender(row)
+                except Exception as e:
+                    return e
+
+        results = await asyncio.gather(*(send(r) for r in rows))
+
+        now = datetime.utcnow()
+        async with SessionLocal() as session:
+            for row, result in zip(rows, results):
+                attempts = row.attempts + 1
+                values = {"attempts": attempts, "claimed_by": None}
+                if not isinstance(result, Exception):
+                    values.update(status=SYNCED, synced_at=now, upstream_id=result, last_error=None)
+                    outcome = "synced"
+                elif _is_permanent(result) or isinstance(result, LookupError) or attempts >= self.max_attempts:
+                    values.update(status=FAILED, last_error=str(result)[:1000])
+                    outcome = "failed"
+                else:
+                    retry_at = now + timedelta(seconds=self._backoff(attempts))
+                    values.update(status=PENDING, last_error=str(result)[:1000], next_attempt_at=retry_at)
+                    outcome = "retried"
+                written = await session.execute(
+                    update(NessieOutbox)
+                    .where(NessieOutbox.id == row.id, NessieOutbox.claimed_by == token)
+                    .values(**values)
+                )
+                if written.rowcount == 0:
+                    # the lease ran out and another worker claimed the row: its outcome wins
+                    logger.warning("Outbox row %s (%s) was claimed by another worker while being sent", row.id, row.kind)
+                    outcome = "lease_lost"
+                elif outcome == "failed":
+                    logger.warning("Outbox row %s (%s) failed for good after %s attempt(s): %s", row.id, row.kind, attempts, result)
+                elif outcome == "retried" and (self._next_retry is None or retry_at < self._next_retry):
+                    self._next_retry = retry_at
+                self.stats[outcome] += 1
+                metrics.outbox_rows.inc(row.kind, outcome)
+            await session.commit()
+        self.stats["batches"] += 1
+        return len(rows)
+
+
+async def summary(session: AsyncSession) -> dict:
+    """Row counts per status and the age of the oldest row still to be synced."""
+    counts = dict((await session.execute(
+        select(NessieOutbox.status, func.count()).group_by(NessieOutbox.status)
+    )).all())
+    oldest = (await session.execute(
+        select(func.min(NessieOutbox.created_at)).where(NessieOutbox.status.in_((PENDING, SENDING)))
+    )).scalar_one()
+    return {
+        "rows": {s: counts.get(s, 0) for s in (PENDING, SENDING, SYNCED, FAILED)},
+        "oldest_unsynced_age_s": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+        "worker": dict(outbox_worker.stats),
+    }
+
+
+outbox_worker = OutboxWorker(
+    batch_size=settings.outbox_batch_size,
+    concurrency=settings.outbox_concurrency,
+    poll_interval=settings.outbox_poll_seconds,
+    backoff_base=settings.outbox_backoff_base_seconds,
+    backoff_max=settings.outbox_backoff_max_seconds,
+    max_attempts=settings.outbox_max_attempts,
+    lease=settings.outbox_lease_seconds,
+)
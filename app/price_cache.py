@@ -0,0 +1,120 @@
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+Fetcher = Callable[[str], Awaitable[dict]]
+
+
+class PriceCache:
+    """In-process price cache keyed by symbol.
+
+    - fresh entries (younger than `ttl`) are served directly;
+    - stale entries (younger than `ttl + stale_ttl`) are served immediately while a single
+      background refresh runs (stale-while-revalidate);
+    - concurrent misses for the same symbol share one upstream fetch (single-flight);
+    - at most `max_size` symbols are kept, least recently used evicted first.
+
+    Only successful fetches are stored: if a refresh fails the last good price keeps being
+    served until it falls out of the stale window, and the caller decides the fallback.
+    """
+
+    def __init__(self, fetch: Fetcher, ttl: float, stale_ttl: float, max_size: int):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "fetches": 0, "errors": 0}
+
+    def peek(self, symbol: str) -> dict | None:
+        entry = self._entries.get(symbol)
+        return entry[1] if entry else None
+
+    async def get(self, symbol: str) -> dict:
+        entry = self._entries.get(symbol)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(symbol)
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self._entries.move_to_end(symbol)
+                self._refresh(symbol)
+                return entry[1]
+
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._refresh(symbol))
+
+    async def refresh(self, symbol: str) -> dict:
+        """Force a (coalesced) upstream fetch, e.g. from the background warmer."""
+        return await asyncio.shield(self._refresh(symbol))
+
+    def _refresh(self, symbol: str) -> asyncio.Task:
+        task = self._inflight.get(symbol)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return task
+        task = asyncio.get_running_loop().create_task(self._load(symbol))
+        self._inflight[symbol] = task
+        return task
+
+    async def _load(self, symbol: str) -> dict:
+        try:
+            self.stats["fetches"] += 1
+            value = await self._fetch(symbol)
+        except Exception:
+            self.stats["errors"] += 1
+            entry = self._entries.get(symbol)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl + self.stale_ttl:
+                return entry[1]
+            raise
+        finally:
+            self._inflight.pop(symbol, None)
+
+        self._entries[symbol] = (time.monotonic(), value)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+
+class PriceRefresher:
+    """Background task that keeps a fixed set of hot symbols warm in a PriceCache."""
+
+    def __init__(self, cache: PriceCache, symbols: list[str], interval: float):
+        self.cache = cache
+        self.symbols = symbols
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None and self.symbols:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            results = await asyncio.gather(*(self.cache.refresh(s) for s in self.symbols), return_exceptions=True)
+            for symbol, res in zip(self.symbols, results):
+                if isinstance(res, Exception):
+                    logger.debug("Price refresh for %s failed: %s", symbol, res)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,80 @@
+"""Give each user a Nessie customer and primary account, once.
+
+`ensure_provisioned` is called by every route that needs the user's account. For a user who
+already has both ids (the usual case, and the ids come with the cached user) it returns
+them without awaiting anything. Otherwise it provisions under a per-user lock, so concurrent
+first requests of one user make a single set of upstream calls, and stores the ids and the
+starting balance in one commit.
+
+Across worker processes the ids are written with a conditional UPDATE: if another process
+provisioned the user first, its ids win and ours are dropped (the upstream customer we
+created is left unused).
+"""
+import asyncio
+import logging
+import weakref
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import nessie_client
+from app.models import User
+from app.security import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+# Starting balance of a new account (recorded in the local ledger for demo accounts)
+INITIAL_BALANCE = 1000
+
+_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _lock_for(user_id: int) -> asyncio.Lock:
+    lock = _locks.get(user_id)
+    if lock is None:
+        lock = _locks[user_id] = asyncio.Lock()
+    return lock
+
+
+def _set_ids(user: User, customer_id: str, account_id: str):
+    # the row already holds these values: don't leave the instance dirty
+    set_committed_value(user, "nessie_customer_id", customer_id)
+    set_committed_value(user, "primary_account_id", account_id)
+
+
+async def ensure_provisioned(user: User, session: AsyncSession, address: dict | None = None) -> tuple[str, str]:
+    """Return the user's (customer id, account id), creating them on first use."""
+    if user.nessie_customer_id and user.primary_account_id:
+        return user.nessie_customer_id, user.primary_account_id
+
+    async with _lock_for(user.id):
+        # another request (or worker) may have finished while we waited
+        cust_id, acc_id = (await session.execute(
+            select(User.nessie_customer_id, User.primary_account_id).where(User.id == user.id)
+        )).one()
+        if cust_id and acc_id:
+            _set_ids(user, cust_id, acc_id)
+            return cust_id, acc_id
+
+        if not cust_id:
+            cust_id = await nessie_client.create_customer(user.first_name or "Nombre", user.last_name or "Usuario", address or {})
+        acc_id = await nessie_client.create_account_for_customer(cust_id, nickname="FinCoach", balance=INITIAL_BALANCE, session=session)
+
+        claimed = await session.execute(
+            update(User)
+            .where(User.id == user.id, User.primary_account_id.is_(None))
+            .values(nessie_customer_id=cust_id, primary_account_id=acc_id)
+        )
+        if claimed.rowcount == 0:
+            # also drops our starting-balance row
+            await session.rollback()
+            await session.refresh(user)
+            logger.info("User %s was provisioned by another worker; keeping account %s", user.id, user.primary_account_id)
+            cust_id, acc_id = user.nessie_customer_id, user.primary_account_id
+        else:
+            await session.commit()
+            _set_ids(user, cust_id, acc_id)
+
+    invalidate_user(user.email)
+    return cust_id, acc_id
@@ -0,0 +1,187 @@
+"""Per-client rate limits and load shedding.
+
+Rate limits are token buckets in the shared store (`app.store`), one per route and client:
+the authenticated user, or the client IP on routes without a user (login). A budget such as
+"30/60" lets a client make 30 requests at once and refills them evenly over 60 seconds; a
+request that finds its bucket empty gets a 429 with Retry-After before the route runs. With
+the memory store the buckets are per worker; with a shared store every worker charges the
+same bucket. Budgets come from the `rate_limit_*` settings; an empty budget turns a limit off.
+
+    @router.post("/advise", dependencies=[Depends(ratelimit.per_user("gemini.advise", settings.rate_limit_advise))])
+
+`LoadShedder` bounds the requests running at once in a worker. Requests beyond
+`load_shed_max_concurrency` queue for a slot; one that would wait longer than
+`load_shed_max_wait_ms`, or finds `load_shed_max_queue` requests already waiting, gets a 503
+instead of adding to a backlog the worker cannot clear.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Callable
+
+from fastapi import Depends, HTTPException, Request, status
+
+from app import metrics
+from app.config import settings
+from app.models import User
+from app.security import get_current_user
+from app.store import store
+
+logger = logging.getLogger(__name__)
+
+Cost = Callable[[Request], float]
+
+
+def parse_budget(budget: str) -> tuple[float, float] | None:
+    """"requests/seconds" -> (capacity, tokens per second); None for an empty budget."""
+    if not budget or not budget.strip():
+        return None
+    try:
+        requests, seconds = (float(part) for part in budget.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid rate limit {budget!r}: expected 'requests/seconds', e.g. '30/60'")
+    if requests <= 0 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit {budget!r}: both numbers must be positive")
+    return requests, requests / seconds
+
+
+async def check(route: str, client: str, budget: tuple[float, float] | None, cost: float = 1):
+    """Charge `client`'s bucket for `route`; raises a 429 when it is empty."""
+    if budget is None or not settings.rate_limit_enabled:
+        return
+    capacity, rate = budget
+    try:
+        wait = await store.take(f"ratelimit:{route}:{client}", capacity, rate, min(cost, capacity))
+    except Exception:
+        # a store outage should not take the API down with it
+        logger.warning("Rate limit store unavailable; letting %s through", route, exc_info=True)
+        return
+    if wait > 0:
+        metrics.rate_limited.inc(route)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, slow down",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    # behind a proxy, run uvicorn with --proxy-headers so this is the forwarded address
+    return request.client.host if request.client else "unknown"
+
+
+def per_user(route: str, budget: str, cost: Cost | None = None):
+    """Dependency limiting the authenticated user to `budget` on `route`.
+
+    `cost(request)` charges expensive variants of a route more than one token.
+    """
+    parsed = parse_budget(budget)
+
+    async def dependency(request: Request, user: User = Depends(get_current_user)):
+        await check(route, f"user:{user.id}", parsed, cost(request) if cost else 1)
+
+    return dependency
+
+
+def per_ip(route: str, budget: str):
+    """Dependency limiting each client IP to `budget` on `route` (for routes without a user)."""
+    parsed = parse_budget(budget)
+
+    async def dependency(request: Request):
+        await check(route, f"ip:{client_ip(request)}", parsed)
+
+    return dependency
+
+
+# long-lived or operational requests that must not hold or wait for a slot
+EXEMPT_PREFIXES = ("/health", "/metrics", "/admin", "/_static", "/nessie/stream", "/nessie/transactions/export")
+# instances built by the app's middleware stack (for /admin/load)
+shedders: list["LoadShedder"] = []
+
+
+class LoadShedder:
+    """ASGI middleware admitting at most `max_concurrency` requests at a time; see the module doc."""
+
+    def __init__(self, app, max_concurrency: int, max_queue: int, max_wait_seconds: float):
+        self.app = app
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        shedders.append(self)
+
+    async def _acquire(self) -> str | None:
+        """Take a slot; returns None once it is held, else the reason it was refused."""
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+        self.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        except BaseException:
+            # cancelled (client gone) right after being handed a slot: pass it on
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            metrics.queue_wait.observe(time.perf_counter() - started)
+        return None
+
+    def _release(self):
+        # hand the slot straight to the oldest live waiter, so arrivals cannot jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.load_shed_enabled or scope["path"].startswith(EXEMPT_PREFIXES):
+            return await self.app(scope, receive, send)
+        refused = await self._acquire()
+        if refused is not None:
+            self.shed += 1
+            metrics.load_shed.inc(refused)
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1")],
+            })
+            await send({"type": "http.response.body", "body": b'{"detail":"Server busy, try again shortly"}'})
+            return
+        self.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+        }
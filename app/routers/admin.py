@@ -0,0 +1,65 @@
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import outbox, ratelimit, upstream
+from app.database import get_session
+from app.advice_cache import advice_cache
+from app.events import broker
+from app.gemini_client import price_cache
+from app.security import require_admin, user_cache
+from app.store import store
+
+# operator endpoints: internal state (caches, outbox rows with account ids and amounts) and
+# controls, all behind the admin token
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/streams")
+async def streams():
+    """Live Server-Sent Event subscribers and slow consumers dropped so far."""
+    return broker.stats()
+
+
+@router.get("/caches")
+async def caches():
+    """Hit/miss counters of the in-process caches, for sizing them."""
+    return {
+        "auth_users": user_cache.stats(),
+        "advice": advice_cache.stats(),
+        "prices": {"size": len(price_cache._entries), "max_size": price_cache.max_size, **price_cache.stats},
+    }
+
+
+@router.get("/upstreams")
+async def upstreams():
+    """Circuit breaker state and adaptive timeout of each upstream."""
+    return {name: breaker.stats() for name, breaker in upstream.breakers.items()}
+
+
+@router.post("/upstreams/{name}/reset")
+async def reset_upstream(name: str):
+    """Close an upstream's circuit now, e.g. after it was fixed."""
+    breaker = upstream.breakers.get(name)
+    if breaker is None:
+        raise HTTPException(status_code=404, detail=f"Unknown upstream: {name}")
+    breaker.reset()
+    return breaker.stats()
+
+
+@router.get("/outbox")
+async def outbox_status(session: AsyncSession = Depends(get_session)):
+    """Backlog of upstream Nessie calls still to be made, and the worker's counters."""
+    return await outbox.summary(session)
+
+
+@router.get("/store")
+async def shared_store():
+    """Backend of the store shared by worker processes, and its message counters (this worker)."""
+    return store.stats()
+
+
+@router.get("/load")
+async def load():
+    """Requests running and queued in this worker, and how many were shed."""
+    return [shedder.stats() for shedder in ratelimit.shedders]
@@ -3,11 +3,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_session
+from app import ratelimit
+from app.config import settings
+from app.database import PoolTimeout, get_session
 from app.models import User
 from app.schemas import RegisterIn, LoginIn, TokenOut, UserOut
-from app.security import get_password_hash, verify_password, create_access_token, get_current_user
-from app.nessie_client import ensure_customer_and_account
+from app.security import hash_password_async, verify_password_async, create_access_token, get_current_user
+from app.provisioning import ensure_provisioned
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -19,7 +21,7 @@ async def register(payload: RegisterIn, session: AsyncSession = Depends(get_sess
 
     user = User(
         email=payload.email,
-        password_hash=get_password_hash(payload.password),
+        password_hash=await hash_password_async(payload.password),
         first_name=payload.first_name or "",
         last_name=payload.last_name or "",
     )
@@ -29,19 +31,19 @@ async def register(payload: RegisterIn, session: AsyncSession = Depends(get_sess
 
     try:
         addr = payload.address.model_dump()
-        await ensure_customer_and_account(user, addr, session=session)
+        await ensure_provisioned(user, session, addr)
     except Exception:
         pass
 
     return {"message": "registered", "id": user.id}
 
-@router.post("/login", response_model=TokenOut)
+@router.post("/login", response_model=TokenOut, dependencies=[Depends(ratelimit.per_ip("auth.login", settings.rate_limit_login))])
 async def login(payload: LoginIn, session: AsyncSession = Depends(get_session)):
     q = await session.execute(select(User).where(User.email == payload.email))
     user = q.scalar_one_or_none()
-    if not user or not verify_password(payload.password, user.password_hash):
+    if not user or not await verify_password_async(payload.password, user.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
-    token = create_access_token(subject=user.email)
+    token = create_access_token(subject=user.email, user_id=user.id)
     return TokenOut(access_token=token)
 
 @router.get("/me", response_model=UserOut)
@@ -52,7 +54,9 @@ async def me(user: User = Depends(get_current_user)):
 async def bootstrap(user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     addr = {"street_number": "123", "street_name": "Main St", "city": "CDMX", "state": "MX", "zip": "01000"}
     try:
-        cust_id, acc_id = await ensure_customer_and_account(user, addr, session=session)
+        cust_id, acc_id = await ensure_provisioned(user, session, addr)
         return {"customer_id": cust_id, "account_id": acc_id}
+    except PoolTimeout:
+        raise  # answered with 503 by app.main
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
 
 from app.security import get_current_user
-from app.database import get_session
-from app.gemini_client import get_price, simulate_trade, generate_recommendations
-from app.models import User, LocalTransaction
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from app.database import PoolTimeout, get_session
+from app.advice_cache import advice_cache
+from app.gemini_client import get_price, get_prices, simulate_trade, generate_recommendations
+from app import analytics, conditional, holdings, ledger, projections, ratelimit
+from app.models import User
+from app.provisioning import ensure_provisioned
+from pydantic import BaseModel, field_validator
+from typing import List, Dict, Any, Literal
 from app.config import settings
 
 router = APIRouter(prefix="/gemini", tags=["gemini"])
@@ -31,11 +35,36 @@ async def price(symbol: str = "BTCUSD"):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+MAX_BATCH_SYMBOLS = 25
+
+
+@router.get("/prices")
+async def prices(symbols: str = "BTCUSD,ETHUSD"):
+    """Return prices for a comma-separated list of symbols in one round-trip.
+
+    Symbols are fetched concurrently; any that fail or time out carry `"fallback": true` and a
+    demo price, and are listed under `fallbacks`.
+    """
+    wanted = [s for s in symbols.split(',') if s.strip()]
+    if not wanted:
+        raise HTTPException(status_code=400, detail="symbols is required")
+    if len(wanted) > MAX_BATCH_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SYMBOLS} symbols per request")
+    quotes = await get_prices(wanted)
+    return {"prices": quotes, "fallbacks": [s for s, q in quotes.items() if q.get("fallback")]}
+
+
 class TradeIn(BaseModel):
     symbol: str
-    side: str
+    side: Literal['buy', 'sell']
     amount_usd: float
 
+    @field_validator("side", mode="before")
+    @classmethod
+    def _lower_side(cls, value):
+        # "BUY" and "Sell" mean the same trade
+        return value.lower() if isinstance(value, str) else value
+
 
 class AdviceIn(BaseModel):
     total_usd: float | None = None
@@ -45,41 +74,129 @@ class AdviceIn(BaseModel):
     risk_profile: str | None = 'balanced'
 
 
-@router.post('/advise')
-async def advise(payload: AdviceIn, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+@router.post('/advise', dependencies=[Depends(ratelimit.per_user('gemini.advise', settings.rate_limit_advise))])
+async def advise(payload: AdviceIn, request: Request, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Investment recommendations for the posted summary.
+
+    The response's ETag covers everything the advice depends on (ledger version, inputs and
+    the market-data bucket); a poll that sends it back in If-None-Match gets a 304 while it
+    still holds.
+    """
     try:
         # take provided summary and enrich with server-side known values (balance, recent txs) when missing
         summary = payload.model_dump()
+        account_id = user.primary_account_id or ''
+
+        # serve a memoized result while the ledger and inputs are unchanged
+        total, ledger_version = (await ledger.get_ledger_state(session, account_id)) if account_id else (0.0, None)
+        cache_key = advice_cache.key(account_id, ledger_version, summary.get('risk_profile'), {**summary, 'user_first_name': user.first_name})
+        tag = conditional.etag('advise', *cache_key)
+        unchanged = conditional.not_modified(request, tag)
+        if unchanged is not None:
+            return unchanged
+        cached = advice_cache.get(cache_key)
+        if cached is not None:
+            return conditional.json_response(request, cached, tag)
 
         # if user has a primary account and total_usd or transactions not provided, compute from local transactions
-        if (summary.get('total_usd') is None or summary.get('transactions') is None) and user.primary_account_id:
-            # compute balance via sum of local transactions
-            q = await session.execute(select(func.coalesce(func.sum(LocalTransaction.amount), 0.0)).where(LocalTransaction.account_id == user.primary_account_id))
-            total = float(q.scalar_one())
+        if (summary.get('total_usd') is None or summary.get('transactions') is None) and account_id:
             if summary.get('total_usd') is None:
                 summary['total_usd'] = total
 
             if summary.get('transactions') is None:
-                txq = await session.execute(select(LocalTransaction).where(LocalTransaction.account_id == user.primary_account_id).order_by(LocalTransaction.created_at.desc()).limit(50))
-                rows = txq.scalars().all()
-                summary['transactions'] = [ { 'id': r.id, 'account_id': r.account_id, 'amount': float(r.amount), 'description': r.description, 'created_at': r.created_at.isoformat() } for r in rows ]
+                # analyse the whole ledger, aggregated per description and month in the database
+                cells = await analytics.load_cells(session, user.primary_account_id)
+                summary['analytics'] = analytics.analyze(cells)
 
         # attach user-friendly info for narrative
         summary['user_first_name'] = user.first_name or ''
         summary['account_id'] = user.primary_account_id or ''
 
         res = await generate_recommendations(summary)
-        return res
+        advice_cache.set(cache_key, res)
+        return conditional.json_response(request, res, tag)
+    except PoolTimeout:
+        raise  # answered with 503 by app.main
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/trade")
+@router.post("/trade", dependencies=[Depends(ratelimit.per_user("gemini.trade", settings.rate_limit_trade))])
 async def trade(payload: TradeIn, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     if payload.amount_usd <= 0:
         raise HTTPException(status_code=400, detail="amount_usd must be positive")
+    await ensure_provisioned(user, session)
     try:
         res = await simulate_trade(user, payload.side, payload.amount_usd, payload.symbol, session=session)
+        await session.commit()
         return res
+    except (holdings.InsufficientHoldings, holdings.UnknownSide) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeout:
+        raise  # answered with 503 by app.main
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/portfolio")
+async def portfolio(user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Value the user's crypto positions at current prices.
+
+    Reads one aggregate row per symbol held (never the trade history) and prices them all in
+    one batched `get_prices` call; quotes that missed the deadline are marked `price_fallback`.
+    """
+    cust_id, acc_id = await ensure_provisioned(user, session)
+    held = await holdings.positions(session, acc_id)
+    quotes = await get_prices([p.symbol for p in held if p.qty > 0]) if held else {}
+    return {"account_id": acc_id, **holdings.value(held, quotes), "ts": datetime.utcnow().isoformat()}
+
+
+class ProjectionIn(BaseModel):
+    initial_usd: float | None = None
+    monthly_contribution: float | None = None
+    years: int = 30
+    paths: int = 10000
+    risk_profile: str | None = 'balanced'
+    allocation: Dict[str, float] | None = None  # weights per asset (SPY, BND, BTC, ETH); overrides risk_profile
+    percentiles: List[float] | None = None
+    seed: int | None = None
+
+
+@router.post("/projections", dependencies=[Depends(ratelimit.per_user("gemini.projections", settings.rate_limit_projections))])
+async def projection(payload: ProjectionIn, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Monte Carlo projection of savings invested in the recommended allocation.
+
+    Defaults: the account balance as the starting amount, and the estimated monthly surplus
+    (income - expenses from the ledger analytics) as the monthly contribution. Returns the
+    percentile bands of the portfolio value for every month.
+    """
+    if not 1 <= payload.years <= settings.projection_max_years:
+        raise HTTPException(status_code=400, detail=f"years must be between 1 and {settings.projection_max_years}")
+    if not 100 <= payload.paths <= settings.projection_max_paths:
+        raise HTTPException(status_code=400, detail=f"paths must be between 100 and {settings.projection_max_paths}")
+    percentiles = payload.percentiles or list(projections.DEFAULT_PERCENTILES)
+    if len(percentiles) > 9 or not all(0 <= p <= 100 for p in percentiles):
+        raise HTTPException(status_code=400, detail="percentiles: at most 9 values between 0 and 100")
+    weights = payload.allocation or projections.allocation_for(payload.risk_profile)
+    if any(a not in projections.ASSETS or w < 0 for a, w in weights.items()) or sum(weights.values()) <= 0:
+        raise HTTPException(status_code=400, detail=f"allocation: non-negative weights for {', '.join(projections.ASSETS)}")
+
+    initial, contribution = payload.initial_usd, payload.monthly_contribution
+    account_id = user.primary_account_id
+    if account_id and initial is None:
+        initial, _ = await ledger.get_ledger_state(session, account_id)
+    if account_id and contribution is None:
+        stats = analytics.analyze(await analytics.load_cells(session, account_id))
+        contribution = max(0.0, stats['monthly_income'] - stats['monthly_expenses'])
+    initial, contribution = max(0.0, float(initial or 0.0)), float(contribution or 0.0)
+
+    result = await projections.project(
+        initial=initial,
+        monthly_contribution=contribution,
+        months=payload.years * 12,
+        paths=payload.paths,
+        weights=weights,
+        percentiles=sorted(percentiles),
+        seed=payload.seed,
+    )
+    return {"risk_profile": (payload.risk_profile or 'balanced').lower(), "initial_usd": round(initial, 2), "monthly_contribution": round(contribution, 2), **result}
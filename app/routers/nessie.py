@@ -1,34 +1,53 @@
 
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import pickle
+import tempfile
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
 
-from app.security import get_current_user
-from app.models import User, LocalTransaction
-from app.database import get_session
-from app.nessie_client import ensure_customer_and_account, deposit_to_account
-from app.schemas import PaycheckIn
+from app.security import create_stream_token, get_current_user, get_current_user_from_stream_token
+from app import conditional, ledger, ratelimit
+from app.events import broker
+from app.config import settings
+from app.models import User
+from app.database import PoolTimeout, get_session, SessionLocal
+from app.nessie_client import deposit_to_account
+from app.provisioning import ensure_provisioned
+from app.schemas import PaycheckIn, TransactionIn
 
 router = APIRouter(prefix="/nessie", tags=["nessie"])
 
 
 @router.post("/simulate-paycheck")
 async def simulate_paycheck(payload: PaycheckIn, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    cust_id, acc_id = await ensure_customer_and_account(user, {"street_number":"1","street_name":"Main","city":"CDMX","state":"MX","zip":"01000"}, session=session)
+    cust_id, acc_id = await ensure_provisioned(user, session, {"street_number":"1","street_name":"Main","city":"CDMX","state":"MX","zip":"01000"})
     try:
         dep = await deposit_to_account(acc_id, payload.amount, session=session)
         return {"status": "ok", "deposit": dep}
+    except PoolTimeout:
+        raise  # answered with 503 by app.main
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Nessie error: {e}")
 
 
 @router.get("/balance")
-async def get_balance(user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    """Return the user's primary account computed balance (demo mode sums local transactions)."""
-    cust_id, acc_id = await ensure_customer_and_account(user, None, session=session)
-    q = await session.execute(select(func.coalesce(func.sum(LocalTransaction.amount), 0.0)).where(LocalTransaction.account_id == acc_id))
-    total = q.scalar_one()
-    return {"account_id": acc_id, "balance": float(total)}
+async def get_balance(request: Request, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Return the user's primary account balance (materialized from local transactions).
+
+    The ETag follows the ledger version, so an unchanged balance revalidates with a 304.
+    """
+    cust_id, acc_id = await ensure_provisioned(user, session)
+    total, version = await ledger.get_ledger_state(session, acc_id)
+    tag = conditional.etag("balance", acc_id, version)
+    unchanged = conditional.not_modified(request, tag)
+    if unchanged is not None:
+        return unchanged
+    return conditional.json_response(request, {"account_id": acc_id, "balance": total}, tag)
 
 
 from pydantic import BaseModel
@@ -43,28 +62,267 @@ class TransferIn(BaseModel):
 @router.post("/transfer")
 async def transfer(payload: TransferIn, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     """Simulate a transfer: create a negative transaction for the sender and a positive transaction for the receiver (demo)."""
-    cust_id, acc_id = await ensure_customer_and_account(user, None, session=session)
+    cust_id, acc_id = await ensure_provisioned(user, session)
     if payload.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     # create debit on user's account
-    debit = LocalTransaction(account_id=acc_id, amount=-float(payload.amount), description=payload.description or "Transfer out")
-    session.add(debit)
+    await ledger.record_transaction(session, acc_id, -float(payload.amount), payload.description or "Transfer out")
     # create credit on target account (in demo we just add a local tx)
-    credit = LocalTransaction(account_id=payload.to_account_id, amount=float(payload.amount), description=payload.description or "Transfer in")
-    session.add(credit)
+    await ledger.record_transaction(session, payload.to_account_id, float(payload.amount), payload.description or "Transfer in")
     await session.commit()
     return {"status": "ok", "from": acc_id, "to": payload.to_account_id, "amount": payload.amount}
 
 
-@router.get("/transactions")
-async def list_transactions(limit: int = 50, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    """Return recent transactions for the user's primary account (desc by created_at)."""
-    cust_id, acc_id = await ensure_customer_and_account(user, None, session=session)
-    q = await session.execute(select(LocalTransaction).where(LocalTransaction.account_id == acc_id).order_by(LocalTransaction.created_at.desc()).limit(limit))
-    rows = q.scalars().all()
+def _page_cost(request: Request) -> float:
+    # a token per 50 rows requested, so large pages spend the budget faster
+    try:
+        limit = int(request.query_params.get("limit", 50))
+    except ValueError:
+        return 1
+    return max(1, min(limit, settings.transactions_max_page_size) // 50)
+
+
+@router.get("/transactions", dependencies=[Depends(ratelimit.per_user("nessie.transactions", settings.rate_limit_transactions, cost=_page_cost))])
+async def list_transactions(request: Request, limit: int = Query(50, ge=1), cursor: str | None = None, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Return a page of transactions for the user's primary account (desc by created_at).
+
+    Pass the returned `next_cursor` back as `cursor` to fetch the following page; `limit` is
+    capped at `settings.transactions_max_page_size`. While the ledger is unchanged a request
+    carrying the page's ETag gets a 304 without the rows being read.
+    """
+    cust_id, acc_id = await ensure_provisioned(user, session)
+    limit = min(limit, settings.transactions_max_page_size)
+    _, version = await ledger.get_ledger_state(session, acc_id)
+    tag = conditional.etag("transactions", acc_id, version, limit, cursor)
+    unchanged = conditional.not_modified(request, tag)
+    if unchanged is not None:
+        return unchanged
+    try:
+        rows, next_cursor = await ledger.list_transactions(session, acc_id, limit, cursor)
+    except ledger.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     # simple serializable output
-    out = [
-        {"id": r.id, "account_id": r.account_id, "amount": float(r.amount), "description": r.description, "created_at": r.created_at.isoformat()}
-        for r in rows
-    ]
-    return {"account_id": acc_id, "transactions": out}
+    out = [ledger.serialize(r) for r in rows]
+    return conditional.json_response(request, {"account_id": acc_id, "transactions": out, "next_cursor": next_cursor}, tag)
+
+
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+_transaction_list = TypeAdapter(list[TransactionIn])
+
+
+class InvalidRow(ValueError):
+    def __init__(self, line: int, error: ValidationError):
+        super().__init__(f"line {line}")
+        self.line = line
+        self.error = error
+
+
+def _parse_row(line_no: int, line: bytes) -> TransactionIn:
+    try:
+        return TransactionIn.model_validate_json(line)
+    except ValidationError as e:
+        raise InvalidRow(line_no, e)
+
+
+async def _spool_body(request: Request):
+    """Receive the whole request body into a temporary file (kept in memory up to
+    `settings.bulk_ingest_spool_bytes`, then on disk); 413 beyond `bulk_ingest_max_bytes`."""
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.bulk_ingest_spool_bytes)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > settings.bulk_ingest_max_bytes:
+            spool.close()
+            raise HTTPException(status_code=413, detail=f"At most {settings.bulk_ingest_max_bytes} bytes per request")
+        spool.write(chunk)
+    return spool
+
+
+def _ndjson_rows(spool) -> Iterator[TransactionIn]:
+    spool.seek(0)
+    for line_no, line in enumerate(spool, 1):
+        if line.strip():
+            yield _parse_row(line_no, line)
+
+
+def _batches(rows: Iterable[TransactionIn], size: int) -> Iterator[list[TransactionIn]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Row(NamedTuple):
+    """A validated NDJSON row as stashed between validation and insert."""
+    amount: float
+    description: str
+    created_at: datetime | None
+
+
+def _stash_batches(rows: Iterable[TransactionIn], size: int, max_rows: int):
+    """Validate every row and write them, pickled as plain tuples `size` at a time, to a
+    temporary file; 413 beyond `max_rows`. Reading a batch back is much cheaper than parsing
+    and validating its lines again."""
+    stash = tempfile.SpooledTemporaryFile(max_size=settings.bulk_ingest_spool_bytes)
+    count = 0
+    try:
+        for batch in _batches(rows, size):
+            count += len(batch)
+            if count > max_rows:
+                raise HTTPException(status_code=413, detail=f"At most {max_rows} rows per request")
+            pickle.dump([(r.amount, r.description, r.created_at) for r in batch], stash, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        stash.close()
+        raise
+    return stash
+
+
+def _stashed_batches(stash) -> Iterator[list[_Row]]:
+    stash.seek(0)
+    while True:
+        try:
+            batch = pickle.load(stash)
+        except EOFError:
+            return
+        yield [_Row._make(r) for r in batch]
+
+
+@router.post("/transactions/bulk")
+async def bulk_ingest(request: Request, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Import many transactions into the user's primary account in one database transaction.
+
+    The body is either a JSON array of `TransactionIn` or NDJSON (one object per line, with an
+    `application/x-ndjson` content type). The whole body is received (at most
+    `bulk_ingest_max_bytes`) and validated before the first insert, so a slow upload never holds
+    the database writer and an invalid row rejects the import without writing anything. Rows
+    are then inserted in batched executemany calls and the materialized balance is updated once
+    at the end.
+    """
+    cust_id, acc_id = await ensure_provisioned(user, session)
+    # nothing written yet: hand the connection back while the body arrives
+    await session.commit()
+    batch_size = settings.bulk_ingest_batch_size
+    max_rows = settings.bulk_ingest_max_rows
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    spool = await _spool_body(request)
+    stash = None
+    try:
+        try:
+            if content_type in NDJSON_CONTENT_TYPES:
+                stash = _stash_batches(_ndjson_rows(spool), batch_size, max_rows)
+                batches: Iterable[list] = _stashed_batches(stash)
+            else:
+                spool.seek(0)
+                rows = _transaction_list.validate_json(spool.read())
+                if len(rows) > max_rows:
+                    raise HTTPException(status_code=413, detail=f"At most {max_rows} rows per request")
+                batches = _batches(rows, batch_size)
+        except InvalidRow as e:
+            raise HTTPException(status_code=422, detail=f"Invalid transaction (line {e.line}): {e.error.errors(include_url=False)}")
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid transaction: {e.errors(include_url=False)}")
+        finally:
+            # everything needed for the inserts is validated by now
+            spool.close()
+
+        inserted = 0
+        total = 0.0
+        try:
+            for batch in batches:
+                total += await ledger.insert_batch(session, acc_id, batch)
+                inserted += len(batch)
+            if inserted:
+                await ledger.apply_batch_to_balance(session, acc_id, total)
+                await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+    finally:
+        if stash is not None:
+            stash.close()
+    return {"status": "ok", "account_id": acc_id, "inserted": inserted, "total_amount": round(total, 2)}
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@router.get("/transactions/export")
+async def export_transactions(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Stream the full ledger of the user's primary account as NDJSON or CSV."""
+    cust_id, acc_id = await ensure_provisioned(user, session)
+
+    async def body():
+        # the request session is closed before the response streams, so use a dedicated one
+        async with SessionLocal() as export_session:
+            async for chunk in ledger.export_rows(export_session, acc_id, format):
+                yield chunk
+
+    filename = f"transactions-{acc_id}.{format}"
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _balance_event(account_id: str) -> str:
+    async with SessionLocal() as s:
+        balance, version = await ledger.get_ledger_state(s, account_id)
+    return _sse("balance", {"account_id": account_id, "balance": balance, "last_transaction_id": version})
+
+
+@router.post("/stream/token")
+async def stream_token(user: User = Depends(get_current_user)):
+    """A token for opening /nessie/stream, valid for `settings.stream_token_expire_seconds` and
+    for nothing else; fetch a new one for every (re)connect."""
+    return {"token": create_stream_token(user.email, user.id), "expires_in": settings.stream_token_expire_seconds}
+
+
+@router.get("/stream")
+async def stream(user: User = Depends(get_current_user_from_stream_token), session: AsyncSession = Depends(get_session)):
+    """Server-Sent Events for the user's primary account.
+
+    Sends the current `balance` on connect, then a `transaction` event per new ledger row and
+    an updated `balance` after every commit that touches the account. `resync` asks the client
+    to refetch (bulk imports, or the subscriber fell behind and was dropped). Since EventSource
+    cannot set headers, a token from POST /nessie/stream/token may be passed as `?token=`;
+    access tokens are not accepted there, so none end up in access logs.
+    """
+    cust_id, acc_id = await ensure_provisioned(user, session)
+
+    async def body():
+        sub = broker.subscribe(acc_id)
+        try:
+            yield "retry: 3000\n\n"
+            yield await _balance_event(acc_id)
+            while True:
+                if sub.closed:
+                    yield _sse("resync", {"account_id": acc_id, "reason": "slow-consumer"})
+                    break
+                event = await sub.get(timeout=settings.sse_keepalive_seconds)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["rows"] is None:
+                    yield _sse("resync", {"account_id": acc_id, "reason": "bulk"})
+                else:
+                    for row in event["rows"]:
+                        yield _sse("transaction", row)
+                yield await _balance_event(acc_id)
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
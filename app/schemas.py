@@ -1,5 +1,6 @@
 
-from pydantic import BaseModel, EmailStr, Field
+from datetime import datetime, timezone
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 class AddressIn(BaseModel):
     street_number: str
@@ -35,3 +36,17 @@ class UserOut(BaseModel):
 
 class PaycheckIn(BaseModel):
     amount: float = Field(gt=0)
+
+class TransactionIn(BaseModel):
+    """One ledger row for bulk ingest (e.g. an imported bank statement line)."""
+    amount: float
+    description: str = Field(default="Imported transaction", max_length=255)
+    created_at: datetime | None = None
+
+    @field_validator("created_at")
+    @classmethod
+    def _naive_utc(cls, value: datetime | None) -> datetime | None:
+        # the ledger stores naive UTC: convert offsets rather than dropping them
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
@@ -1,20 +1,31 @@
 
+import asyncio
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy import select
+from sqlalchemy import select, inspect
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
+from app.cache import LRUCache
 from app.config import settings
 from app.database import get_session
 from app.models import User
+from app.store import store
 
 # Use pbkdf2_sha256 to avoid needing native bcrypt bindings in some envs
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 bearer_scheme = HTTPBearer()
+optional_bearer_scheme = HTTPBearer(auto_error=False)
+
+# Column snapshots of recently authenticated users, keyed by token subject (email).
+# Entries expire after auth_cache_ttl_seconds and are dropped explicitly (in every worker) when a user row changes.
+user_cache = LRUCache(max_size=settings.auth_cache_max_users, ttl=settings.auth_cache_ttl_seconds)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -22,28 +33,132 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
-def create_access_token(subject: str, expires_minutes: int | None = None) -> str:
+# pbkdf2 takes tens of ms of CPU; run it off the event loop (hashlib releases the GIL while hashing)
+_hash_executor: ThreadPoolExecutor | None = None
+_hash_pending = 0
+
+async def _run_hashing(fn, *args):
+    global _hash_executor, _hash_pending
+    if _hash_pending >= settings.password_hash_workers + settings.password_hash_max_queue:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="pwhash")
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    return await _run_hashing(verify_password, plain, hashed)
+
+def shutdown_hash_pool():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False)
+        _hash_executor = None
+
+def create_access_token(subject: str, expires_minutes: int | None = None, user_id: int | None = None) -> str:
     to_encode = {"sub": subject, "iat": int(datetime.utcnow().timestamp())}
+    if user_id is not None:
+        # lets get_current_user load the user by primary key
+        to_encode["uid"] = user_id
     expire = datetime.utcnow() + timedelta(minutes=expires_minutes or settings.access_token_expire_minutes)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm="HS256")
     return encoded_jwt
 
-async def get_current_user(
-    creds: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-    session: AsyncSession = Depends(get_session),
-) -> User:
-    token = creds.credentials
+# EventSource cannot set headers, so the stream takes its token in the URL, where access logs
+# keep it: those tokens are short-lived and carry this scope, which only the stream accepts
+STREAM_SCOPE = "stream"
+
+def create_stream_token(subject: str, user_id: int | None = None) -> str:
+    now = datetime.utcnow()
+    to_encode = {"sub": subject, "iat": int(now.timestamp()), "scope": STREAM_SCOPE}
+    if user_id is not None:
+        to_encode["uid"] = user_id
+    to_encode["exp"] = now + timedelta(seconds=settings.stream_token_expire_seconds)
+    return jwt.encode(to_encode, settings.secret_key, algorithm="HS256")
+
+def _snapshot(user: User) -> dict:
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+def cache_user(user: User):
+    user_cache.set(user.email, _snapshot(user))
+
+AUTH_INVALIDATE_CHANNEL = "auth.invalidate"
+
+def invalidate_user(email: str):
+    # every worker holds its own user_cache
+    store.publish_nowait(AUTH_INVALIDATE_CHANNEL, {"email": email})
+
+def _drop_cached_user(message: dict):
+    user_cache.pop(message["email"])
+
+store.subscribe(AUTH_INVALIDATE_CHANNEL, _drop_cached_user)
+
+async def _load_user(session: AsyncSession, email: str, user_id: int | None) -> User | None:
+    if user_id is not None:
+        user = await session.get(User, user_id)
+        return user if user is not None and user.email == email else None
+    result = await session.execute(select(User).where(User.email == email))
+    return result.scalar_one_or_none()
+
+async def _user_from_token(token: str, session: AsyncSession, scope: Optional[str] = None) -> User:
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=["HS256"])
         email: Optional[str] = payload.get("sub")
-        if email is None:
+        user_id: Optional[int] = payload.get("uid")
+        if email is None or payload.get("scope") != scope:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
 
-    result = await session.execute(select(User).where(User.email == email))
-    user = result.scalar_one_or_none()
+    cached = user_cache.get(email)
+    if cached is not None:
+        # attach a copy to this request's session without a SELECT
+        user = User(**cached)
+        make_transient_to_detached(user)
+        return await session.merge(user, load=False)
+
+    user = await _load_user(session, email, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    cache_user(user)
     return user
+
+async def get_current_user(
+    creds: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    session: AsyncSession = Depends(get_session),
+) -> User:
+    return await _user_from_token(creds.credentials, session)
+
+async def get_current_user_from_stream_token(
+    token: Optional[str] = Query(None, description="Stream token from POST /nessie/stream/token, for clients that cannot set headers (EventSource)"),
+    creds: Optional[HTTPAuthorizationCredentials] = Depends(optional_bearer_scheme),
+    session: AsyncSession = Depends(get_session),
+) -> User:
+    """Like get_current_user, but also accepts a stream token (`create_stream_token`) as a
+    `token` query parameter. Access tokens are only taken from the Authorization header."""
+    if creds:
+        return await _user_from_token(creds.credentials, session)
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return await _user_from_token(token, session, scope=STREAM_SCOPE)
+
+def require_admin(x_admin_token: Optional[str] = Header(None, description="Operator token (settings.admin_token)")):
+    """Guard for operator endpoints: the X-Admin-Token header must equal settings.admin_token.
+
+    With no admin_token configured the endpoints are closed to everybody.
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin API disabled: set ADMIN_TOKEN")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), settings.admin_token.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token")
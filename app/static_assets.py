@@ -0,0 +1,243 @@
+"""Static frontend assets: content-hashed, precompressed and served from memory.
+
+`build` reads the web files under the frontend directory once and, for every asset (CSS, JS,
+images, fonts):
+
+- names a copy after its content hash (`style.css` -> `style.3f2a9c0b1d.css`), which can be
+  cached forever (`Cache-Control: immutable`) because a change produces a new name;
+- keeps gzip and (with the optional `brotli` package) brotli encodings of text types when
+  they are smaller.
+
+HTML pages are rewritten to reference the hashed names and are served with `no-cache`, so
+browsers revalidate the page (a 304 when unchanged) and fetch a changed asset under its new
+name. Every response carries a strong ETag per representation and honours If-None-Match.
+
+`StaticAssets` is the ASGI app mounted at /_static. `python -m app.static_assets build --out DIR`
+writes the same files (with .gz/.br siblings and a manifest.json) for serving from nginx or a CDN.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import sys
+from dataclasses import dataclass, field
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip copies are built
+    brotli = None
+
+ASSET_EXTENSIONS = {".css", ".js", ".gif", ".png", ".jpg", ".jpeg", ".svg", ".ico", ".webp", ".woff", ".woff2"}
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "image/svg+xml")
+MAX_FILE_BYTES = 10 * 1024 * 1024
+SKIP_DIRS = {"node_modules", "venv", "env", "site-packages", "__pycache__"}
+# a subdirectory holding one of these is a Python project or environment (e.g. this backend), not web files
+SKIP_MARKERS = ("pyvenv.cfg", "conda-meta", "setup.py", "pyproject.toml", "requirements.txt")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_REF = re.compile(r"""(\b(?:href|src)\s*=\s*)(["'])([^"'#?:]+)\2""", re.IGNORECASE)
+
+
+@dataclass
+class Asset:
+    path: str  # served path relative to the mount, e.g. "style.3f2a9c0b1d.css"
+    source: str  # file it was built from, relative to the frontend directory
+    media_type: str
+    cache_control: str
+    etag: str
+    # content-coding ("identity", "br", "gzip") -> body
+    bodies: dict[str, bytes] = field(default_factory=dict)
+
+
+def _hashed_name(rel: str, digest: str) -> str:
+    root, ext = posixpath.splitext(rel)
+    return f"{root}.{digest[:10]}{ext}"
+
+
+def _media_type(rel: str) -> str:
+    if rel.endswith(".js"):
+        return "application/javascript"
+    return mimetypes.guess_type(rel)[0] or "application/octet-stream"
+
+
+def _encode(data: bytes, media_type: str) -> dict[str, bytes]:
+    bodies = {"identity": data}
+    if media_type.startswith(COMPRESSIBLE_TYPES) and len(data) > 256:
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data):
+                bodies["br"] = br
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) < len(data):
+            bodies["gzip"] = gz
+    return bodies
+
+
+def _is_python_tree(path: str) -> bool:
+    return any(os.path.exists(os.path.join(path, marker)) for marker in SKIP_MARKERS)
+
+
+def _sources(root: str):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith((".", "_")) and d not in SKIP_DIRS and not _is_python_tree(os.path.join(dirpath, d)))
+        for name in sorted(filenames):
+            full = os.path.join(dirpath, name)
+            ext = os.path.splitext(name)[1].lower()
+            if (ext in ASSET_EXTENSIONS or ext == ".html") and os.path.getsize(full) <= MAX_FILE_BYTES:
+                yield os.path.relpath(full, root).replace(os.sep, "/"), full
+
+
+def _rewrite_html(html: str, page: str, hashed: dict[str, str], url_prefix: str) -> str:
+    base = posixpath.dirname(page)
+
+    def sub(m: re.Match) -> str:
+        ref = m.group(3)
+        target = posixpath.normpath(posixpath.join(base, ref))
+        if ref.startswith("/") or target not in hashed:
+            return m.group(0)
+        return f"{m.group(1)}{m.group(2)}{url_prefix}{hashed[target]}{m.group(2)}"
+
+    return _REF.sub(sub, html)
+
+
+def build(root: str, url_prefix: str = "/_static/") -> dict[str, Asset]:
+    """Read and encode the frontend under `root`; returns served path -> Asset.
+
+    Pages reference the hashed assets as `url_prefix` + hashed path, so they work from any
+    URL (the root page is also served at /).
+    """
+    assets: dict[str, Asset] = {}
+    hashed: dict[str, str] = {}
+    pages: list[tuple[str, str]] = []
+    for rel, full in _sources(root):
+        if rel.endswith(".html"):
+            pages.append((rel, full))
+            continue
+        with open(full, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        media_type = _media_type(rel)
+        bodies = _encode(data, media_type)
+        hashed[rel] = _hashed_name(rel, digest)
+        assets[hashed[rel]] = Asset(hashed[rel], rel, media_type, IMMUTABLE, digest[:20], bodies)
+        # the original name keeps working (e.g. links from outside), revalidated like a page
+        assets[rel] = Asset(rel, rel, media_type, REVALIDATE, digest[:20], bodies)
+
+    for rel, full in pages:
+        with open(full, encoding="utf-8") as f:
+            data = _rewrite_html(f.read(), rel, hashed, url_prefix).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        assets[rel] = Asset(rel, rel, "text/html; charset=utf-8", REVALIDATE, digest[:20], _encode(data, "text/html"))
+    return assets
+
+
+def _accepted(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        try:
+            if q.startswith("q=") and float(q[2:]) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison: W/"x" matches "x"
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+class StaticAssets:
+    """ASGI app serving the output of `build` for GET and HEAD."""
+
+    def __init__(self, assets: dict[str, Asset], index: str = "index.html"):
+        self.assets = assets
+        self.index = index
+
+    def lookup(self, path: str) -> Asset | None:
+        path = path.lstrip("/")
+        return self.assets.get(path or self.index) or self.assets.get(posixpath.join(path, self.index))
+
+    async def __call__(self, scope, receive, send):
+        path, root = scope["path"], scope.get("root_path", "")
+        asset = self.lookup(path[len(root):] if path.startswith(root) else path)
+        if asset is None:
+            return await _plain(send, 404, b"Not Found")
+        if scope["method"] not in ("GET", "HEAD"):
+            return await _plain(send, 405, b"Method Not Allowed", [(b"allow", b"GET, HEAD")])
+
+        request_headers = dict(scope["headers"])
+        accepted = _accepted(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        coding = next((c for c in ("br", "gzip") if c in asset.bodies and c in accepted), "identity")
+        etag = f'"{asset.etag}"' if coding == "identity" else f'"{asset.etag}-{coding}"'
+        headers = [
+            (b"etag", etag.encode()),
+            (b"cache-control", asset.cache_control.encode()),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if_none_match = request_headers.get(b"if-none-match")
+        if if_none_match is not None and _etag_matches(if_none_match.decode("latin-1"), etag):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        body = asset.bodies[coding]
+        headers += [(b"content-type", asset.media_type.encode()), (b"content-length", str(len(body)).encode())]
+        if coding != "identity":
+            headers.append((b"content-encoding", coding.encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+
+async def _plain(send, status: int, body: bytes, headers: list | None = None):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain"), *(headers or [])]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def write(assets: dict[str, Asset], out: str) -> dict:
+    """Write the hashed files and pages with their .br/.gz siblings, and manifest.json."""
+    manifest = {}
+    os.makedirs(out, exist_ok=True)
+    for path, asset in assets.items():
+        if asset.cache_control == REVALIDATE and not asset.media_type.startswith("text/html"):
+            continue  # original asset names: only the hashed copies are written
+        for coding, suffix in (("identity", ""), ("br", ".br"), ("gzip", ".gz")):
+            if coding in asset.bodies:
+                target = os.path.join(out, path + suffix)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as f:
+                    f.write(asset.bodies[coding])
+        if asset.cache_control == IMMUTABLE:
+            manifest[asset.source] = path
+    with open(os.path.join(out, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _main(argv: list[str]) -> int:
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(prog="python -m app.static_assets", description="Build the hashed, precompressed frontend")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--src", default=settings.frontend_dir)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--url-prefix", default="/_static/", help="URL the output directory will be served under")
+    args = parser.parse_args(argv)
+    assets = build(args.src, args.url_prefix)
+    manifest = write(assets, args.out)
+    for original, hashed in sorted(manifest.items()):
+        print(f"{original} -> {hashed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,282 @@
+"""State shared by the worker processes: keys with a TTL, counters and pub/sub channels.
+
+`settings.shared_store` picks the backend:
+
+    memory               in-process (the default; right for a single worker)
+    sqlite:///path.db    a SQLite file every worker on the host opens; a local stand-in for
+                         a networked store such as Redis, with pub/sub done by polling
+
+Messages published on a channel reach the subscribers in every process, including the
+publisher's own. In-process caches use this to drop entries another worker invalidated, and
+ledger commit listeners (`ledger.on_commit`) and the SSE broker to see every worker's writes.
+
+`take` charges a token bucket (used by the rate limits in `app.ratelimit`); like `incr` it is
+atomic across processes.
+
+A backend implements `get`, `set`, `delete`, `incr`, `take`, `publish_nowait`, `start`, `stop`
+and `stats`; subscriptions and dispatch come from `Store`.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], None]
+
+
+def _refill(state: tuple[float, float] | None, capacity: float, rate: float, cost: float, now: float) -> tuple[tuple[float, float], float]:
+    """Token bucket step: returns the new (tokens, timestamp) state and the seconds to wait
+    (0 when `cost` tokens were taken)."""
+    tokens = capacity if state is None else min(capacity, state[0] + (now - state[1]) * rate)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / rate
+
+
+class Store:
+    # whether other processes see this store (False for the in-process default)
+    shared = False
+
+    def __init__(self):
+        self._handlers: dict[str, list[Handler]] = defaultdict(list)
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Call `handler(message)` on the event loop for every message on `channel`."""
+        self._handlers[channel].append(handler)
+
+    def _dispatch(self, channel: str, message: dict):
+        for handler in self._handlers.get(channel, ()):
+            self.delivered += 1
+            try:
+                handler(message)
+            except Exception:
+                logger.exception("Store subscriber for %s failed", channel)
+
+    async def publish(self, channel: str, message: dict):
+        self.publish_nowait(channel, message)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class MemoryStore(Store):
+    def __init__(self):
+        super().__init__()
+        self._data: dict[str, tuple[Any, float]] = {}
+
+    def _live(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at and expires_at < time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    async def get(self, key: str) -> str | None:
+        entry = self._live(key)
+        return None if entry is None else entry[0]
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        self._data[key] = (value, time.time() + ttl if ttl else 0.0)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def incr(self, key: str, amount: float = 1, ttl: float | None = None) -> float:
+        """Add to a counter and return the new value; `ttl` applies when the counter is created."""
+        entry = self._live(key)
+        if entry is None:
+            entry = (0, time.time() + ttl if ttl else 0.0)
+        value = float(entry[0]) + amount
+        self._data[key] = (value, entry[1])
+        return value
+
+    async def take(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        """Take `cost` tokens from the bucket at `key` (holding up to `capacity`, refilled at
+        `rate` per second). Returns 0 if they were taken, else the seconds until they would be."""
+        # no await between reading and writing the bucket, so this is atomic on the event loop
+        now = time.time()
+        entry = self._live(key)
+        state, wait = _refill(entry and entry[0], capacity, rate, cost, now)
+        # an idle bucket is full again after capacity / rate seconds: no need to keep it
+        self._data[key] = (state, now + capacity / rate)
+        return wait
+
+    def publish_nowait(self, channel: str, message: dict):
+        self.published += 1
+        self._dispatch(channel, message)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self._data), "published": self.published, "delivered": self.delivered}
+
+
+class SQLiteStore(Store):
+    """Store in a SQLite file shared by the processes on one host.
+
+    All file access runs on one dedicated thread per process. Messages go to a table that each
+    process polls every `poll_interval` seconds, and are pruned after `message_ttl` seconds.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, poll_interval: float = 0.05, message_ttl: float = 60.0):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.message_ttl = message_ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-store")
+        self._conn: sqlite3.Connection | None = None
+        self._last_id = 0
+        self._task: asyncio.Task | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value, expires_at REAL NOT NULL DEFAULT 0)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "channel TEXT NOT NULL, body TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _get(self, key: str):
+        row = self._db().execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] and row[1] < time.time()):
+            return None
+        return row[0]
+
+    async def get(self, key: str) -> str | None:
+        return await self._call(self._get, key)
+
+    def _set(self, key: str, value, ttl: float | None):
+        self._db().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else 0),
+        )
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        await self._call(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._call(lambda: self._db().execute("DELETE FROM kv WHERE key = ?", (key,)))
+
+    def _incr(self, key: str, amount: float, ttl: float | None) -> float:
+        now = time.time()
+        # one statement, so concurrent processes cannot lose an increment
+        row = self._db().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?1, ?2, ?3) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN kv.expires_at AND kv.expires_at < ?4 THEN ?2 ELSE kv.value + ?2 END, "
+            "expires_at = CASE WHEN kv.expires_at AND kv.expires_at < ?4 THEN ?3 ELSE kv.expires_at END "
+            "RETURNING value",
+            (key, amount, now + ttl if ttl else 0, now),
+        ).fetchone()
+        return float(row[0])
+
+    async def incr(self, key: str, amount: float = 1, ttl: float | None = None) -> float:
+        return await self._call(self._incr, key, amount, ttl)
+
+    def _take(self, key: str, capacity: float, rate: float, cost: float) -> float:
+        conn = self._db()
+        now = time.time()
+        # BEGIN IMMEDIATE holds the write lock from the read to the write, so buckets are
+        # charged one process at a time
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+            previous = json.loads(row[0]) if row is not None and row[1] >= now else None
+            state, wait = _refill(previous, capacity, rate, cost, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(state), now + capacity / rate),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def take(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        return await self._call(self._take, key, capacity, rate, cost)
+
+    def _publish(self, channel: str, body: str):
+        self._db().execute("INSERT INTO messages (channel, body, created_at) VALUES (?, ?, ?)", (channel, body, time.time()))
+
+    def publish_nowait(self, channel: str, message: dict):
+        """Queue the message for writing; it reaches subscribers (here too) on their next poll."""
+        self.published += 1
+        future = self._executor.submit(self._publish, channel, json.dumps(message))
+        future.add_done_callback(lambda f: f.exception() and logger.error("Store publish on %s failed: %s", channel, f.exception()))
+
+    def _fetch(self, after: int) -> list[tuple]:
+        return self._db().execute(
+            "SELECT id, channel, body FROM messages WHERE id > ? ORDER BY id LIMIT 1000", (after,)
+        ).fetchall()
+
+    def _prune(self):
+        self._db().execute("DELETE FROM messages WHERE created_at < ?", (time.time() - self.message_ttl,))
+        self._db().execute("DELETE FROM kv WHERE expires_at AND expires_at < ?", (time.time(),))
+
+    async def start(self):
+        if self._task is None:
+            # only messages published from now on
+            self._last_id = await self._call(lambda: self._db().execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0])
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _poll(self):
+        last_prune = time.monotonic()
+        while True:
+            try:
+                for msg_id, channel, body in await self._call(self._fetch, self._last_id):
+                    self._last_id = msg_id
+                    self._dispatch(channel, json.loads(body))
+                if time.monotonic() - last_prune > self.message_ttl:
+                    await self._call(self._prune)
+                    last_prune = time.monotonic()
+            except Exception:
+                logger.exception("Shared store poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "path": self.path, "published": self.published, "delivered": self.delivered, "last_message_id": self._last_id}
+
+
+def _build(url: str) -> Store:
+    if url == "memory":
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):], poll_interval=settings.shared_store_poll_seconds)
+    raise ValueError(f"Unsupported shared_store: {url!r} (use 'memory' or 'sqlite:///path')")
+
+
+store = _build(settings.shared_store)
@@ -0,0 +1,174 @@
+
+import asyncio
+import logging
+import time
+import httpx
+from app import metrics
+from app.circuit import CircuitBreaker, CircuitOpenError
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# One pooled client per upstream, created on app startup and closed on shutdown.
+_clients: dict[str, httpx.AsyncClient] = {}
+# Transports to use instead of the network, e.g. local stand-ins for benchmarks
+_transports: dict[str, httpx.AsyncBaseTransport] = {}
+UPSTREAMS = ("nessie", "gemini")
+# One breaker per upstream; kept across client rebuilds
+breakers: dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(
+        name,
+        window=settings.circuit_window,
+        min_calls=settings.circuit_min_calls,
+        failure_rate=settings.circuit_failure_rate,
+        open_seconds=settings.circuit_open_seconds,
+        half_open_calls=settings.circuit_half_open_calls,
+        timeout_multiplier=settings.adaptive_timeout_multiplier,
+        min_timeout=settings.adaptive_timeout_min_seconds,
+        latency_samples=settings.adaptive_timeout_samples,
+    )
+    for name in UPSTREAMS
+}
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2 needs the optional `h2` package (httpx[http2]); fall back to HTTP/1.1 without it."""
+    if not settings.upstream_http2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    if name not in UPSTREAMS:
+        raise KeyError(f"unknown upstream: {name}")
+    if name == "nessie":
+        timeout, max_conns, max_keepalive = settings.nessie_timeout, settings.nessie_max_connections, settings.nessie_max_keepalive
+    else:
+        timeout, max_conns, max_keepalive = settings.gemini_timeout, settings.gemini_max_connections, settings.gemini_max_keepalive
+
+    transport = _transports.get(name) or httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=max_conns,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=settings.upstream_keepalive_expiry,
+        ),
+        http2=_http2_enabled(),
+    )
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=settings.upstream_connect_timeout),
+        transport=_GuardedTransport(name, transport, breakers[name]),
+    )
+
+
+class _GuardedTransport(httpx.AsyncBaseTransport):
+    """Puts an upstream's circuit breaker and adaptive timeout in front of every call, and
+    records latency and outcome (time to response headers).
+
+    Requests sent with `extensions={"adaptive_timeout": False}` keep their full timeout (e.g.
+    order placement, where giving up early does not mean the order was not placed).
+    """
+
+    def __init__(self, name: str, inner: httpx.AsyncBaseTransport, breaker: CircuitBreaker):
+        self.name = name
+        self.inner = inner
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            metrics.upstream_calls.inc(self.name, "rejected")
+            raise CircuitOpenError(f"{self.name} circuit is open", request=request)
+
+        hard_timeout = (request.extensions.get("timeout") or {}).get("read")
+        deadline = hard_timeout
+        if request.extensions.get("adaptive_timeout", True):
+            deadline = self.breaker.timeout(hard_timeout)
+
+        start = time.perf_counter()
+        try:
+            if deadline is not None and deadline != hard_timeout:
+                response = await asyncio.wait_for(self.inner.handle_async_request(request), deadline)
+            else:
+                response = await self.inner.handle_async_request(request)
+        except asyncio.TimeoutError:
+            self._failed("timeout", start)
+            raise httpx.ReadTimeout(f"{self.name} did not answer within {deadline:.2f}s (adaptive timeout)", request=request)
+        except httpx.TimeoutException:
+            self._failed("timeout", start)
+            raise
+        except asyncio.CancelledError:
+            self.breaker.record_abandoned()
+            raise
+        except Exception:
+            self._failed("error", start)
+            raise
+
+        elapsed = time.perf_counter() - start
+        metrics.record_upstream(self.name, f"{response.status_code // 100}xx", elapsed)
+        if response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success(elapsed)
+        return response
+
+    def _failed(self, outcome: str, start: float):
+        metrics.record_upstream(self.name, outcome, time.perf_counter() - start)
+        self.breaker.record_failure()
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Return the shared client for an upstream.
+
+    Normally created by `startup()`; created lazily when the module is used outside the app
+    (scripts, tests) so callers never have to open their own client.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client(name)
+        _clients[name] = client
+    return client
+
+
+async def set_transport(name: str, transport: httpx.AsyncBaseTransport | None):
+    """Route an upstream through `transport` (None restores the network).
+
+    The current client, if any, is closed along with its pooled connections, so the next call
+    builds one with the new transport; requests still in flight on the old client fail.
+    """
+    if transport is None:
+        _transports.pop(name, None)
+    else:
+        _transports[name] = transport
+    old = _clients.pop(name, None)
+    if old is not None:
+        await old.aclose()
+
+
+def nessie() -> httpx.AsyncClient:
+    return get_client("nessie")
+
+
+def gemini() -> httpx.AsyncClient:
+    return get_client("gemini")
+
+
+async def startup():
+    for name in UPSTREAMS:
+        get_client(name)
+    logger.info("Upstream clients ready (http2=%s)", _http2_enabled())
+
+
+async def shutdown():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception:
+            logger.exception("Error closing upstream client")
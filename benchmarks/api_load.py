@@ -0,0 +1,305 @@
+"""Closed-loop load test of the FinCoach API routes, in-process.
+
+Boots `app.main:app` on a throw-away SQLite database with local Nessie and Gemini stand-ins
+(`benchmarks.standins`), seeds one user and ledger per virtual user, then has every virtual
+user log in and issue a weighted mix of requests until the run ends. Prints (or writes) a
+JSON report with throughput and p50/p95/p99 latency per route, plus upstream and cache
+counters; compare two reports with `python -m benchmarks.compare`.
+
+    python -m benchmarks.api_load [--users 50] [--duration 20] [--ledger-rows 2000]
+        [--gemini-latency-ms 40] [--gemini-error-rate 0.05] [--out report.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mktemp(suffix='.db')}")
+# a Nessie key makes the app call Nessie (here: the stand-in) instead of its demo mode
+os.environ.setdefault("NESSIE_API_KEY", "bench")
+# virtual users poll far faster than the per-user budgets allow; measure the server, not the limiter
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# the report includes the cache stats from /admin/caches
+os.environ.setdefault("ADMIN_TOKEN", "bench-admin")
+
+import httpx  # noqa: E402
+
+from app import ledger, security, upstream  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import SessionLocal, init_models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import User  # noqa: E402
+from app.schemas import TransactionIn  # noqa: E402
+from benchmarks.common import git_revision, latency_summary, now_iso  # noqa: E402
+from benchmarks.standins import GeminiStandIn, NessieStandIn  # noqa: E402
+
+PASSWORD = "bench-secret"
+SYMBOLS = ["BTCUSD", "ETHUSD", "SOLUSD"]
+
+# relative weight of each route in a virtual user's request mix; every user also logs in once
+# before its first request
+DEFAULT_MIX = {
+    "POST /auth/login": 2,
+    "GET /auth/me": 10,
+    "GET /nessie/balance": 25,
+    "GET /nessie/transactions": 20,
+    "POST /nessie/transfer": 10,
+    "GET /gemini/price": 15,
+    "POST /gemini/advise": 10,
+    "POST /gemini/trade": 10,
+    "GET /gemini/portfolio": 5,
+}
+
+_LEDGER_ROWS = [
+    (2500.0, 0.0, "Payroll deposit"),
+    (-4.5, 2.0, "Starbucks"),
+    (-12.0, 6.0, "Uber trip"),
+    (-9.0, 4.0, "OXXO"),
+    (-45.0, 20.0, "Restaurante"),
+    (-15.99, 0.0, "Netflix"),
+    (-60.0, 25.0, "Gasolina"),
+    (-800.0, 0.0, "Renta"),
+    (-25.0, 15.0, "Amazon"),
+]
+
+
+def _ledger_rows(n: int, rng: random.Random) -> list[TransactionIn]:
+    """`n` rows spread over the last year: a payroll twice a month, the rest everyday spending."""
+    now = datetime.utcnow()
+    rows = []
+    for i in range(n):
+        amount, spread, description = _LEDGER_ROWS[0] if i % 40 == 0 else rng.choice(_LEDGER_ROWS[1:])
+        rows.append(TransactionIn.model_construct(
+            amount=round(amount + rng.uniform(-spread, spread), 2),
+            description=description,
+            created_at=now - timedelta(seconds=rng.randrange(365 * 86400)),
+        ))
+    return rows
+
+
+async def seed(users: int, ledger_rows: int, unprovisioned: float, rng: random.Random) -> list[dict]:
+    """Create `users` users, each with a ledger of `ledger_rows` rows.
+
+    A share `unprovisioned` of them get no Nessie customer/account (and no ledger): their
+    first request provisions one through the Nessie stand-in.
+    """
+    await init_models()
+    # one pbkdf2 hash for everybody: seeding 1000 users should not take minutes
+    password_hash = security.get_password_hash(PASSWORD)
+    run_id = int(time.time() * 1000)
+    seeded = []
+    async with SessionLocal() as session:
+        for i in range(users):
+            email = f"bench-{run_id}-{i}@example.com"
+            user = User(email=email, password_hash=password_hash, first_name="Bench", last_name=f"User{i}")
+            session.add(user)
+            if rng.random() < unprovisioned:
+                await session.commit()
+                seeded.append({"email": email, "account_id": None})
+                continue
+            account_id = f"BENCHACC-{run_id}-{i}"
+            user.nessie_customer_id, user.primary_account_id = f"BENCHCUST-{run_id}-{i}", account_id
+            rows = _ledger_rows(ledger_rows, rng)
+            total = 0.0
+            for start in range(0, len(rows), settings.bulk_ingest_batch_size):
+                total += await ledger.insert_batch(session, account_id, rows[start:start + settings.bulk_ingest_batch_size])
+            if rows:
+                await ledger.apply_batch_to_balance(session, account_id, total)
+            await session.commit()
+            seeded.append({"email": email, "account_id": account_id})
+    return seeded
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.recording = False
+
+    def add(self, route: str, elapsed_ms: float, status: str):
+        if self.recording:
+            self.latencies[route].append(elapsed_ms)
+            self.statuses[route][status] += 1
+
+
+async def _timed(rec: Recorder, route: str, send) -> httpx.Response | None:
+    t0 = time.perf_counter()
+    try:
+        r = await send()
+    except Exception as e:
+        rec.add(route, (time.perf_counter() - t0) * 1000, type(e).__name__)
+        return None
+    rec.add(route, (time.perf_counter() - t0) * 1000, str(r.status_code))
+    return r
+
+
+def _request(client: httpx.AsyncClient, route: str, me: dict, peers: list[dict], rng: random.Random):
+    if route == "POST /auth/login":
+        return lambda: client.post("/auth/login", json={"email": me["email"], "password": PASSWORD})
+    if route == "GET /auth/me":
+        return lambda: client.get("/auth/me")
+    if route == "GET /nessie/balance":
+        return lambda: client.get("/nessie/balance")
+    if route == "GET /nessie/transactions":
+        return lambda: client.get("/nessie/transactions", params={"limit": 50})
+    if route == "POST /nessie/transfer":
+        to = rng.choice(peers)["account_id"] if peers else "BENCHACC-external"
+        return lambda: client.post("/nessie/transfer", json={"to_account_id": to, "amount": round(rng.uniform(1, 50), 2), "description": "Bench transfer"})
+    if route == "GET /gemini/price":
+        return lambda: client.get("/gemini/price", params={"symbol": rng.choice(SYMBOLS)})
+    if route == "POST /gemini/advise":
+        return lambda: client.post("/gemini/advise", json={"risk_profile": rng.choice(["conservative", "balanced", "aggressive"])})
+    if route == "POST /gemini/trade":
+        return lambda: client.post("/gemini/trade", json={"symbol": rng.choice(SYMBOLS), "side": rng.choice(["buy", "buy", "sell"]), "amount_usd": round(rng.uniform(5, 100), 2)})
+    if route == "GET /gemini/portfolio":
+        return lambda: client.get("/gemini/portfolio")
+    raise KeyError(route)
+
+
+async def virtual_user(transport: httpx.AsyncBaseTransport, rec: Recorder, me: dict, peers: list[dict], mix: dict[str, int],
+                       stop_at: float, think_ms: float, rng: random.Random):
+    routes, weights = list(mix), list(mix.values())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        route = "POST /auth/login"
+        while True:
+            r = await _timed(rec, route, _request(client, route, me, peers, rng))
+            if route == "POST /auth/login":
+                if r is None or r.status_code != 200:
+                    return
+                client.headers["Authorization"] = f"Bearer {r.json()['access_token']}"
+            if time.perf_counter() >= stop_at:
+                break
+            route = rng.choices(routes, weights)[0]
+            if think_ms:
+                await asyncio.sleep(rng.expovariate(1000 / think_ms))
+
+
+def _parse_mix(spec: str | None) -> dict[str, int]:
+    """`"balance=5,advise=1"` -> weights for the routes whose path ends with those names."""
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        matches = [r for r in DEFAULT_MIX if r.rsplit("/", 1)[-1] == name.strip()]
+        if not matches:
+            raise SystemExit(f"unknown route in --mix: {name!r} (choose from {', '.join(r.rsplit('/', 1)[-1] for r in DEFAULT_MIX)})")
+        mix[matches[0]] = int(weight or 1)
+    return mix
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    nessie_standin = NessieStandIn(latency_ms=args.nessie_latency_ms, jitter_ms=args.jitter_ms, error_rate=args.nessie_error_rate, seed=args.seed)
+    gemini_standin = GeminiStandIn(latency_ms=args.gemini_latency_ms, jitter_ms=args.jitter_ms, error_rate=args.gemini_error_rate, seed=args.seed)
+    await upstream.set_transport("nessie", httpx.MockTransport(nessie_standin))
+    await upstream.set_transport("gemini", httpx.MockTransport(gemini_standin))
+    mix = _parse_mix(args.mix)
+
+    t_seed = time.perf_counter()
+    users = await seed(args.users, args.ledger_rows, args.unprovisioned, rng)
+    seed_s = time.perf_counter() - t_seed
+
+    await app.router.startup()
+    rec = Recorder()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            start = time.perf_counter()
+            stop_at = start + args.warmup + args.duration
+            tasks = [
+                asyncio.create_task(virtual_user(transport, rec, u, [p for p in users if p is not u and p["account_id"]], mix, stop_at, args.think_ms, random.Random(rng.random())))
+                for u in users
+            ]
+            if args.warmup:
+                await asyncio.sleep(args.warmup)
+            rec.recording = True
+            measured_from = time.perf_counter()
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - measured_from
+            caches = (await client.get("/admin/caches", headers={"X-Admin-Token": settings.admin_token})).json()
+    finally:
+        await app.router.shutdown()
+
+    routes = {}
+    all_latencies: list[float] = []
+    total_errors = 0
+    for route in sorted(rec.latencies):
+        samples = rec.latencies[route]
+        statuses = dict(rec.statuses[route])
+        errors = sum(n for s, n in statuses.items() if not s.isdigit() or int(s) >= 400)
+        total_errors += errors
+        all_latencies.extend(samples)
+        routes[route] = {
+            "requests": len(samples),
+            "errors": errors,
+            "statuses": statuses,
+            "throughput_rps": round(len(samples) / elapsed, 1),
+            **latency_summary(samples),
+        }
+
+    return {
+        "benchmark": "api_load",
+        "timestamp": now_iso(),
+        "git": git_revision(),
+        "config": {
+            "users": args.users,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "think_ms": args.think_ms,
+            "ledger_rows": args.ledger_rows,
+            "unprovisioned": args.unprovisioned,
+            "mix": mix,
+            "seed": args.seed,
+            "nessie": {"latency_ms": args.nessie_latency_ms, "error_rate": args.nessie_error_rate},
+            "gemini": {"latency_ms": args.gemini_latency_ms, "error_rate": args.gemini_error_rate},
+            "jitter_ms": args.jitter_ms,
+            "database": settings.database_url.split("://", 1)[0],
+        },
+        "seed_s": round(seed_s, 2),
+        "elapsed_s": round(elapsed, 2),
+        "total": {
+            "requests": len(all_latencies),
+            "errors": total_errors,
+            "throughput_rps": round(len(all_latencies) / elapsed, 1),
+            **latency_summary(all_latencies),
+        },
+        "routes": routes,
+        "upstreams": {"nessie": nessie_standin.stats(), "gemini": gemini_standin.stats()},
+        "caches": caches,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=50, help="concurrent virtual users (one seeded account each)")
+    ap.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=2.0, help="seconds of load before measuring starts")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's requests")
+    ap.add_argument("--ledger-rows", type=int, default=2000, help="ledger rows seeded per account")
+    ap.add_argument("--unprovisioned", type=float, default=0.0, help="share of users left without a Nessie account (provisioned on first use)")
+    ap.add_argument("--mix", help="route weights, e.g. 'balance=5,transactions=2,advise=1' (default: a mixed workload)")
+    ap.add_argument("--nessie-latency-ms", type=float, default=80.0)
+    ap.add_argument("--nessie-error-rate", type=float, default=0.0)
+    ap.add_argument("--gemini-latency-ms", type=float, default=40.0)
+    ap.add_argument("--gemini-error-rate", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0, help="± uniform jitter on stand-in latency")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--out", help="also write the report to this file")
+    args = ap.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare two `benchmarks.api_load` reports route by route.
+
+Prints p50/p95/p99 and throughput for the baseline and the candidate with the relative
+change, and exits with status 1 when any route's p95 grew, or its throughput fell, by more
+than --threshold percent (so it can gate CI).
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+
+
+def _change(old: float, new: float) -> float | None:
+    return None if not old else (new - old) / old * 100
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> tuple[list[str], list[str]]:
+    """Return (table lines, regressions)."""
+    lines = [f"{'route':<28}" + "".join(f"{m:>26}" for m in METRICS)]
+    regressions = []
+    routes = {"total": (baseline["total"], candidate["total"])}
+    for route in sorted(set(baseline["routes"]) | set(candidate["routes"])):
+        routes[route] = (baseline["routes"].get(route), candidate["routes"].get(route))
+
+    for route, (old, new) in routes.items():
+        if old is None or new is None:
+            lines.append(f"{route:<28}  only in {'candidate' if old is None else 'baseline'}")
+            continue
+        cells = []
+        for metric in METRICS:
+            change = _change(old[metric], new[metric])
+            shown = "n/a" if change is None else f"{change:+.1f}%"
+            cells.append(f"{old[metric]:>9} -> {new[metric]:<9}{shown:>6}")
+            if change is None:
+                continue
+            if metric == "p95_ms" and change > threshold:
+                regressions.append(f"{route}: p95 {old[metric]} -> {new[metric]} ms ({change:+.1f}%)")
+            if metric == "throughput_rps" and change < -threshold:
+                regressions.append(f"{route}: throughput {old[metric]} -> {new[metric]} req/s ({change:+.1f}%)")
+        lines.append(f"{route:<28}" + "".join(f"{c:>26}" for c in cells))
+    return lines, regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("baseline")
+    ap.add_argument("candidate")
+    ap.add_argument("--threshold", type=float, default=10.0, help="allowed regression, in percent")
+    args = ap.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline.get("config") != candidate.get("config"):
+        print("warning: the reports were run with different settings", file=sys.stderr)
+
+    lines, regressions = compare(baseline, candidate, args.threshold)
+    print(f"baseline {baseline.get('git', {}).get('commit')}  vs  candidate {candidate.get('git', {}).get('commit')}")
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold}%:")
+        print("\n".join(f"  {r}" for r in regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Measure /health latency while a burst of /auth/login requests is in flight.
+
+Shows the event-loop stall caused by password hashing: with --inline the pbkdf2 check runs
+on the loop (the old behaviour), by default it runs in the hashing thread pool.
+
+    python -m benchmarks.login_storm [--logins 200] [--concurrency 50] [--inline]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mktemp(suffix='.db')}")
+# every login comes from one client IP and would drain the per-IP login budget after a few
+# requests; measure the hashing pool, not the limiter
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx  # noqa: E402
+
+from app import security  # noqa: E402
+from app.database import SessionLocal, init_models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import User  # noqa: E402
+from app.routers import auth  # noqa: E402
+from benchmarks.common import percentile  # noqa: E402
+
+
+async def _seed_user(email: str, password: str):
+    await init_models()
+    async with SessionLocal() as session:
+        session.add(User(email=email, password_hash=security.get_password_hash(password), first_name="Bench", last_name="User"))
+        await session.commit()
+
+
+async def run(logins: int, concurrency: int, inline: bool) -> dict:
+    email, password = f"storm-{int(time.time() * 1000)}@example.com", "secret123"
+    await _seed_user(email, password)
+
+    if inline:
+        async def _inline_verify(plain, hashed):
+            return security.verify_password(plain, hashed)
+        auth.verify_password_async = _inline_verify
+
+    transport = httpx.ASGITransport(app=app)
+    health: list[float] = []
+    statuses: dict[int, int] = {}
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def probe():
+            # latency is measured from when the probe was due, so time spent waiting for a
+            # blocked event loop to wake it up counts as well
+            interval = 0.005
+            due = time.perf_counter()
+            while not done.is_set():
+                await client.get("/health")
+                health.append((time.perf_counter() - due) * 1000)
+                due = max(due + interval, time.perf_counter())
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+
+        sem = asyncio.Semaphore(concurrency)
+
+        async def login():
+            async with sem:
+                r = await client.post("/auth/login", json={"email": email, "password": password})
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        probe_task = asyncio.create_task(probe())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await probe_task
+
+    security.shutdown_hash_pool()
+    return {
+        "mode": "inline" if inline else "thread-pool",
+        "logins": logins,
+        "concurrency": concurrency,
+        "login_statuses": statuses,
+        "logins_per_s": round(logins / elapsed, 1),
+        "health_samples": len(health),
+        "health_p50_ms": round(statistics.median(health), 2) if health else 0.0,
+        "health_p99_ms": round(percentile(health, 99), 2),
+        "health_max_ms": round(max(health), 2) if health else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--logins", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--inline", action="store_true", help="verify passwords on the event loop (pre-offload behaviour)")
+    args = ap.parse_args()
+    print(json.dumps(asyncio.run(run(args.logins, args.concurrency, args.inline)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Throughput of /nessie/balance and /gemini/price as the number of worker processes grows.
+
+Seeds a throw-away SQLite database, serves the Nessie and Gemini stand-ins over HTTP
+(`python -m benchmarks.standins`), then for each worker count starts the app as a real
+multi-worker server (`uvicorn --workers N`, or gunicorn with gunicorn.conf.py) using the
+SQLite shared store, and drives it from several client processes for a fixed time. Reports
+req/s and p50/p99 per worker count, the speedup over one worker and the efficiency
+(speedup / workers), plus the ticker calls the stand-in saw.
+
+    python -m benchmarks.scaling [--workers 1,2,4] [--duration 10] [--clients 4]
+        [--concurrency 32] [--server uvicorn|gunicorn] [--out report.json]
+
+The load generators share the host with the server: keep `--clients` well below the core
+count, or the run measures the clients. Scaling is only visible with at least as many free
+cores as the largest worker count.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import git_revision, latency_summary, now_iso
+
+ROUTES = ("/nessie/balance", "/gemini/price")
+SYMBOLS = ["BTCUSD", "ETHUSD", "SOLUSD"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _seed_and_sign(database_url: str, users: int) -> list[str]:
+    os.environ["DATABASE_URL"] = database_url
+    from sqlalchemy import select
+
+    from app import security
+    from app.database import SessionLocal
+    from app.models import User
+    from benchmarks.api_load import seed
+
+    async def main():
+        await seed(users, 200, 0.0, random.Random(0))
+        async with SessionLocal() as session:
+            rows = (await session.execute(select(User.email, User.id))).all()
+        return [security.create_access_token(email, user_id=user_id) for email, user_id in rows]
+
+    return asyncio.run(main())
+
+
+def _seed(database_url: str, users: int) -> list[str]:
+    """Seed `users` users and return a bearer token for each; runs in a child process so the
+    app's engine and settings are never loaded here."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_seed_and_sign, (database_url, users))
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+
+
+def _stop(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def _start_app(server: str, workers: int, port: int, env: dict) -> subprocess.Popen:
+    if server == "gunicorn":
+        cmd = [shutil.which("gunicorn") or "gunicorn", "-c", "gunicorn.conf.py", "-w", str(workers), "-b", f"127.0.0.1:{port}", "app.main:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--no-access-log", "--log-level", "warning"]
+    return subprocess.Popen(cmd, env=env)
+
+
+async def _client(base_url: str, tokens: list[str], concurrency: int, warmup: float, duration: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    latencies = {route: [] for route in ROUTES}
+    errors = 0
+    start = time.perf_counter()
+    record_from, stop_at = start + warmup, start + warmup + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        async def loop():
+            nonlocal errors
+            headers = {"Authorization": f"Bearer {rng.choice(tokens)}"}
+            while True:
+                route = rng.choice(ROUTES)
+                params = {"symbol": rng.choice(SYMBOLS)} if route == "/gemini/price" else None
+                t0 = time.perf_counter()
+                try:
+                    ok = (await client.get(route, params=params, headers=headers)).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                t1 = time.perf_counter()
+                if t1 >= stop_at:
+                    return
+                if t0 >= record_from:
+                    if ok:
+                        latencies[route].append((t1 - t0) * 1000)
+                    else:
+                        errors += 1
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}
+
+
+def _client_process(args: tuple) -> dict:
+    return asyncio.run(_client(*args))
+
+
+def _measure(base_url: str, tokens: list[str], args) -> dict:
+    jobs = [(base_url, tokens, args.concurrency, args.warmup, args.duration, args.seed + i) for i in range(args.clients)]
+    with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+        results = pool.map(_client_process, jobs)
+    per_route = {route: [ms for r in results for ms in r["latencies"][route]] for route in ROUTES}
+    everything = [ms for samples in per_route.values() for ms in samples]
+    return {
+        "requests": len(everything),
+        "errors": sum(r["errors"] for r in results),
+        "throughput_rps": round(len(everything) / args.duration, 1),
+        **latency_summary(everything),
+        "routes": {route: {"requests": len(s), "throughput_rps": round(len(s) / args.duration, 1), **latency_summary(s)} for route, s in per_route.items()},
+    }
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="fincoach-scaling-")
+    database_url = f"sqlite+aiosqlite:///{os.path.join(workdir, 'app.db')}"
+    tokens = _seed(database_url, args.users)
+
+    standin_port = _free_port()
+    standins = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.standins", "--port", str(standin_port),
+        "--nessie-latency-ms", str(args.nessie_latency_ms), "--gemini-latency-ms", str(args.gemini_latency_ms),
+    ])
+    standin_url = f"http://127.0.0.1:{standin_port}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "SHARED_STORE": f"sqlite:///{os.path.join(workdir, 'shared.db')}",
+        "NESSIE_API_KEY": "bench",
+        "NESSIE_BASE_URL": f"{standin_url}/nessie",
+        "GEMINI_BASE_URL": f"{standin_url}/gemini",
+        "RATE_LIMIT_ENABLED": os.environ.get("RATE_LIMIT_ENABLED", "false"),
+    }
+    runs = []
+    try:
+        _wait_ready(f"{standin_url}/_stats", standins)
+        for workers in args.workers:
+            port = _free_port()
+            app = _start_app(args.server, workers, port, env)
+            try:
+                _wait_ready(f"http://127.0.0.1:{port}/health", app)
+                before = httpx.get(f"{standin_url}/_stats").json()
+                result = _measure(f"http://127.0.0.1:{port}", tokens, args)
+                after = httpx.get(f"{standin_url}/_stats").json()
+            finally:
+                _stop(app)
+            result["workers"] = workers
+            result["upstream_requests"] = {name: after[name].get("requests", 0) - before[name].get("requests", 0) for name in after}
+            runs.append(result)
+            print(f"workers={workers}: {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms", file=sys.stderr)
+    finally:
+        _stop(standins)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if runs and runs[0]["throughput_rps"]:
+        base_rps, base_workers = runs[0]["throughput_rps"], runs[0]["workers"]
+        for r in runs:
+            r["speedup"] = round(r["throughput_rps"] / base_rps, 2)
+            r["efficiency"] = round(r["speedup"] * base_workers / r["workers"], 2)
+
+    return {
+        "benchmark": "scaling",
+        "started_at": now_iso(),
+        "git": git_revision(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput scaling of the API across worker processes")
+    parser.add_argument("--workers", default=None, help="comma-separated worker counts (default: 1,2,4.. up to the CPU count)")
+    parser.add_argument("--server", choices=["uvicorn", "gunicorn"], default="uvicorn")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--clients", type=int, default=2, help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight per load generator")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--nessie-latency-ms", type=float, default=30.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    if args.workers:
+        args.workers = [int(w) for w in args.workers.split(",")]
+    else:
+        cpus, n, args.workers = os.cpu_count() or 1, 1, []
+        while n < cpus:
+            args.workers.append(n)
+            n *= 2
+        args.workers.append(cpus)
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Local stand-ins for the Nessie and Gemini APIs.
+
+Each stand-in is an `httpx.MockTransport` handler that answers like the real service after a
+configurable delay and fails a configurable share of requests, so benchmarks never touch
+the network and upstream behaviour is reproducible (`seed`).
+
+    await upstream.set_transport("gemini", httpx.MockTransport(GeminiStandIn(latency_ms=40)))
+
+For an app running in other processes (e.g. several workers), serve them over HTTP instead,
+under the path prefixes /nessie and /gemini, with counters at /_stats:
+
+    python -m benchmarks.standins --port 9100 [--gemini-latency-ms 40]
+    NESSIE_BASE_URL=http://127.0.0.1:9100/nessie GEMINI_BASE_URL=http://127.0.0.1:9100/gemini ...
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+from collections import Counter
+
+import httpx
+
+
+class StandIn:
+    """Base handler: adds latency (mean ± jitter) and injects errors before `respond`.
+
+    `error_rate` is the fraction of requests answered with `error_status`;
+    `timeout_rate` is the fraction that hang for `hang_seconds` (longer than the app's
+    upstream timeouts) to exercise timeout paths.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        timeout_rate: float = 0.0,
+        hang_seconds: float = 30.0,
+        seed: int | None = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self._rng = random.Random(seed)
+        self.calls: Counter = Counter()
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls["requests"] += 1
+        roll = self._rng.random()
+        if roll < self.timeout_rate:
+            self.calls["timeouts"] += 1
+            await asyncio.sleep(self.hang_seconds)
+        delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+        if roll < self.timeout_rate + self.error_rate:
+            self.calls["errors"] += 1
+            return httpx.Response(self.error_status, json={"message": "stand-in error"})
+        return self.respond(request)
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return dict(self.calls)
+
+
+class NessieStandIn(StandIn):
+    """Capital One Nessie: customers, accounts and deposits.
+
+    Deposits honour an `Idempotency-Key` header: a repeated key returns the original deposit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deposits: dict[str, dict] = {}
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path.endswith("/customers"):
+            return self._created("BENCHCUST")
+        if request.method == "POST" and re.search(r"/customers/[^/]+/accounts$", path):
+            return self._created("BENCHACC")
+        if request.method == "POST" and re.search(r"/accounts/[^/]+/deposits$", path):
+            key = request.headers.get("idempotency-key")
+            if key and key in self.deposits:
+                self.calls["duplicates"] += 1
+                return httpx.Response(201, json=self.deposits[key])
+            body = json.loads(request.content or b"{}")
+            created = {"code": 201, "message": "Created deposit", "objectCreated": {**body, "_id": self._id("BENCHDEP")}}
+            if key:
+                self.deposits[key] = created
+            return httpx.Response(201, json=created)
+        return httpx.Response(404, json={"message": "not found"})
+
+    def _id(self, prefix: str) -> str:
+        self.calls["created"] += 1
+        return f"{prefix}-{self.calls['created']:08d}"
+
+    def _created(self, prefix: str) -> httpx.Response:
+        return httpx.Response(201, json={"code": 201, "objectCreated": {"_id": self._id(prefix)}})
+
+
+class GeminiStandIn(StandIn):
+    """Gemini public ticker (and order placement, for runs with trade execution enabled)."""
+
+    BASE_PRICES = {"btcusd": 60000.0, "ethusd": 4000.0, "solusd": 150.0}
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        m = re.search(r"/v1/pubticker/([a-z0-9]+)$", path)
+        if m:
+            base = self.BASE_PRICES.get(m.group(1), 1.0)
+            last = round(base * self._rng.uniform(0.99, 1.01), 2)
+            return httpx.Response(200, json={"last": str(last), "bid": str(last), "ask": str(last)})
+        if request.method == "POST" and path.endswith("/v1/order/new"):
+            return httpx.Response(200, json={"order_id": str(self._rng.randrange(10**9)), "is_live": False})
+        return httpx.Response(404, json={"result": "error", "reason": "EndpointNotFound"})
+
+
+class StandInServer:
+    """ASGI app routing `/<name>/...` to the stand-in registered under `name`."""
+
+    def __init__(self, **standins: StandIn):
+        self.standins = standins
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                else:
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        name, _, rest = scope["path"].lstrip("/").partition("/")
+        if name == "_stats":
+            response = httpx.Response(200, json={n: s.stats() for n, s in self.standins.items()})
+        elif name in self.standins:
+            request = httpx.Request(
+                scope["method"],
+                httpx.URL(path="/" + rest, query=scope["query_string"]),
+                headers=[(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]],
+                content=body,
+            )
+            response = await self.standins[name](request)
+        else:
+            response = httpx.Response(404, json={"message": "unknown stand-in"})
+        content = response.content
+        headers = [(b"content-type", response.headers.get("content-type", "application/json").encode()), (b"content-length", str(len(content)).encode())]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": content})
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the Nessie and Gemini stand-ins over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--nessie-latency-ms", type=float, default=30.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    app = StandInServer(
+        nessie=NessieStandIn(latency_ms=args.nessie_latency_ms, jitter_ms=args.jitter_ms, seed=args.seed),
+        gemini=GeminiStandIn(latency_ms=args.gemini_latency_ms, jitter_ms=args.jitter_ms, seed=args.seed),
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
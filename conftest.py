@@ -0,0 +1,95 @@
+"""Shared test setup.
+
+Settings are read when `app` is first imported, so the environment is fixed here, before any
+test module imports it: a throwaway SQLite database, demo mode for Nessie and Gemini, the
+in-process store and no rate limits. Async tests run on asyncio through the anyio plugin.
+
+Suites that take the `backend` fixture also run against PostgreSQL when TEST_DATABASE_URL (or
+a DATABASE_URL given to pytest) names one and asyncpg is installed; otherwise that case is
+skipped.
+"""
+import importlib.util
+import os
+import tempfile
+
+import pytest
+
+# read before DATABASE_URL is replaced with the SQLite test database below
+_postgres_url = os.environ.get("TEST_DATABASE_URL") or os.environ.get("DATABASE_URL", "")
+if not _postgres_url.startswith(("postgres://", "postgresql")):
+    _postgres_url = ""
+
+_tmp = tempfile.mkdtemp(prefix="fincoach-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ["FRONTEND_DIR"] = os.path.dirname(os.path.abspath(__file__))
+os.environ["SHARED_STORE"] = "memory"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+for _name in ("NESSIE_API_KEY", "GEMINI_API_KEY", "GEMINI_API_SECRET"):
+    os.environ[_name] = ""
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(params=[
+    "sqlite",
+    pytest.param("postgresql", marks=pytest.mark.skipif(
+        not _postgres_url or importlib.util.find_spec("asyncpg") is None,
+        reason="needs TEST_DATABASE_URL=postgresql://... and asyncpg",
+    )),
+])
+def backend(request, monkeypatch):
+    """The database the app runs on for this test. For PostgreSQL, the engine and every
+    module-level SessionLocal are pointed at TEST_DATABASE_URL (migrated on startup)."""
+    if request.param == "postgresql":
+        from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+        from app import database
+
+        engine = create_async_engine(database._async_url(_postgres_url), future=True)
+        session_factory = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+        monkeypatch.setattr(database, "engine", engine)
+        monkeypatch.setattr(database, "read_engine", engine)
+        for module in ("app.database", "app.routers.nessie", "app.nessie_client", "app.outbox"):
+            monkeypatch.setattr(f"{module}.SessionLocal", session_factory)
+    return request.param
+
+
+@pytest.fixture
+async def session():
+    """A session on the migrated test database; the engines are disposed afterwards because
+    every test runs on its own event loop."""
+    from app.database import SessionLocal, engine, init_models, read_engine
+
+    await init_models()
+    async with SessionLocal() as s:
+        yield s
+    await engine.dispose()
+    await read_engine.dispose()
+
+
+@pytest.fixture
+async def client(session):
+    """An HTTP client for the app, with its startup and shutdown hooks run around the test."""
+    import httpx
+
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+            yield c
+
+
+@pytest.fixture
+async def auth_headers(client):
+    """Register and log in a fresh user; returns its Authorization header."""
+    import uuid
+
+    email = f"user-{uuid.uuid4().hex[:10]}@example.com"
+    address = {"street_number": "1", "street_name": "Main", "city": "CDMX", "state": "MX", "zip": "01000"}
+    r = await client.post("/auth/register", json={"email": email, "password": "secret123", "first_name": "Test", "address": address})
+    assert r.status_code == 200, r.text
+    r = await client.post("/auth/login", json={"email": email, "password": "secret123"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
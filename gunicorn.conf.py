@@ -0,0 +1,53 @@
+"""Multi-worker deployment: gunicorn managing uvicorn worker processes.
+
+    SHARED_STORE=sqlite:////var/lib/fincoach/shared.db gunicorn -c gunicorn.conf.py app.main:app
+
+Every worker is a separate process with its own connection pools, upstream clients and
+in-process caches. What has to agree across workers goes through the shared store
+(`SHARED_STORE`, see app/store.py): user-cache invalidation, ledger commit notices (advice
+cache invalidation, Server-Sent Event streams) and ticker prices. With the default
+`SHARED_STORE=memory` each worker only sees its own events, so use it for one worker only.
+The "sqlite:///" store works for workers on one host; it stands in for a networked store.
+
+Pending migrations are applied once, in the master, before any worker starts (unless
+`DB_AUTO_MIGRATE=false`); workers still check on startup and wait on the migration lock if
+another deploy is migrating. Each worker runs its own outbox worker (rows are claimed with
+leases) and price refresher.
+
+Database connections multiply with the workers: size `DB_POOL_SIZE` + `DB_MAX_OVERFLOW`
+so that workers x (pool + overflow) stays under the server's connection limit.
+
+The same mode without gunicorn: `uvicorn app.main:app --workers N` (no master-side
+migration; the workers serialize on the migration lock instead).
+"""
+import asyncio
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# pbkdf2 logins and cold upstream calls can take a while under load; don't kill busy workers
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = None
+
+
+def on_starting(server):
+    from app import migrate
+    from app.config import settings
+    from app.database import engine
+
+    if not settings.db_auto_migrate:
+        return
+
+    async def upgrade():
+        try:
+            applied = await migrate.upgrade(engine)
+        finally:
+            await engine.dispose()
+        if applied:
+            server.log.info("Applied migrations: %s", ", ".join(applied))
+
+    asyncio.run(upgrade())
@@ -0,0 +1,30 @@
+import pytest
+
+from app.config import settings
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    return "s3cret"
+
+
+async def test_reset_upstream_is_closed_without_a_configured_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "")
+    r = await client.post("/admin/upstreams/nessie/reset", headers={"X-Admin-Token": ""})
+    assert r.status_code == 403
+
+
+async def test_reset_upstream_requires_the_token(client, admin_token):
+    assert (await client.post("/admin/upstreams/nessie/reset")).status_code == 401
+    assert (await client.post("/admin/upstreams/nessie/reset", headers={"X-Admin-Token": "wrong"})).status_code == 401
+    r = await client.post("/admin/upstreams/nessie/reset", headers={"X-Admin-Token": admin_token})
+    assert r.status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/admin/caches", "/admin/streams", "/admin/upstreams", "/admin/outbox", "/admin/store", "/admin/load"])
+async def test_admin_reads_require_the_token(client, admin_token, path):
+    assert (await client.get(path)).status_code == 401
+    assert (await client.get(path, headers={"X-Admin-Token": admin_token})).status_code == 200
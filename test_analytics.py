@@ -0,0 +1,81 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app import analytics, ledger
+from app.models import LedgerMonth, LocalTransaction
+
+pytestmark = pytest.mark.anyio
+
+DESCRIPTIONS = ["Payroll ACME", "Starbucks", "Uber trip", "Transfer to savings", "Rent", "", "Gemini demo buy BTCUSD"]
+
+
+def _ledger(rows: int, seed: int = 7) -> list[LocalTransaction]:
+    rng = random.Random(seed)
+    acc = f"TEST-{uuid.uuid4().hex[:12]}"
+    start = datetime(2024, 1, 1)
+    txs = [LocalTransaction(account_id=acc, amount=1000.0, description="Initial balance", created_at=start)]
+    for _ in range(rows):
+        amount = round(rng.choice([rng.uniform(-19.99, -0.5), rng.uniform(-500, -20), rng.uniform(5, 3000)]), 2)
+        created_at = start + timedelta(days=rng.randrange(0, 400), seconds=rng.randrange(86_400))
+        txs.append(LocalTransaction(account_id=acc, amount=amount, description=rng.choice(DESCRIPTIONS), created_at=created_at))
+    return txs
+
+
+def _columns(txs: list[LocalTransaction]) -> analytics.LedgerColumns:
+    return analytics.build_columns(
+        [t.amount for t in txs], [t.created_at.isoformat(sep=" ") for t in txs], [t.description for t in txs]
+    )
+
+
+async def _cells(session, account_id: str) -> dict:
+    q = await session.execute(select(LedgerMonth).where(LedgerMonth.account_id == account_id))
+    return {(m.month, m.description): (round(m.credit, 6), round(m.debit, 6), m.count) for m in q.scalars()}
+
+
+async def test_month_totals_match_the_numpy_path(session):
+    txs = _ledger(2000)
+    acc = txs[0].account_id
+    await ledger.record_transaction(session, acc, txs[0].amount, txs[0].description, txs[0].created_at)
+    for start in range(1, len(txs), 500):
+        await ledger.insert_batch(session, acc, txs[start:start + 500])
+    await session.commit()
+
+    from_db = analytics.analyze(await analytics.load_cells(session, acc))
+    from_rows = analytics.analyze(_columns(txs))
+    assert from_db["transaction_count"] == len(txs)
+    assert _normalized(from_db) == _normalized(from_rows)
+
+    # and the rebuild recomputes the same totals from the rows
+    kept = await _cells(session, acc)
+    await ledger.rebuild_months(session)
+    assert await _cells(session, acc) == kept
+
+
+def _normalized(stats: dict) -> dict:
+    # the two paths visit descriptions in a different order
+    return {**stats, "recurring_deposits": sorted(stats["recurring_deposits"], key=lambda r: (-r["months"], r["description"]))}
+
+
+async def test_small_expense_window_ends_at_the_newest_transaction(session):
+    acc = f"TEST-{uuid.uuid4().hex[:12]}"
+    newest = datetime(2024, 6, 30, 8, 0)
+    await ledger.record_transaction(session, acc, -5.0, "Starbucks", newest)
+    # first day of the 30-day window, just after midnight
+    await ledger.record_transaction(session, acc, -7.5, "Oxxo", datetime(2024, 6, 1, 0, 1))
+    # the day before the window, and an expense over the limit
+    await ledger.record_transaction(session, acc, -3.0, "Oxxo", datetime(2024, 5, 31, 23, 59))
+    await ledger.record_transaction(session, acc, -45.0, "Restaurant", newest)
+    await session.commit()
+
+    cells = await analytics.load_cells(session, acc)
+    assert (cells.small_count, cells.small_total) == (2, 12.5)
+    assert analytics.analyze(cells)["monthly"][-1]["month"] == "2024-06"
+
+
+async def test_empty_ledger(session):
+    assert await analytics.load_cells(session, "TEST-none") is None
+    assert analytics.analyze(None)["transaction_count"] == 0
@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pytest
+
+from app.schemas import TransactionIn
+
+pytestmark = pytest.mark.anyio
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+
+def test_aware_created_at_is_stored_as_naive_utc():
+    row = TransactionIn.model_validate_json(b'{"amount": 1, "created_at": "2025-03-01T10:00:00-06:00"}')
+    assert row.created_at == datetime(2025, 3, 1, 16, 0, 0)
+    row = TransactionIn.model_validate_json(b'{"amount": 1, "created_at": "2025-03-01T10:00:00"}')
+    assert row.created_at == datetime(2025, 3, 1, 10, 0, 0)
+
+
+async def test_ndjson_import(client, auth_headers):
+    body = b'{"amount": -5, "description": "coffee"}\n\n{"amount": 20, "created_at": "2025-03-01T10:00:00+02:00"}\n'
+    r = await client.post("/nessie/transactions/bulk", content=body, headers={**auth_headers, **NDJSON})
+    assert r.status_code == 200, r.text
+    assert r.json()["inserted"] == 2
+    page = (await client.get("/nessie/transactions?limit=10", headers=auth_headers)).json()["transactions"]
+    assert "2025-03-01T08:00:00" in [t["created_at"] for t in page]
+
+
+async def test_ndjson_error_reports_the_physical_line(client, auth_headers):
+    body = b'{"amount": 1}\n\n\n{"amount": "lots"}\n'
+    r = await client.post("/nessie/transactions/bulk", content=body, headers={**auth_headers, **NDJSON})
+    assert r.status_code == 422
+    assert "(line 4)" in r.json()["detail"]
+    # nothing from the rejected import was kept
+    balance = (await client.get("/nessie/balance", headers=auth_headers)).json()["balance"]
+    assert balance == 1000
+
+
+async def test_slow_upload_does_not_hold_the_writer(client, auth_headers, monkeypatch):
+    import asyncio
+
+    from app import database
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "bulk_ingest_batch_size", 1)
+    monkeypatch.setattr(database.engine.pool, "_timeout", 0.3)
+
+    async def slow_body():
+        for i in range(4):
+            yield b'{"amount": 1}\n'
+            await asyncio.sleep(0.25)
+
+    upload = asyncio.create_task(client.post("/nessie/transactions/bulk", content=slow_body(), headers={**auth_headers, **NDJSON}))
+    await asyncio.sleep(0.4)
+    r = await client.post("/nessie/transfer", json={"to_account_id": "OTHER", "amount": 5}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    assert (await upload).json()["inserted"] == 4
+
+
+async def test_writer_timeout_is_a_503(client, auth_headers, monkeypatch):
+    from sqlalchemy import text
+
+    from app import database
+
+    if database.engine is database.read_engine:
+        pytest.skip("only the tuned SQLite profile has a single writer connection")
+    monkeypatch.setattr(database.engine.pool, "_timeout", 0.2)
+    async with database.engine.connect() as writer:
+        await writer.execute(text("SELECT 1"))
+        r = await client.post("/nessie/transfer", json={"to_account_id": "OTHER", "amount": 5}, headers=auth_headers)
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"[" + b",".join([b'{"amount": 1}'] * 10) + b"]", "application/json"),
+    (b'{"amount": 1}\n' * 10, "application/x-ndjson"),
+])
+async def test_body_over_the_byte_limit_is_a_413(client, auth_headers, monkeypatch, body, content_type):
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "bulk_ingest_max_bytes", 64)
+    r = await client.post("/nessie/transactions/bulk", content=body, headers={**auth_headers, "Content-Type": content_type})
+    assert r.status_code == 413
+
+
+async def test_row_limit_applies_to_both_formats(client, auth_headers, monkeypatch):
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "bulk_ingest_max_rows", 3)
+    monkeypatch.setattr(settings, "bulk_ingest_batch_size", 2)
+    r = await client.post("/nessie/transactions/bulk", content=b'{"amount": 1}\n' * 4, headers={**auth_headers, **NDJSON})
+    assert r.status_code == 413
+    r = await client.post("/nessie/transactions/bulk", json=[{"amount": 1}] * 3, headers=auth_headers)
+    assert r.json()["inserted"] == 3
+    r = await client.post("/nessie/transactions/bulk", content=b'{"amount": 2}\n' * 3, headers={**auth_headers, **NDJSON})
+    assert (r.json()["inserted"], r.json()["total_amount"]) == (3, 6)
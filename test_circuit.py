@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import circuit
+from app.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(circuit, "time", SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+def _breaker(**kw) -> CircuitBreaker:
+    return CircuitBreaker("test", **{"window": 10, "min_calls": 4, "failure_rate": 0.5, "open_seconds": 15, **kw})
+
+
+def test_opens_once_the_failure_rate_is_reached(clock):
+    cb = _breaker()
+    cb.record_success(0.1)
+    cb.record_failure()
+    cb.record_success(0.1)
+    # one failure in three calls, below min_calls
+    assert cb.state == CLOSED
+    cb.record_failure()
+    # two in four
+    assert cb.state == OPEN
+    assert not cb.allow()
+    assert cb.stats()["retry_in_s"] == 15
+
+
+def test_too_few_calls_never_open(clock):
+    cb = _breaker()
+    for _ in range(3):
+        cb.record_failure()
+    assert cb.state == CLOSED and cb.allow()
+
+
+def _opened(clock) -> CircuitBreaker:
+    cb = _breaker()
+    for _ in range(4):
+        cb.record_failure()
+    clock.t += 15
+    return cb
+
+
+def test_half_open_lets_one_probe_through_and_a_success_closes(clock):
+    cb = _opened(clock)
+    assert cb.allow()
+    assert cb.state == HALF_OPEN
+    # the probe slot is taken
+    assert not cb.allow()
+    cb.record_success(0.2)
+    assert cb.state == CLOSED
+    assert cb.stats()["window_calls"] == 0
+
+
+def test_failed_probe_opens_again(clock):
+    cb = _opened(clock)
+    assert cb.allow()
+    cb.record_failure()
+    assert cb.state == OPEN
+    assert cb.opened == 2
+    clock.t += 14
+    assert not cb.allow()
+
+
+def test_abandoned_probe_frees_its_slot(clock):
+    cb = _opened(clock)
+    assert cb.allow()
+    cb.record_abandoned()
+    assert cb.allow()
+
+
+def test_adaptive_timeout_follows_p99_within_bounds(clock):
+    cb = _breaker(timeout_multiplier=3.0, min_timeout=0.5)
+    for _ in range(circuit.MIN_LATENCY_SAMPLES - 1):
+        cb.record_success(0.4)
+    assert cb.timeout(20.0) == 20.0
+    cb.record_success(0.4)
+    assert cb.timeout(20.0) == pytest.approx(1.2)
+    assert cb.timeout(1.0) == 1.0
+    cb.reset()
+    assert cb.timeout(20.0) == 20.0
@@ -0,0 +1,55 @@
+import uuid
+
+import pytest
+
+from app import holdings
+
+pytestmark = pytest.mark.anyio
+
+
+def _account() -> str:
+    return f"TEST-{uuid.uuid4().hex[:12]}"
+
+
+async def test_average_cost_and_realized_pnl(session):
+    acc = _account()
+    await holdings.record_fill(session, acc, "btcusd", "buy", 1.0, 100.0)
+    await holdings.record_fill(session, acc, "BTCUSD", "buy", 1.0, 200.0)
+    await holdings.record_fill(session, acc, "BTCUSD", "sell", 0.5, 300.0)
+    await session.commit()
+
+    [pos] = await holdings.positions(session, acc)
+    assert pos.symbol == "BTCUSD"
+    assert pos.qty == pytest.approx(1.5)
+    # selling leaves the average cost (150) unchanged and realizes 0.5 x (300 - 150)
+    assert pos.cost_basis / pos.qty == pytest.approx(150.0)
+    assert pos.realized_pnl == pytest.approx(75.0)
+    assert pos.fills == 3
+
+
+async def test_sell_more_than_held_is_rejected(session):
+    acc = _account()
+    await holdings.record_fill(session, acc, "ETHUSD", "buy", 0.25, 2000.0)
+    with pytest.raises(holdings.InsufficientHoldings):
+        await holdings.record_fill(session, acc, "ETHUSD", "sell", 0.5, 2100.0)
+    assert await holdings.held(session, acc, "ETHUSD") == pytest.approx(0.25)
+
+
+async def test_sell_without_position_is_rejected(session):
+    with pytest.raises(holdings.InsufficientHoldings):
+        await holdings.record_fill(session, _account(), "BTCUSD", "sell", 0.1, 100.0)
+
+
+@pytest.mark.parametrize("side", ["hodl", "", "short"])
+async def test_unknown_side_is_rejected(session, side):
+    acc = _account()
+    with pytest.raises(holdings.UnknownSide):
+        await holdings.record_fill(session, acc, "BTCUSD", side, 1.0, 100.0)
+    assert await holdings.positions(session, acc) == []
+
+
+def test_value_totals():
+    pos = holdings.Position(account_id="A", symbol="BTCUSD", qty=2.0, cost_basis=300.0, realized_pnl=10.0, fills=2)
+    out = holdings.value([pos], {"BTCUSD": {"price": 200.0}})
+    assert out["positions"][0]["avg_cost"] == 150.0
+    assert out["totals"] == {"market_value": 400.0, "cost_basis": 300.0, "unrealized_pnl": 100.0, "realized_pnl": 10.0}
@@ -0,0 +1,109 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from app import ledger
+from app.models import AccountBalance, LocalTransaction
+
+pytestmark = pytest.mark.anyio
+
+
+def _account() -> str:
+    return f"TEST-{uuid.uuid4().hex[:12]}"
+
+
+async def _mismatches(session, account_id: str) -> list[dict]:
+    return [m for m in await ledger.verify_balances(session) if m["account_id"] == account_id]
+
+
+async def test_balance_is_materialized_on_every_write(session):
+    acc = _account()
+    await ledger.record_transaction(session, acc, 100.0, "Initial balance")
+    tx = await ledger.record_transaction(session, acc, -30.25, "Starbucks")
+    await session.commit()
+
+    assert await ledger.get_ledger_state(session, acc) == (pytest.approx(69.75), tx.id)
+    row = await session.get(AccountBalance, acc)
+    assert row.balance == pytest.approx(69.75)
+    assert await _mismatches(session, acc) == []
+
+
+async def test_batches_apply_to_the_balance_once(session):
+    class Row:
+        def __init__(self, amount):
+            self.amount, self.description, self.created_at = amount, "import", None
+
+    acc = _account()
+    await ledger.record_transaction(session, acc, 10.0, "Initial balance")
+    total = await ledger.insert_batch(session, acc, [Row(1.5), Row(-0.5), Row(4.0)])
+    await ledger.apply_batch_to_balance(session, acc, total)
+    await session.commit()
+
+    assert total == pytest.approx(5.0)
+    assert await ledger.get_balance(session, acc) == pytest.approx(15.0)
+    assert await _mismatches(session, acc) == []
+
+
+async def test_legacy_account_is_seeded_from_the_ledger(session):
+    # rows written before balances were materialized: no AccountBalance row
+    acc = _account()
+    await session.execute(insert(LocalTransaction), [
+        {"account_id": acc, "amount": 500.0, "description": "Initial balance", "created_at": datetime(2024, 1, 1)},
+        {"account_id": acc, "amount": -20.0, "description": "Oxxo", "created_at": datetime(2024, 1, 2)},
+    ])
+    await session.commit()
+    assert await session.get(AccountBalance, acc) is None
+    assert await ledger.get_balance(session, acc) == pytest.approx(480.0)
+
+    # the next write creates the row from the ledger, which already holds the flushed row
+    tx = await ledger.record_transaction(session, acc, -80.0, "Rent")
+    await session.commit()
+    row = await session.get(AccountBalance, acc, populate_existing=True)
+    assert (row.balance, row.last_transaction_id) == (pytest.approx(400.0), tx.id)
+    assert await _mismatches(session, acc) == []
+
+
+async def test_rebuild_restores_a_drifted_balance(session):
+    acc = _account()
+    await ledger.record_transaction(session, acc, 250.0, "Payroll")
+    await session.commit()
+    row = await session.get(AccountBalance, acc)
+    row.balance = 1.0
+    await session.commit()
+    assert await _mismatches(session, acc) == [{"account_id": acc, "ledger": 250.0, "materialized": 1.0}]
+
+    await ledger.rebuild_balances(session)
+    assert await ledger.get_balance(session, acc) == pytest.approx(250.0)
+    assert await _mismatches(session, acc) == []
+
+
+def test_cursor_round_trip():
+    tx = LocalTransaction(id=42, created_at=datetime(2025, 3, 1, 10, 0, 0, 123456))
+    cursor = ledger.encode_cursor(tx)
+    assert "=" not in cursor
+    assert ledger.decode_cursor(cursor) == (datetime(2025, 3, 1, 10, 0, 0, 123456), 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "garbage", "bm90LWEtZGF0ZXwx", "MjAyNS0wMy0wMVQxMDowMDowMHx4"])
+def test_invalid_cursor(cursor):
+    # the last two decode to "not-a-date|1" and "2025-03-01T10:00:00|x"
+    with pytest.raises(ledger.InvalidCursor):
+        ledger.decode_cursor(cursor)
+
+
+async def test_pages_break_timestamp_ties_by_id(session):
+    acc = _account()
+    same = datetime(2025, 1, 1, 12, 0)
+    for i in range(5):
+        await ledger.record_transaction(session, acc, float(i), f"row {i}", same)
+    await session.commit()
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = await ledger.list_transactions(session, acc, 2, cursor)
+        seen += [r.description for r in rows]
+        if cursor is None:
+            break
+    assert seen == [f"row {i}" for i in range(4, -1, -1)]
@@ -0,0 +1,76 @@
+import httpx
+import pytest
+from sqlalchemy import select, update
+
+from app import database, outbox
+from app.models import NessieOutbox
+
+pytestmark = pytest.mark.anyio
+
+
+def _worker(**kw) -> outbox.OutboxWorker:
+    return outbox.OutboxWorker(**{
+        "batch_size": 10, "concurrency": 2, "poll_interval": 1, "backoff_base": 1,
+        "backoff_max": 10, "max_attempts": 3, "lease": 60, **kw,
+    })
+
+
+async def _enqueue(session, *kinds: str) -> list[int]:
+    rows = [await outbox.enqueue(session, kind, "ACC", {"amount": 1}) for kind in kinds]
+    await session.commit()
+    return [r.id for r in rows]
+
+
+async def _rows(session, ids) -> dict[int, NessieOutbox]:
+    session.expire_all()
+    return {r.id: r for r in (await session.execute(select(NessieOutbox).where(NessieOutbox.id.in_(ids)))).scalars()}
+
+
+async def test_drain_records_each_outcome_without_holding_a_connection(session):
+    worker = _worker()
+    held = []
+
+    @worker.handler("ok")
+    async def ok(row):
+        held.append(database.engine.pool.checkedout() + database.read_engine.pool.checkedout())
+        return "up-1"
+
+    @worker.handler("flaky")
+    async def flaky(row):
+        raise httpx.ConnectError("down")
+
+    @worker.handler("rejected")
+    async def rejected(row):
+        raise httpx.HTTPStatusError("bad", request=httpx.Request("POST", "http://x"), response=httpx.Response(400))
+
+    ids = await _enqueue(session, "ok", "flaky", "rejected", "unknown")
+    await session.close()
+    assert await worker.drain_once() == 4
+    assert held == [0]
+
+    rows = await _rows(session, ids)
+    assert [(rows[i].status, rows[i].attempts, rows[i].claimed_by) for i in ids] == [
+        (outbox.SYNCED, 1, None), (outbox.PENDING, 1, None), (outbox.FAILED, 1, None), (outbox.FAILED, 1, None),
+    ]
+    assert rows[ids[0]].upstream_id == "up-1"
+    assert worker.stats == {"batches": 1, "synced": 1, "retried": 1, "failed": 2, "lease_lost": 0}
+
+
+async def test_outcome_is_dropped_once_another_worker_holds_the_claim(session):
+    worker = _worker()
+
+    @worker.handler("slow")
+    async def slow(row):
+        # the lease ran out mid-call and another worker claimed the row
+        async with database.SessionLocal() as other:
+            await other.execute(update(NessieOutbox).where(NessieOutbox.id == row.id).values(claimed_by="other"))
+            await other.commit()
+        return "up-2"
+
+    [row_id] = await _enqueue(session, "slow")
+    await session.close()
+    assert await worker.drain_once() == 1
+
+    row = (await _rows(session, [row_id]))[row_id]
+    assert (row.status, row.claimed_by, row.attempts, row.upstream_id) == (outbox.SENDING, "other", 0, None)
+    assert worker.stats["lease_lost"] == 1
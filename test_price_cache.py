@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import price_cache as price_cache_module
+from app.price_cache import PriceCache
+
+pytestmark = pytest.mark.anyio
+
+
+class Upstream:
+    """A fake price source counting its calls; `fail` makes the next calls raise."""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.gate: asyncio.Event | None = None
+
+    async def __call__(self, symbol: str) -> dict:
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return {"symbol": symbol, "price": float(self.calls)}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(price_cache_module, "time", SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+async def test_fresh_entries_are_served_from_cache(clock):
+    upstream = Upstream()
+    cache = PriceCache(upstream, ttl=5, stale_ttl=30, max_size=10)
+    assert (await cache.get("BTCUSD"))["price"] == 1
+    clock.t += 4
+    assert (await cache.get("BTCUSD"))["price"] == 1
+    assert upstream.calls == 1
+    assert cache.stats["hits"] == 1
+
+
+async def test_stale_entry_is_served_while_one_refresh_runs(clock):
+    upstream = Upstream()
+    cache = PriceCache(upstream, ttl=5, stale_ttl=30, max_size=10)
+    await cache.get("BTCUSD")
+    clock.t += 10
+    # both callers get the stale price at once; a single background refresh is started
+    assert [(await cache.get("BTCUSD"))["price"] for _ in range(2)] == [1, 1]
+    await asyncio.sleep(0)
+    assert upstream.calls == 2
+    assert cache.peek("BTCUSD")["price"] == 2
+
+
+async def test_concurrent_misses_share_one_fetch(clock):
+    upstream = Upstream()
+    upstream.gate = asyncio.Event()
+    cache = PriceCache(upstream, ttl=5, stale_ttl=30, max_size=10)
+    waiting = [asyncio.create_task(cache.get("ETHUSD")) for _ in range(5)]
+    await asyncio.sleep(0)
+    upstream.gate.set()
+    assert [q["price"] for q in await asyncio.gather(*waiting)] == [1] * 5
+    assert upstream.calls == 1
+    assert cache.stats["coalesced"] == 4
+
+
+async def test_failed_refresh_keeps_the_last_good_price(clock):
+    upstream = Upstream()
+    cache = PriceCache(upstream, ttl=5, stale_ttl=30, max_size=10)
+    await cache.get("BTCUSD")
+    upstream.fail = True
+    clock.t += 10
+    assert (await cache.refresh("BTCUSD"))["price"] == 1
+    # past the stale window the failure reaches the caller
+    clock.t += 30
+    with pytest.raises(RuntimeError):
+        await cache.get("BTCUSD")
+    assert cache.stats["errors"] == 2
+
+
+async def test_least_recently_used_symbol_is_evicted(clock):
+    cache = PriceCache(Upstream(), ttl=5, stale_ttl=30, max_size=2)
+    await cache.get("BTCUSD")
+    await cache.get("ETHUSD")
+    await cache.get("BTCUSD")
+    await cache.get("SOLUSD")
+    assert cache.peek("ETHUSD") is None
+    assert cache.peek("BTCUSD") is not None
@@ -0,0 +1,33 @@
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi import HTTPException
+
+from app import projections
+from app.config import settings
+
+pytestmark = pytest.mark.anyio
+
+
+class _BrokenPool(Executor):
+    shut_down = False
+
+    def submit(self, fn, /, *args, **kwargs):
+        raise BrokenProcessPool("a child process terminated abruptly")
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shut_down = True
+
+
+async def test_broken_pool_is_a_503_and_is_replaced(monkeypatch):
+    monkeypatch.setattr(settings, "projection_pool_min_cells", 0)
+    broken = _BrokenPool()
+    monkeypatch.setattr(projections, "_pool", broken)
+    kwargs = {"initial": 100, "monthly_contribution": 10, "months": 12, "paths": 10, "weights": {"SPY": 1.0}, "seed": 1}
+    with pytest.raises(HTTPException) as exc:
+        await projections.project(**kwargs)
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "1"
+    assert broken.shut_down and projections._pool is None
+    assert projections._pending == 0
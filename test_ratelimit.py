@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app import ratelimit, store as store_module
+from app.config import settings
+from app.store import MemoryStore, _refill
+
+pytestmark = pytest.mark.anyio
+
+
+def test_new_bucket_starts_full():
+    (tokens, at), wait = _refill(None, capacity=5, rate=1, cost=1, now=100.0)
+    assert (tokens, at, wait) == (4, 100.0, 0.0)
+
+
+def test_bucket_refills_at_rate_up_to_capacity():
+    (tokens, _), wait = _refill((0.0, 100.0), capacity=5, rate=0.5, cost=1, now=104.0)
+    assert (tokens, wait) == (1.0, 0.0)
+    # a long idle period does not bank more than capacity
+    (tokens, _), _ = _refill((0.0, 100.0), capacity=5, rate=0.5, cost=1, now=1000.0)
+    assert tokens == 4
+
+
+def test_short_bucket_is_not_charged_and_reports_the_wait():
+    (tokens, at), wait = _refill((0.5, 100.0), capacity=5, rate=0.5, cost=2, now=101.0)
+    assert (tokens, at) == (1.0, 101.0)
+    assert wait == pytest.approx(2.0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(store_module, "time", SimpleNamespace(time=lambda: now.t))
+    return now
+
+
+async def test_memory_store_take(clock):
+    store = MemoryStore()
+    assert [await store.take("k", capacity=3, rate=1) for _ in range(3)] == [0, 0, 0]
+    assert await store.take("k", capacity=3, rate=1) == pytest.approx(1.0)
+    clock.t += 1
+    assert await store.take("k", capacity=3, rate=1) == 0
+    # other keys have their own bucket
+    assert await store.take("other", capacity=3, rate=1, cost=3) == 0
+
+
+async def test_idle_bucket_expires_full(clock):
+    store = MemoryStore()
+    await store.take("k", capacity=2, rate=1, cost=2)
+    clock.t += 2.5
+    assert await store.get("k") is None
+    assert await store.take("k", capacity=2, rate=1, cost=2) == 0
+
+
+@pytest.mark.parametrize("budget, parsed", [("30/60", (30.0, 0.5)), ("", None), ("  ", None)])
+def test_parse_budget(budget, parsed):
+    assert ratelimit.parse_budget(budget) == parsed
+
+
+@pytest.mark.parametrize("budget", ["30", "a/b", "0/60", "30/0"])
+def test_parse_budget_rejects(budget):
+    with pytest.raises(ValueError):
+        ratelimit.parse_budget(budget)
+
+
+async def test_empty_bucket_is_a_429_with_retry_after(monkeypatch, clock):
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(ratelimit, "store", MemoryStore())
+    budget = ratelimit.parse_budget("2/10")
+    await ratelimit.check("route", "user:1", budget)
+    await ratelimit.check("route", "user:1", budget)
+    with pytest.raises(HTTPException) as exc:
+        await ratelimit.check("route", "user:1", budget)
+    assert exc.value.status_code == 429
+    assert exc.value.headers["Retry-After"] == "5"
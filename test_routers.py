@@ -0,0 +1,118 @@
+"""The HTTP API end to end, once per database backend (see the `backend` fixture in conftest)."""
+import uuid
+
+import httpx
+import pytest
+
+from app import upstream
+from app.gemini_client import price_cache
+
+pytestmark = [pytest.mark.anyio, pytest.mark.usefixtures("backend")]
+
+ADDRESS = {"street_number": "1", "street_name": "Main", "city": "CDMX", "state": "MX", "zip": "01000"}
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+
+async def _login(client, email: str) -> dict:
+    r = await client.post("/auth/login", json={"email": email, "password": "secret123"})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+@pytest.fixture
+async def btc_at_60000():
+    await upstream.set_transport("gemini", httpx.MockTransport(lambda request: httpx.Response(200, json={"last": "60000"})))
+    price_cache.clear()
+    yield
+    await upstream.set_transport("gemini", None)
+    price_cache.clear()
+
+
+async def test_register_login_me(client):
+    email = f"user-{uuid.uuid4().hex[:10]}@example.com"
+    r = await client.post("/auth/register", json={"email": email, "password": "secret123", "first_name": "Ana", "address": ADDRESS})
+    assert r.status_code == 200, r.text
+    assert (await client.post("/auth/register", json={"email": email, "password": "secret123", "address": ADDRESS})).status_code == 400
+    assert (await client.post("/auth/login", json={"email": email, "password": "wrong"})).status_code == 401
+
+    me = (await client.get("/auth/me", headers=await _login(client, email))).json()
+    assert (me["email"], me["first_name"]) == (email, "Ana")
+
+
+async def test_balance_revalidates_until_the_ledger_changes(client, auth_headers):
+    r = await client.get("/nessie/balance", headers=auth_headers)
+    assert r.json()["balance"] == 1000
+    tag = r.headers["etag"]
+    assert (await client.get("/nessie/balance", headers={**auth_headers, "If-None-Match": tag})).status_code == 304
+
+    r = await client.post("/nessie/transfer", json={"to_account_id": "OTHER", "amount": 250}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    r = await client.get("/nessie/balance", headers={**auth_headers, "If-None-Match": tag})
+    assert r.status_code == 200
+    assert r.json()["balance"] == 750
+
+
+async def test_transfer_credits_the_other_account(client, auth_headers):
+    email = f"user-{uuid.uuid4().hex[:10]}@example.com"
+    await client.post("/auth/register", json={"email": email, "password": "secret123", "address": ADDRESS})
+    other = await _login(client, email)
+    other_account = (await client.get("/nessie/balance", headers=other)).json()["account_id"]
+
+    r = await client.post("/nessie/transfer", json={"to_account_id": other_account, "amount": 40.5}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    assert (await client.get("/nessie/balance", headers=other)).json()["balance"] == 1040.5
+    assert (await client.post("/nessie/transfer", json={"to_account_id": other_account, "amount": -1}, headers=auth_headers)).status_code == 400
+
+
+async def test_bulk_import_pages_and_export(client, auth_headers):
+    body = b"".join(b'{"amount": %d, "description": "row %d", "created_at": "2025-01-%02dT12:00:00"}\n' % (i, i, i) for i in range(1, 8))
+    r = await client.post("/nessie/transactions/bulk", content=body, headers={**auth_headers, **NDJSON})
+    assert r.status_code == 200, r.text
+    assert r.json()["inserted"] == 7
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        page = (await client.get("/nessie/transactions", params=params, headers=auth_headers)).json()
+        seen += [t["description"] for t in page["transactions"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    # newest first: the initial balance (written at registration), then the backdated rows
+    assert seen[1:] == [f"row {i}" for i in range(7, 0, -1)]
+    assert len(seen) == len(set(seen)) == 8
+    assert (await client.get("/nessie/transactions", params={"cursor": "garbage"}, headers=auth_headers)).status_code == 400
+
+    r = await client.get("/nessie/transactions/export", params={"format": "csv"}, headers=auth_headers)
+    assert r.status_code == 200
+    assert len(r.text.strip().splitlines()) == 9  # header + 8 rows
+
+
+async def test_trade_updates_cash_and_portfolio(client, auth_headers, btc_at_60000):
+    r = await client.post("/gemini/trade", json={"symbol": "BTCUSD", "side": "BUY", "amount_usd": 600}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    assert r.json()["qty"] == pytest.approx(0.01)
+    assert (await client.get("/nessie/balance", headers=auth_headers)).json()["balance"] == 400
+
+    r = await client.post("/gemini/trade", json={"symbol": "BTCUSD", "side": "Sell", "amount_usd": 1200}, headers=auth_headers)
+    assert r.status_code == 400
+    assert (await client.post("/gemini/trade", json={"symbol": "BTCUSD", "side": "hodl", "amount_usd": 1}, headers=auth_headers)).status_code == 422
+
+    portfolio = (await client.get("/gemini/portfolio", headers=auth_headers)).json()
+    [btc] = portfolio["positions"]
+    assert (btc["symbol"], btc["qty"], btc["avg_cost"]) == ("BTCUSD", 0.01, 60000)
+
+
+async def test_advise_and_projections_read_the_ledger(client, auth_headers):
+    body = b'{"amount": 2500, "description": "Payroll"}\n{"amount": -900, "description": "Rent"}\n' * 3
+    assert (await client.post("/nessie/transactions/bulk", content=body, headers={**auth_headers, **NDJSON})).status_code == 200
+
+    r = await client.post("/gemini/advise", json={}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    r2 = await client.post("/gemini/advise", json={}, headers={**auth_headers, "If-None-Match": r.headers["etag"]})
+    assert r2.status_code == 304
+
+    r = await client.post("/gemini/projections", json={"years": 1, "paths": 100, "seed": 1}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    # all in the current month: 3 x (2500 - 900); the initial balance is not income
+    assert r.json()["monthly_contribution"] == 4800
@@ -0,0 +1,43 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app.config import settings
+from app.security import create_access_token, create_stream_token, get_current_user_from_stream_token
+
+pytestmark = pytest.mark.anyio
+
+
+async def _me(client, auth_headers) -> dict:
+    return (await client.get("/auth/me", headers=auth_headers)).json()
+
+
+async def test_stream_token_opens_the_stream_only(client, auth_headers, session):
+    r = await client.post("/nessie/stream/token", headers=auth_headers)
+    assert r.status_code == 200
+    token = r.json()["token"]
+    me = await _me(client, auth_headers)
+
+    user = await get_current_user_from_stream_token(token=token, creds=None, session=session)
+    assert user.email == me["email"]
+    # no use as a bearer token anywhere else
+    assert (await client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})).status_code == 401
+
+
+async def test_access_token_is_refused_in_the_url(client, auth_headers, session):
+    me = await _me(client, auth_headers)
+    access = create_access_token(subject=me["email"])
+    with pytest.raises(HTTPException) as exc:
+        await get_current_user_from_stream_token(token=access, creds=None, session=session)
+    assert exc.value.status_code == 401
+    # from the Authorization header it is still fine
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access)
+    assert (await get_current_user_from_stream_token(token=None, creds=creds, session=session)).email == me["email"]
+
+
+async def test_expired_stream_token(client, auth_headers, session, monkeypatch):
+    me = await _me(client, auth_headers)
+    monkeypatch.setattr(settings, "stream_token_expire_seconds", -1)
+    with pytest.raises(HTTPException) as exc:
+        await get_current_user_from_stream_token(token=create_stream_token(me["email"]), creds=None, session=session)
+    assert exc.value.status_code == 401
@@ -0,0 +1,21 @@
+import httpx
+import pytest
+
+from app import upstream
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_set_transport_closes_the_replaced_client():
+    old = upstream.get_client("nessie")
+    await upstream.set_transport("nessie", httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True})))
+    try:
+        assert old.is_closed
+        client = upstream.get_client("nessie")
+        assert client is not old
+        assert (await client.get("http://nessie.test/accounts")).json() == {"ok": True}
+    finally:
+        await upstream.set_transport("nessie", None)
+    assert client.is_closed
+    assert not upstream.get_client("nessie").is_closed
+    await upstream.shutdown()
@@ -47,6 +47,8 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     // debug container to store and show raw responses for diagnosis
     const debugData = { token, user: null, accounts: null, transactions: null, advise: null };
+    // last /gemini/advise response and its ETag, revalidated on the next poll
+    let lastAdvise = null;
 
     function renderDebug() {
         try {
@@ -448,9 +450,11 @@ document.addEventListener('DOMContentLoaded', async () => {
                 return;
             }
 
+            // revalidate the previous advice: the server answers 304 while it still holds
+            const adviseHeaders = lastAdvise ? { ...headers, 'If-None-Match': lastAdvise.etag } : headers;
             const res = await fetch('http://localhost:8000/gemini/advise', {
                 method: 'POST',
-                headers: headers,
+                headers: adviseHeaders,
                 body: JSON.stringify({
                     total_usd: Math.max(0, currentSavings || 0), // Ensure non-negative
                     monthly_income: Math.max(0, data.monthlyIncome || 0),
@@ -464,9 +468,11 @@ document.addEventListener('DOMContentLoaded', async () => {
                     risk_profile: 'moderado'
                 })
             });
-            if (res.ok) {
+            if (res.ok || (res.status === 304 && lastAdvise)) {
                 setStatus('Recomendaciones recibidas del servidor.', '#0c5460');
-                const advise = await res.json();
+                const advise = res.status === 304 ? lastAdvise.body : await res.json();
+                const etag = res.headers.get('ETag');
+                if (etag) lastAdvise = { etag, body: advise };
                 debugData.advise = advise;
                 renderDebug();
 
@@ -585,10 +591,57 @@ document.addEventListener('DOMContentLoaded', async () => {
     // Load on start
     loadFinancialData();
 
-    // Set up periodic refresh every 30 seconds
-    setInterval(() => {
-        if (document.visibilityState === 'visible') {
-            loadFinancialData();
-        }
-    }, 30000);
+    // Live updates: the backend pushes balance/transaction events over SSE, so we only
+    // reload when something changed. Fall back to polling every 30 seconds if SSE is unavailable.
+    let pollTimer = null;
+    function startPolling() {
+        if (pollTimer) return;
+        pollTimer = setInterval(() => {
+            if (document.visibilityState === 'visible') {
+                loadFinancialData();
+            }
+        }, 30000);
+    }
+
+    if (typeof EventSource === 'undefined') {
+        startPolling();
+    } else {
+        let reloadPending = null;
+        const scheduleReload = () => {
+            // coalesce bursts of events into a single reload
+            if (reloadPending) return;
+            reloadPending = setTimeout(() => { reloadPending = null; loadFinancialData(); }, 300);
+        };
+        let connected = false;
+        const openStream = async () => {
+            // EventSource cannot send headers: it gets a short-lived, stream-only token in the URL
+            // (never the access token), so every (re)connect fetches a fresh one
+            let streamToken;
+            try {
+                const r = await fetch('http://localhost:8000/nessie/stream/token', { method: 'POST', headers });
+                if (!r.ok) throw new Error(`stream token: ${r.status}`);
+                streamToken = (await r.json()).token;
+            } catch (e) {
+                if (!connected) startPolling();
+                else setTimeout(openStream, 3000);
+                return;
+            }
+            const stream = new EventSource(`http://localhost:8000/nessie/stream?token=${encodeURIComponent(streamToken)}`);
+            stream.addEventListener('balance', (ev) => {
+                // the first balance event is the current state we loaded on start; after a
+                // reconnect it may be newer, so reload
+                if (!connected) { connected = true; return; }
+                scheduleReload();
+            });
+            stream.addEventListener('resync', scheduleReload);
+            stream.onerror = () => {
+                // the token in the URL may have expired, so reconnect ourselves with a new one;
+                // if the stream never connected, poll instead
+                stream.close();
+                if (!connected) startPolling();
+                else setTimeout(openStream, 3000);
+            };
+        };
+        openStream();
+    }
 });